@@ -0,0 +1,73 @@
+"""Benchmark parsing the player config of a series with and without js2py.
+
+Usage::
+
+    python benchmarks/player_config.py [--episodes 100 1000 5000] [--repeat 5]
+
+js2py is no longer a dependency, its timings are only shown if it is
+installed.
+"""
+import argparse
+import os
+import sys
+import time
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utility.js_object import parse_object_literal
+
+
+def make_script(episodes: int) -> str:
+    """Make a player script like the one of a series with many episodes.
+
+    Parameters
+    ----------
+    episodes : int
+        Number of episodes of the series.
+
+    Returns
+    -------
+    str
+        Source of the script.
+    """
+    seasons = ',\n'.join(
+        f"{{ title: 'Episode {number} - It\\'s \"{{here}}\"', index: {number}, episode: '{number%20+1}', "
+        f"id_episode: {100000+number}, season: '{number//20+1}', still: 'https://img.example/{number}.jpg' }}"
+        for number in range(episodes))
+    return (
+        "window['show_storage'] = {\n"
+        "    title: 'Synthetic Show', year: 2019, id_show: 7767422,\n"
+        "    hash: 'AbCdEf0123456789_-', expires: 1671341126,\n"
+        f"    seasons: [\n{seasons}\n    ],\n"
+        "    poster_medium: 'https://img.example/poster.jpg'\n"
+        "};"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--episodes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    try:
+        import js2py
+    except ImportError:
+        js2py = None
+        print('js2py is not installed, only timing parse_object_literal')
+    else:
+        print(f'import js2py: {(time.perf_counter()-start)*1000:.0f} ms')
+    for episodes in args.episodes:
+        script = make_script(episodes)
+        assert len(parse_object_literal(script)['seasons']) == episodes
+        fast = min(timeit.repeat(lambda: parse_object_literal(script), number=1, repeat=args.repeat))
+        line = f'{episodes:>6} episodes: parse_object_literal {fast*1000:9.2f} ms'
+        if js2py is not None:
+            slow = min(timeit.repeat(lambda: js2py.eval_js(script).to_dict(), number=1, repeat=args.repeat))
+            line += f' | js2py {slow*1000:9.2f} ms | {slow/fast:6.1f}x faster'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
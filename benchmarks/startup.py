@@ -0,0 +1,62 @@
+"""Benchmark the time to import the entry point, before the prompt shows.
+
+Usage::
+
+    python benchmarks/startup.py [--repeat 5] [--budget 250]
+
+Every run imports ``moviesNseries`` in a fresh interpreter. The script exits
+with status 1 if the fastest run is over the budget, in milliseconds, or if
+a module that should only be imported when needed is loaded at startup.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that must not be imported before the prompt shows.
+DEFERRED_MODULES = ('aiohttp', 'bs4', 'Crypto', 'requests', 'selenium', 'tmdbsimple', 'tqdm',
+                    'webdriver_manager')
+# Imports the entry point and prints the time it took and the deferred
+# modules that were loaded anyway.
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import moviesNseries
+elapsed = time.perf_counter()-start
+print(json.dumps([elapsed, sorted(name for name in {deferred!r} if name in sys.modules)]))
+'''
+
+
+def measure() -> tuple[float, list[str]]:
+    """Import the entry point in a fresh interpreter.
+
+    Returns
+    -------
+    tuple[float, list[str]]
+        Seconds the import took, and the deferred modules it loaded.
+    """
+    result = subprocess.run([sys.executable, '-c', PROBE.format(deferred=DEFERRED_MODULES)], cwd=ROOT,
+                            stdin=subprocess.DEVNULL, capture_output=True, text=True, check=True)
+    elapsed, loaded = json.loads(result.stdout.splitlines()[-1])
+    return elapsed, loaded
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=250, help='milliseconds')
+    args = parser.parse_args()
+    runs = [measure() for _ in range(args.repeat)]
+    fastest = min(elapsed for elapsed, _ in runs)*1000
+    loaded = sorted({name for _, names in runs for name in names})
+    print(f'import moviesNseries: {fastest:.0f} ms (budget {args.budget:.0f} ms)')
+    if loaded:
+        print(f'imported at startup: {", ".join(loaded)}')
+    if fastest > args.budget or loaded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,44 @@
-import json
+import argparse
+import functools
 import os
 import re
-import subprocess
+import threading
+from collections.abc import Callable
 
-import requests
 from prompt_toolkit import print_formatted_text, prompt
+from prompt_toolkit.application import Application, get_app
 from prompt_toolkit.formatted_text import HTML
-from prompt_toolkit.key_binding import KeyBindings
-from prompt_toolkit.shortcuts import (checkboxlist_dialog, message_dialog,
-                                      radiolist_dialog, set_title)
+from prompt_toolkit.key_binding import KeyBindings, merge_key_bindings
+from prompt_toolkit.key_binding.bindings.focus import (focus_next,
+                                                       focus_previous)
+from prompt_toolkit.key_binding.defaults import load_key_bindings
+from prompt_toolkit.layout import HSplit, Layout
+from prompt_toolkit.shortcuts import (checkboxlist_dialog, clear,
+                                      message_dialog, set_title)
 from prompt_toolkit.styles import Style
 from prompt_toolkit.validation import Validator
-
-from providers.lookmovie import Lookmovie
-from utility.content import Episode, Movie, Series
-from utility.m3u8_downloader import start_download
+from prompt_toolkit.widgets import Button, Dialog, Label, RadioList
+
+from providers.registry import registry
+from utility import integrity, ratelimit
+from utility.batch import (DEFAULT_PARALLEL_JOBS, BatchJob, JobFileError,
+                           load_jobs, run_batch, run_job)
+from utility.config import Config, ConfigError, load_config
+from utility.content import Episode, Movie, Series, fetch_synopses
+from utility.daemon import DEFAULT_PORT, DEFAULT_WORKERS, Daemon
+from utility.resolver import StreamResolver
+from utility.retry import SegmentError, TokenExpiredError
+from utility.scheduler import DownloadJob, DownloadScheduler
 from utility.search_suggestions import SearchAutocompletor
+from utility.title_index import title_index
 
-set_title('moviesNseries | v1.0 (beta)')
-
-
-if os.name == 'nt':
-    os.system('cls')
-else:
-    os.system('clear')
+# Modules that download, search providers or talk to TMDB are imported
+# where they are first needed, so that the prompt shows without waiting for
+# requests, selenium, tqdm or aiohttp to load.
 
+config: Config | None = None
+# Whether the shared session was configured, see ``configure_session``.
+session_configured = False
 
 logo = r"""
                       _            _   _               _           
@@ -61,12 +75,6 @@ dialog_style = Style.from_dict({
 })
 
 
-print_formatted_text(
-    HTML(f'<logo>{logo}</logo>'),
-    style=style
-)
-
-
 kb = KeyBindings()
 
 
@@ -89,127 +97,245 @@ validator = Validator.from_callable(
 )
 
 
-def download_content(content: Movie | Series) -> None:
+def download_subtitle(url: str, file_name: str, name: str, priority: str = ratelimit.DEFAULT_PRIORITY) -> None:
+    """Download a subtitle.
+
+    It counts against the global bandwidth and request rate limits like the
+    segments of the download.
+
+    Parameters
+    ----------
+    url : str
+        Url of the subtitle.
+    file_name : str
+        Path of the ``.vtt`` file.
+    name : str
+        Name of the movie or episode, used in messages.
+    priority : str, optional
+        Priority class of the download, by default
+        ratelimit.DEFAULT_PRIORITY
+    """
+    from utility import session
+    try:
+        resp = session.get(url, priority=priority, stream=True)
+        resp.raise_for_status()
+        with open(file_name, 'wb') as f_subtitle:
+            for chunk in resp.iter_content(chunk_size=1024):
+                ratelimit.bandwidth.consume(len(chunk), priority)
+                f_subtitle.write(chunk)
+        print_formatted_text(
+            HTML(f'<info>Subtitle downloaded for {name}</info>'),
+            style=style
+        )
+    except Exception:
+        print_formatted_text(
+            HTML(f'<error>Could not download subtitle for {name}!</error>'),
+            style=style
+        )
+
+
+def get_engine() -> Callable:
+    """Get the ``start_download`` function of the configured download engine.
+
+    Returns
+    -------
+    Callable
+        ``start_download`` of ``utility.async_downloader`` or
+        ``utility.m3u8_downloader``.
+    """
+    if config.download_engine == 'async':
+        from utility import async_downloader
+        async_downloader.connections_per_host = config.connections_per_host
+        return async_downloader.start_download
+    from utility.m3u8_downloader import start_download
+    return start_download
+
+
+def configure_session() -> None:
+    """Configure the shared session from the config, once.
+
+    Configuring it again would replace its connection pools and drop the
+    connections kept alive.
+    """
+    global session_configured
+    if session_configured:
+        return
+    session_configured = True
+    from utility import session
+    session.configure(
+        pool_size=max(config.download_window*config.parallel_downloads, session.DEFAULT_POOL_SIZE),
+        request_timeout=config.request_timeout,
+        retries=config.request_retries
+    )
+
+
+def warm_up() -> None:
+    """Load the title index and the providers while the query is typed."""
+    title_index.load()
+    registry.discover()
+
+
+def download_item(resolver: StreamResolver, item: Movie | Episode, file_name: str, name: str,
+                  on_state: Callable[[str], None] | None = None,
+                  priority: str = ratelimit.DEFAULT_PRIORITY) -> bool:
+    """Resolve the link of a movie or an episode and download its subtitle and stream.
+
+    The link is resolved right before the download so that it is still
+    valid when the download starts. If it can't be resolved, or the server
+    refuses it during the download, the hash is refreshed and only this
+    item is resolved again, up to three times.
+
+    Parameters
+    ----------
+    resolver : StreamResolver
+        Resolver of the content the item belongs to.
+    item : Movie | Episode
+        The movie or episode to download.
+    file_name : str
+        Path of the output file, without extension.
+    name : str
+        Name of the movie or episode, used in messages.
+    on_state : Callable[[str], None] | None, optional
+        Called with ``downloading`` when the stream starts downloading and
+        ``remuxing`` when it starts being converted, by default None
+    priority : str, optional
+        Priority class of the download, by default
+        ratelimit.DEFAULT_PRIORITY
+
+    Returns
+    -------
+    bool
+        True if the item was downloaded.
+    """
+    refresh = False
+    subtitle_downloaded = False
+    for attempt in range(3):
+        success = resolver.resolve(item, refresh)
+        if success is not None:
+            print_formatted_text(
+                HTML('<error>Failed to get m3u8 and subtitle of {}! {}</error>').format(name, success[1]),
+                style=style
+            )
+            refresh = True
+            continue
+        if not subtitle_downloaded:
+            print_formatted_text(
+                HTML(f'<loading>Downloading {name}</loading>'),
+                style=style
+            )
+            download_subtitle(item.subtitle, file_name+'.vtt', name, priority)
+            subtitle_downloaded = True
+        if on_state is not None:
+            on_state('downloading')
+        try:
+            get_engine()(
+                m3u8=item.m3u8,
+                file_name=file_name,
+                window=config.download_window,
+                adaptive=config.adaptive_concurrency,
+                quality=resolver.quality,
+                stream_remux=config.stream_remux,
+                on_remux=functools.partial(on_state, 'remuxing') if on_state is not None else None,
+                priority=priority
+            )
+            print_formatted_text(
+                HTML(f'<info>Download complete for {name}!</info>'),
+                style=style
+            )
+            return True
+        except TokenExpiredError:
+            refresh = True
+        except SegmentError as e:
+            print_formatted_text(
+                HTML('<error>Failed to download {}! {}</error>').format(name, str(e)),
+                style=style
+            )
+            return False
+    print_formatted_text(
+        HTML(f'<error>Failed to download {name}!</error>'),
+        style=style
+    )
+    return False
+
+
+def download_content(content: Movie | Series, quality: int | None = None,
+                     on_state: Callable[[str], None] | None = None,
+                     priority: str = ratelimit.DEFAULT_PRIORITY) -> list[DownloadJob]:
     """Download the content from the provider.
 
+    Episodes are downloaded several at once, earlier episodes first, while
+    the segments in flight and the download rate are limited across all of
+    them. The link of every episode is resolved right before it is
+    downloaded, and the hash of the content is refreshed in the background
+    before it expires.
+
     Parameters
     ----------
     content : Movie | Series
         The content to download.
+    quality : int | None, optional
+        Wanted quality, by default None for the quality of the config
+    on_state : Callable[[str], None] | None, optional
+        Called with ``downloading`` and ``remuxing`` as the items get there,
+        by default None
+    priority : str, optional
+        Priority class of the downloads. Interactive downloads get most of
+        the bandwidth when limited, while batch downloads get what they
+        leave, by default ratelimit.DEFAULT_PRIORITY
+
+    Returns
+    -------
+    list[DownloadJob]
+        A job for the movie or for every episode, whose ``result`` is True
+        if it was downloaded.
     """
-    os.chdir('Downloads')
+    from utility.m3u8_downloader import ffmpeg_available
+    if not ffmpeg_available():
+        print_formatted_text(
+            HTML('<warning>FFmpeg not found! Final file won\'t be converted to mp4</warning>'),
+            style=style
+        )
     print_formatted_text(
         HTML(f'<info>Working on <u>{content.title}</u></info>'),
         style=style
     )
     content.title = re.sub(re.compile(r'[\\/*?:"<>|]'), '', content.title)
-    if not os.path.exists(content.title):
-        os.mkdir(content.title)
-    os.chdir(content.title)
+    folder = os.path.join('Downloads', content.title)
+    os.makedirs(folder, exist_ok=True)
+    resolver = StreamResolver(content, quality or config.download_quality)
+    scheduler = DownloadScheduler(config.parallel_downloads)
     if isinstance(content, Movie):
-        with open(f'{content.title}.vtt', 'wb') as f_subtitle:
-            try:
-                resp = requests.get(content.subtitle, stream=True)
-                resp.raise_for_status()
-                print_formatted_text(
-                    HTML(f'<loading>Downloading subtitle</loading>'),
-                    style=style
-                )
-                for chunk in resp.iter_content(chunk_size=1024):
-                    f_subtitle.write(chunk)
-                print_formatted_text(
-                    HTML(f'<info>Subtitle downloaded</info>'),
-                    style=style
-                )
-            except Exception:
-                print_formatted_text(
-                    HTML(
-                        f'<error>Could not download subtitle for {content.title}!</error>'),
-                    style=style
-                )
+        scheduler.add(content.title, functools.partial(
+            download_item, resolver, content, os.path.join(folder, content.title), content.title, on_state, priority))
+    else:
+        for season in content.seasons:
+            season_folder = os.path.join(folder, f'Season {season}')
+            os.makedirs(season_folder, exist_ok=True)
+            for episode in content.seasons[season]:
+                name = f'Season {season} Episode {episode.number}'
+                file_name = os.path.join(season_folder, re.sub(re.compile(r'[\\/*?:"<>|]'), '', episode.title))
+                # Earlier episodes start first, so they can be watched first.
+                scheduler.add(name, functools.partial(download_item, resolver, episode, file_name, name, on_state,
+                                                    priority),
+                              priority=len(scheduler.jobs))
+    resolver.start()
+    try:
+        jobs = scheduler.run()
+    except KeyboardInterrupt:
         print_formatted_text(
-            HTML(f'<loading>Downloading m3u8</loading>'),
+            HTML('<error>Download interrupted.</error>'),
             style=style
         )
-        while True:
-            try:
-                start_download(
-                    m3u8=content.m3u8,
-                    file_name=content.title
-                )
-                print_formatted_text(
-                    HTML(f'<info>Download complete!</info>'),
-                    style=style
-                )
-                break
-            except ValueError:
-                success = content.provider.set_m3u8_n_subtitle(content, quality)
-                if success == False:
-                    print_formatted_text(
-                        HTML('<error>Failed to download!</error>'),
-                        style=style
-                    )
-                    break
-        os.chdir('..')
-    else:
-        for season in content.seasons:
+        exit()
+    finally:
+        resolver.stop()
+    for job in jobs:
+        if job.error is not None:
             print_formatted_text(
-                HTML(f'<info>Working on <u>Season {season}</u></info>'),
+                HTML('<error>Failed to download {}! {}</error>').format(job.name, str(job.error)),
                 style=style
             )
-            if not os.path.exists(f'Season {season}'):
-                os.mkdir(f'Season {season}')
-            os.chdir(f'Season {season}')
-            for episode in content.seasons[season]:
-                print_formatted_text(
-                    HTML(f'<info>Working on <u>Episode {episode.number}</u></info>'),
-                    style=style
-                )
-                with open(f'{episode.title}.vtt', 'wb') as f_subtitle:
-                    try:
-                        resp = requests.get(episode.subtitle, stream=True)
-                        resp.raise_for_status()
-                        print_formatted_text(
-                            HTML(f'<loading>Downloading subtitle</loading>'),
-                            style=style
-                        )
-                        for chunk in resp.iter_content(chunk_size=1024):
-                            f_subtitle.write(chunk)
-                        print_formatted_text(
-                            HTML(f'<info>Subtitle downloaded</info>'),
-                            style=style
-                        )
-                    except Exception:
-                        print_formatted_text(
-                            HTML(
-                                f'<error>Could not download subtitle for Episode {episode.number}!</error>'),
-                            style=style
-                        )
-                print_formatted_text(
-                    HTML(f'<loading>Downloading Episode {episode.number}</loading>'),
-                    style=style
-                )
-                while True:
-                    try:
-                        start_download(
-                            m3u8=episode.m3u8,
-                            file_name=re.sub(re.compile(r'[\\/*?:"<>|]'), '', episode.title)
-                        )
-                        print_formatted_text(
-                            HTML(f'<info>Download complete!</info>'),
-                            style=style
-                        )
-                        break
-                    except ValueError:
-                        success = content.provider.set_m3u8_n_subtitle(content, quality)
-                        if success == False:
-                            print_formatted_text(
-                                HTML('<error>Failed to download!</error>'),
-                                style=style
-                            )
-                            break
-            os.chdir('..')
-    os.chdir('..')
+    return jobs
 
 
 def get_download_choice(seasons: dict[int, list[Episode]]) -> dict[int, list[Episode]] | None:
@@ -280,7 +406,6 @@ def get_query() -> str:
     return prompt(
         HTML('<prompt>Enter the name of a movie or series: </prompt>'),
         completer=SearchAutocompletor(),
-        complete_in_thread=True,
         validator=validator,
         key_bindings=kb,
         style=style
@@ -290,6 +415,9 @@ def get_query() -> str:
 def get_choice(results: list[Movie | Series]) -> int | None:
     """Get the user's choice from the list of results.
 
+    The synopsis of the highlighted result is shown below the list. The
+    dialog is shown at once and synopses appear as they are fetched.
+
     Parameters
     ----------
     results : list[Movie | Series]
@@ -300,68 +428,85 @@ def get_choice(results: list[Movie | Series]) -> int | None:
     int | None
         The index of the user's choice, or None if the user cancelled.
     """
-    dialog = radiolist_dialog(
-        title='Select a movie or series',
+    radio_list = RadioList(
         values=[
             (
                 result[0],
                 f'{result[1].title} | {result[1].year} | {result[1].provider.name}'
             ) for result in enumerate(results)
+        ]
+    )
+    synopsis = Label(
+        # The RadioList has no public attribute for the highlighted entry.
+        text=lambda: results[radio_list._selected_index].synopsis or 'Loading synopsis...',
+        dont_extend_height=True
+    )
+    dialog = Dialog(
+        title='Select a movie or series',
+        body=HSplit([radio_list, synopsis], padding=1),
+        buttons=[
+            Button(text='Select', handler=lambda: get_app().exit(result=radio_list.current_value)),
+            Button(text='Cancel', handler=lambda: get_app().exit(result=None)),
         ],
-        ok_text='Select',
-        cancel_text='Cancel',
+        with_background=True,
+    )
+    focus = KeyBindings()
+    focus.add('tab')(focus_next)
+    focus.add('s-tab')(focus_previous)
+    app = Application(
+        layout=Layout(dialog),
+        key_bindings=merge_key_bindings([load_key_bindings(), focus, kb]),
+        mouse_support=True,
         style=dialog_style,
+        full_screen=True,
     )
-    dialog.mouse_support = True
-    dialog.key_bindings = kb
-    return dialog.run()
+    futures = fetch_synopses(results, lambda _: app.invalidate())
+    try:
+        return app.run()
+    finally:
+        # Synopses not fetched yet aren't needed anymore.
+        for future in futures:
+            future.cancel()
 
 
-def main() -> None:
-    """Main function.
-
-    Returns
-    -------
-    None
-    """
+def setup() -> None:
+    """Load the config and apply its download limits, exiting if it is invalid."""
+    global config
     if not os.path.exists('Downloads'):
         os.mkdir('Downloads')
-    global quality
     try:
-        with open("Config.json") as config_file:
-            config = json.load(config_file)
-            quality = int(config['download_quality'])
-            assert quality in [1080, 720, 480]
-    except FileNotFoundError:
-        print_formatted_text(
-            HTML('<error>Config.json not found!</error>'),
-            style=style
-        )
-        exit()
-    except AssertionError:
-        print_formatted_text(
-            HTML('<error>Invalid download quality! Valid Options- 1080, 720, 480</error>'),
-            style=style
-        )
-        exit()
-    except ValueError:
+        config = load_config()
+    except ConfigError as e:
         print_formatted_text(
-            HTML('<error>Invalid download quality! Valid Options- 1080, 720, 480</error>'),
+            HTML('<error>{}</error>').format(str(e)),
             style=style
         )
         exit()
-    try:
-        subprocess.run("ffmpeg", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        os.environ['FFMPEG'] = '1'
-    except FileNotFoundError:
-        print_formatted_text(
-            HTML('<warning>FFmpeg not found! Final file won\'t be converted to mp4</warning>'),
-            style=style
-        )
-        os.environ['FFMPEG'] = '0'
+    ratelimit.configure(
+        max_segments=config.max_segments_in_flight,
+        max_bytes_per_second=config.max_bytes_per_second,
+        max_requests_per_second=config.max_requests_per_second
+    )
+    integrity.configure(verify=config.verify_segments, hash=config.hash_segments)
+
+
+def select_content() -> Movie | Series | None:
+    """Search, and let the user choose a movie or series and its episodes.
+
+    Returns
+    -------
+    Movie | Series | None
+        The content, with only the chosen episodes of a series, or None if
+        the user cancelled a dialog.
+    """
     while True:
         query = get_query()
-        results = Lookmovie.search(query)
+        # Both only run on the first search.
+        configure_session()
+        registry.discover()
+        results = registry.search(query)
+        for result in results:
+            title_index.add(result.title)
         if len(results) == 0:
             message_dialog(
                 title='No results found',
@@ -373,50 +518,223 @@ def main() -> None:
             break
     choice = get_choice(results)
     if choice is None:
-        main()
-    else:
-        success = results[choice].provider.update_info(results[choice])
-        if success == False:
+        return None
+    content = results[choice]
+    success = content.provider.update_info(content)
+    if success == False:
+        print_formatted_text(
+            HTML('<error>Failed to get series info!</error>'),
+            style=style
+        )
+        exit()
+    if isinstance(content, Series):
+        print()
+        download_choice = get_download_choice(content.seasons)
+        if download_choice is None or download_choice == []:
+            return None
+        # Update the seasons with the user's choice
+        content.seasons = download_choice
+    return content
+
+
+def main() -> None:
+    """Main function.
+
+    Returns
+    -------
+    None
+    """
+    setup()
+    threading.Thread(target=warm_up, daemon=True).start()
+    while True:
+        # A cancelled dialog starts over with a new search.
+        content = select_content()
+        if content is not None:
+            break
+    download_content(content)
+
+
+def batch(job_file: str, report_file: str, parallel_jobs: int = DEFAULT_PARALLEL_JOBS) -> None:
+    """Download the movies and series of a job file without any prompt.
+
+    Parameters
+    ----------
+    job_file : str
+        Path of the JSON lines or TOML job file.
+    report_file : str
+        Path of the JSON report, written as jobs finish.
+    parallel_jobs : int, optional
+        Number of jobs running at the same time, by default
+        DEFAULT_PARALLEL_JOBS
+    """
+    setup()
+    try:
+        jobs = load_jobs(job_file)
+    except JobFileError as e:
+        print_formatted_text(
+            HTML('<error>{}</error>').format(str(e)),
+            style=style
+        )
+        exit(1)
+    configure_session()
+    registry.discover()
+    try:
+        entries = run_batch(jobs, registry.search, download_content, report_file, parallel_jobs)
+    except KeyboardInterrupt:
+        print_formatted_text(
+            HTML('<error>Batch interrupted. The report has the jobs that finished.</error>'),
+            style=style
+        )
+        exit(1)
+    done = sum(entry['status'] == 'done' for entry in entries)
+    print_formatted_text(
+        HTML('<info>{} of {} jobs done, report written to {}</info>').format(done, len(entries), report_file),
+        style=style
+    )
+    if done < len(entries):
+        exit(1)
+
+
+def verify(paths: list[str]) -> None:
+    """Check the ``.ts`` files of unfinished downloads against their manifests.
+
+    Nothing is downloaded. Downloading a title again replaces only its bad
+    segments.
+
+    Parameters
+    ----------
+    paths : list[str]
+        ``.ts`` files, or folders searched for them.
+    """
+    setup()
+    integrity.configure(verify=True, hash=config.hash_segments)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith('.ts'))
+        else:
+            files.append(path)
+    bad_files = 0
+    for file_name in files:
+        if not os.path.exists(file_name+'.manifest'):
             print_formatted_text(
-                HTML('<error>Failed to get series info!</error>'),
+                HTML('<warning>{}: no manifest, skipped</warning>').format(file_name),
                 style=style
             )
-            exit()
-        else:
-            if isinstance(results[choice], Series):
-                print()
-                while True:
-                    download_choice = get_download_choice(
-                        results[choice].seasons)
-                    # Update the seasons with the user's choice
-                    results[choice].seasons = download_choice
-                    if download_choice is None or download_choice == []:
-                        main()
-                    else:
-                        break
-            # Try three times to get the m3u8 and subtitle before exiting.
-            for i in range(3):
-                success = Lookmovie.set_m3u8_n_subtitle(results[choice], quality)
-                if success is not None:
-                    print_formatted_text(
-                        HTML(f'<error>Failed to get m3u8 and subtitle! {success[1]}</error>'),
-                        style=style
-                    )
-                    print_formatted_text(
-                        HTML('<info>Trying again...</info>'),
-                        style=style
-                    )
-                    Lookmovie.update_info(results[choice])
-                else:
-                    download_content(results[choice])
-                    break
-            else: exit()
-                # for season in download_choice:
-                    # for episode in download_choice[season]:
-                        # print(episode.title, episode.m3u8, episode.subtitle)
-                # print(results[choice].title, results[choice].m3u8, results[choice].subtitle)
+            continue
+        bad = integrity.verify_file(file_name)
+        if not bad:
+            print_formatted_text(HTML('<info>{}: OK</info>').format(file_name), style=style)
+            continue
+        bad_files += 1
+        print_formatted_text(
+            HTML('<error>{}: {} bad segment(s)</error>').format(file_name, len(bad)),
+            style=style
+        )
+        for index, reason in bad.items():
+            print_formatted_text(HTML('<error>  segment {}: {}</error>').format(index, reason), style=style)
+    if bad_files:
+        print_formatted_text(
+            HTML('<info>Download these titles again to fetch only their bad segments.</info>'),
+            style=style
+        )
+        exit(1)
+
+
+def setup_worker() -> None:
+    """Prepare a worker process of the service to run jobs."""
+    setup()
+    configure_session()
+    registry.discover()
 
 
+def run_service_job(values: dict, on_state: Callable[[str], None]) -> dict:
+    """Run a job of the service in a worker process.
+
+    Parameters
+    ----------
+    values : dict
+        The job, as an entry of a job file.
+    on_state : Callable[[str], None]
+        Called with the new state of the job as it goes on.
+
+    Returns
+    -------
+    dict
+        Report entry of the job, see ``utility.batch.run_job``.
+    """
+    return run_job(BatchJob.from_dict(values, 'job'), registry.search, download_content, on_state)
+
+
+def serve(workers: int = DEFAULT_WORKERS, port: int = DEFAULT_PORT) -> None:
+    """Download the jobs submitted to a local HTTP API until interrupted.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of worker processes, by default DEFAULT_WORKERS
+    port : int, optional
+        Port of the API, by default DEFAULT_PORT
+    """
+    setup()
+    daemon = Daemon(run_service_job, setup_worker, workers, port, limits={
+        'max_segments_in_flight': config.max_segments_in_flight,
+        'max_bytes_per_second': config.max_bytes_per_second,
+        'max_requests_per_second': config.max_requests_per_second,
+    })
+    print_formatted_text(
+        HTML('<info>Serving on http://127.0.0.1:{} with {} workers, press Ctrl+C to stop</info>').format(
+            port, workers),
+        style=style
+    )
+    try:
+        daemon.serve_forever()
+    except OSError as e:
+        print_formatted_text(
+            HTML('<error>Could not serve on port {}! {}</error>').format(port, e.strerror or str(e)),
+            style=style
+        )
+        exit(1)
+    except KeyboardInterrupt:
+        print_formatted_text(
+            HTML('<info>Stopped. Running jobs will resume on the next start.</info>'),
+            style=style
+        )
+
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Download movies and series.')
+    parser.add_argument('--batch', metavar='JOB_FILE',
+                        help='download the titles of a JSON lines or TOML job file without prompts')
+    parser.add_argument('--report', default='report.json', help='path of the batch report (default: %(default)s)')
+    parser.add_argument('--parallel-jobs', type=int, default=DEFAULT_PARALLEL_JOBS,
+                        help='titles downloaded at the same time in batch mode (default: %(default)s)')
+    parser.add_argument('--serve', action='store_true',
+                        help='run as a service downloading the jobs submitted to a local HTTP API')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='worker processes of the service (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help='port of the API of the service (default: %(default)s)')
+    parser.add_argument('--verify', nargs='+', metavar='PATH',
+                        help='check the .ts files of unfinished downloads, or the folders holding them, for bad '
+                             'segments')
+    args = parser.parse_args()
+    if args.verify is not None:
+        verify(args.verify)
+    elif args.serve:
+        if args.workers < 1:
+            parser.error('--workers must be at least 1')
+        serve(args.workers, args.port)
+    elif args.batch is not None:
+        if args.parallel_jobs < 1:
+            parser.error('--parallel-jobs must be at least 1')
+        batch(args.batch, args.report, args.parallel_jobs)
+    else:
+        set_title('moviesNseries | v1.0 (beta)')
+        clear()
+        print_formatted_text(
+            HTML(f'<logo>{logo}</logo>'),
+            style=style
+        )
+        main()
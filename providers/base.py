@@ -0,0 +1,124 @@
+from utility.content import Episode, Movie, Series
+
+
+class ProviderError(Exception):
+    """Raised when a provider can't be reached or returns no usable answer."""
+
+
+class Provider:
+    """Base class for providers.
+
+    A provider is a class with only class methods, as it holds no state of
+    its own. Subclasses set ``name`` and implement every method, and are
+    added to the registry with ``providers.registry.register``.
+
+    Attributes
+    ----------
+    name : str
+        Name of the provider.
+
+    Methods
+    -------
+    search(query: str) -> list[Movie | Series]
+        Search for movies and series.
+    update_info(content: Movie | Series) -> None | bool
+        Update the info of the content.
+    refresh_hash(content: Movie | Series) -> bool
+        Get a new hash and expiry for the stream links of the content.
+    resolve_episode(content: Series, episode: Episode, quality: int) -> None | tuple[bool, str]
+        Set the m3u8 link and subtitle of an episode.
+    set_m3u8_n_subtitle(content: Movie | Series, quality: int) -> None | tuple[bool, str]
+        Set the m3u8 link and subtitle of the content.
+    """
+    name = ''
+
+    @classmethod
+    def search(cls, query: str) -> list[Movie | Series]:
+        """Search for movies and series.
+
+        Parameters
+        ----------
+        query : str
+            Query to search for.
+
+        Returns
+        -------
+        list[Movie | Series]
+            List of movies and series, with this provider as their provider.
+
+        Raises
+        ------
+        ProviderError
+            If the search failed, as opposed to finding nothing.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def update_info(cls, content: Movie | Series) -> None | bool:
+        """Update the info of the content.
+
+        Parameters
+        ----------
+        content : Movie | Series
+            Content found by this provider.
+
+        Returns
+        -------
+        None | bool
+            None if the info was updated, False if it couldn't be.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def refresh_hash(cls, content: Movie | Series) -> bool:
+        """Get a new hash and expiry for the stream links of the content.
+
+        Parameters
+        ----------
+        content : Movie | Series
+            Content whose info was updated.
+
+        Returns
+        -------
+        bool
+            True if the hash was refreshed.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def resolve_episode(cls, content: Series, episode: Episode, quality: int) -> None | tuple[bool, str]:
+        """Set the m3u8 link and subtitle of an episode.
+
+        Parameters
+        ----------
+        content : Series
+            Series the episode belongs to.
+        episode : Episode
+            The episode.
+        quality : int
+            Wanted quality of the stream.
+
+        Returns
+        -------
+        None | tuple[bool, str]
+            None if the episode was resolved, else False and the error message.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def set_m3u8_n_subtitle(cls, content: Movie | Series, quality: int) -> None | tuple[bool, str]:
+        """Set the m3u8 link and subtitle of the content.
+
+        Parameters
+        ----------
+        content : Movie | Series
+            The movie, or the series with the episodes to resolve.
+        quality : int
+            Wanted quality of the stream.
+
+        Returns
+        -------
+        None | tuple[bool, str]
+            None if the content was resolved, else False and the error message.
+        """
+        raise NotImplementedError
@@ -1,8 +1,7 @@
+import concurrent.futures
 import os
-import time
 from urllib.parse import urlparse
 
-import js2py
 import requests
 
 if __name__ == '__main__':
@@ -11,15 +10,23 @@ if __name__ == '__main__':
 import logging
 
 from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.chrome.options import Options as ChromeOptions
-from selenium.webdriver.chrome.service import Service as ChromeService
 from selenium.webdriver.common.by import By
 from selenium.webdriver.remote.remote_connection import LOGGER
-from webdriver_manager.chrome import ChromeDriverManager
+from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.remote.webelement import WebElement
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 
+from providers.base import Provider, ProviderError
+from providers.registry import register
+from utility import session
+from utility.browser_pool import BrowserPool
+from utility.cache import MetadataCache, TTLCache
 from utility.content import Episode, Movie, Series
+from utility.js_object import JSParseError, parse_object_literal
+from utility.metrics import metrics
 from utility.print_progress import print_progress
 
 options = ChromeOptions()
@@ -28,8 +35,52 @@ options.add_experimental_option('excludeSwitches', ['enable-logging'])
 os.environ['WDM_PROGRESS_BAR'] = '0'
 os.environ['WDM_LOG'] = str(logging.NOTSET)
 
+# Seconds to wait for an element of the player page.
+PAGE_TIMEOUT = 5
+# CSS selector of the inline script holding the player config.
+PLAYER_SCRIPT_SELECTOR = '#app > script:nth-child(2)'
+# Status codes of the challenge pages shown instead of the player.
+CHALLENGE_STATUS_CODES = (403, 429, 503)
+# Text of a challenge page. Only looked for when the player config can't be
+# read, as the player page may load a captcha script too.
+CHALLENGE_MARKER = 'recaptcha'
+# Seconds to wait for each search endpoint.
+SEARCH_TIMEOUT = 10
+# Seconds the results of a search are reused for.
+SEARCH_CACHE_TTL = 600
 
-class Lookmovie:
+browser_pool = BrowserPool(options)
+metadata_cache = MetadataCache()
+# Results of recent searches, by endpoint and normalized query.
+search_cache = TTLCache(maxsize=128, ttl=SEARCH_CACHE_TTL)
+
+
+def wait_for_element(driver: WebDriver, css_selector: str, timeout: float = PAGE_TIMEOUT) -> WebElement | None:
+    """Wait for an element of the page to be present.
+
+    Parameters
+    ----------
+    driver : WebDriver
+        Browser showing the page.
+    css_selector : str
+        CSS selector of the element.
+    timeout : float, optional
+        Seconds to wait, by default PAGE_TIMEOUT
+
+    Returns
+    -------
+    WebElement | None
+        The element, None if it didn't appear in time.
+    """
+    try:
+        return WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, css_selector)))
+    except TimeoutException:
+        return None
+
+
+@register
+class Lookmovie(Provider):
     """Class for Lookmovie provider.
 
     Attributes
@@ -53,6 +104,12 @@ class Lookmovie:
         Search for movies and series.
     update_info(content: Movie | Series) -> None | bool
         Update the info of the content.
+    refresh_hash(content: Movie | Series) -> bool
+        Get a new hash and expiry for the stream links of the content.
+    resolve_episode(content: Series, episode: Episode, quality: int) -> None | tuple[bool, str]
+        Set the m3u8 link and subtitle of an episode.
+    set_m3u8_n_subtitle(content: Movie | Series, quality: int) -> None | tuple[bool, str]
+        Set the m3u8 link and subtitle of the content.
 
     Raises
     ------
@@ -68,6 +125,11 @@ class Lookmovie:
     def search(cls, query: str) -> list[Movie | Series]:
         """Search for movies and series.
 
+        Movies and series are searched at the same time. If one search
+        fails, the results of the other are still returned. Results are
+        cached for ``SEARCH_CACHE_TTL`` seconds, so the same query, in any
+        case or spacing, is answered without a request.
+
         Parameters
         ----------
         query : str
@@ -76,30 +138,187 @@ class Lookmovie:
         Returns
         -------
         list[Movie | Series]
-            List of movies and series, empty list if no results or error
+            List of movies and series, empty list if no results
+
+        Raises
+        ------
+        ProviderError
+            If both searches failed.
         """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            movies, series = executor.map(cls._search_endpoint, (cls.movie_search_link, cls.series_search_link),
+                                          (query, query))
+        if movies is None and series is None:
+            raise ProviderError('Lookmovie search failed')
+        # New objects every time, as their info is filled in later.
         search_results = []
+        for title, year, slug in movies or []:
+            search_results.append(Movie(title, year, cls.movie_link+slug, cls))
+        for title, year, slug in series or []:
+            search_results.append(Series(title, year, cls.series_link+slug, cls, {}))
+        return search_results
+
+    @staticmethod
+    def _search_endpoint(link: str, query: str) -> list[tuple[str, int, str]] | None:
+        """Search one endpoint, or get its results from the cache.
+
+        Parameters
+        ----------
+        link : str
+            Link of the endpoint, the query is appended to it.
+        query : str
+            Query to search for.
+
+        Returns
+        -------
+        list[tuple[str, int, str]] | None
+            Title, year and slug of every result, None if the search failed.
+        """
+        query = ' '.join(query.split())
+        key = (link, query.lower())
+        results = search_cache.get(key)
+        if results is not None:
+            metrics.increment('search.cache_hit')
+            return results
         try:
-            resp = requests.get(cls.movie_search_link+query)
-            resp.raise_for_status()
-            movie_search_response = resp.json()
-            resp = requests.get(cls.series_search_link+query)
+            resp = session.get(link+query, timeout=SEARCH_TIMEOUT)
             resp.raise_for_status()
-            series_search_response = resp.json()
-        except requests.exceptions.HTTPError:
-            return search_results
-        for movie in movie_search_response['result']:
-            search_results.append(
-                Movie(movie['title'], int(movie['year']), cls.movie_link+movie['slug'], cls))
-        for series in series_search_response['result']:
-            search_results.append(
-                Series(series['title'], int(series['year']), cls.series_link+series['slug'], cls, {}))
-        return search_results
+            items = resp.json()['result']
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            metrics.increment('search.error')
+            return None
+        results = []
+        for item in items:
+            try:
+                results.append((item['title'], int(item['year']), item['slug']))
+            except (KeyError, TypeError, ValueError):
+                # Skipped rather than failing the whole search.
+                continue
+        search_cache.set(key, results)
+        return results
 
     @staticmethod
-    def update_info(content: Movie | Series) -> None | bool:
+    def _fetch_player_config(content: Movie | Series) -> tuple[dict | None, str]:
+        """Get the config of the player of the content without a browser.
+
+        The player page is fetched through the shared session and the config
+        is read from its inline script without executing it. The page is only
+        taken for a captcha if the config can't be read from it.
+
+        Parameters
+        ----------
+        content : Movie | Series
+            Content to get the config of, with its ``frame_link`` set.
+
+        Returns
+        -------
+        tuple[dict | None, str]
+            The config, None if it couldn't be read, and the outcome: ``http``
+            if it was read, ``captcha`` or ``missing_element`` if the page
+            needs a browser, ``http_error`` if the page couldn't be fetched.
+        """
+        try:
+            resp = session.get(content.frame_link)
+        except requests.exceptions.RequestException:
+            return None, 'http_error'
+        if resp.status_code in CHALLENGE_STATUS_CODES:
+            return None, 'captcha'
+        if not resp.ok:
+            return None, 'http_error'
+        element = BeautifulSoup(resp.text, 'html.parser').select_one(PLAYER_SCRIPT_SELECTOR)
+        try:
+            config = parse_object_literal(element.get_text()) if element is not None else None
+        except JSParseError:
+            config = None
+        required = ('id_movie' if isinstance(content, Movie) else 'seasons', 'hash', 'expires')
+        if config is None or any(name not in config for name in required):
+            if CHALLENGE_MARKER in resp.text.lower():
+                return None, 'captcha'
+            return None, 'missing_element'
+        return config, 'http'
+
+    @classmethod
+    def _get_player_config(cls, content: Movie | Series, show_progress: bool = True) -> dict | None:
+        """Get the config of the player of the content.
+
+        The config holds the hash and expiry of the stream links and, for a
+        series, the list of episodes. It is read from the player page over
+        HTTP, and a browser is only used if the page shows a captcha or lacks
+        the script. Which way was taken is counted in ``utility.metrics``.
+        The page of the content is only fetched to find the player page if
+        ``content.frame_link`` isn't set yet.
+
+        Parameters
+        ----------
+        content : Movie | Series
+            Content to get the config of.
+        show_progress : bool, optional
+            Print the progress, by default True
+
+        Returns
+        -------
+        dict | None
+            The config, None if it couldn't be read.
+        """
+        content_type = 'movie' if isinstance(content, Movie) else 'series'
+
+        def progress(percent: int) -> None:
+            if show_progress:
+                print_progress(percent, f'Getting {content_type} info...')
+
+        progress(0)
+        if not content.frame_link:
+            try:
+                resp = session.get(content.link)
+                resp.raise_for_status()
+            except Exception:
+                return None
+            soup = BeautifulSoup(resp.text, 'html.parser')
+            content.frame_link = soup.select_one('a.round-button')['href'].strip()
+        frame_link = content.frame_link
+        progress(25)
+        config, outcome = cls._fetch_player_config(content)
+        metrics.increment(f'player_config.{outcome}')
+        if outcome in ('http', 'http_error'):
+            return config
+        # A captcha or a page without the script needs a real browser.
+        with browser_pool.browser() as driver:
+            driver.get(frame_link)
+            progress(50)
+            # get() returns once the page has loaded, so the script is either
+            # there already or the page needs to be reloaded.
+            element = wait_for_element(driver, PLAYER_SCRIPT_SELECTOR, timeout=1)
+            if element is None:
+                # The first load may only set cookies, so reload the page.
+                driver.get(frame_link)
+                element = wait_for_element(driver, PLAYER_SCRIPT_SELECTOR)
+            if element is None:
+                # If reload method is not working, try to click on the recaptcha checkbox
+                try:
+                    WebDriverWait(driver, PAGE_TIMEOUT).until(
+                        EC.frame_to_be_available_and_switch_to_it((By.TAG_NAME, 'iframe')))
+                    WebDriverWait(driver, PAGE_TIMEOUT).until(
+                        EC.element_to_be_clickable((By.CSS_SELECTOR, '.recaptcha-checkbox-border'))).click()
+                except TimeoutException:
+                    return None
+                driver.switch_to.default_content()
+                element = wait_for_element(driver, PLAYER_SCRIPT_SELECTOR)
+                if element is None:
+                    return None
+            progress(75)
+            script_content = element.get_attribute('innerHTML')
+        try:
+            return parse_object_literal(script_content)
+        except JSParseError:
+            return None
+
+    @classmethod
+    def update_info(cls, content: Movie | Series) -> None | bool:
         """Update the info of the content.
 
+        The player page and the episodes are kept in the metadata cache, so
+        once the content is cached only its hash is renewed when it expires.
+
         Parameters
         ----------
         content : Movie | Series
@@ -110,46 +329,24 @@ class Lookmovie:
         None | bool
             None if their is no exception while sending request, else False if an exception is raised.
         """
+        if metadata_cache.load(content):
+            return None
         content_type = 'movie' if isinstance(content, Movie) else 'series'
-        print_progress(0, f'Getting {content_type} info...')
-        try:
-            resp = requests.get(content.link)
-            resp.raise_for_status()
-        except Exception:
+        if content.frame_link:
+            # Only the hash of the cached content has expired.
+            info_dict = cls._get_player_config(content)
+            if info_dict is not None and 'hash' in info_dict and 'expires' in info_dict:
+                content.hash = info_dict['hash'].strip()
+                content.expiry = int(info_dict['expires'])
+                metadata_cache.store_hash(content)
+                print_progress(100, f'Getting {content_type} info...')
+                print()
+                return None
+            # The player page may have moved, look it up again.
+            content.frame_link = ''
+        info_dict = cls._get_player_config(content)
+        if info_dict is None:
             return False
-        print_progress(25, f'Getting {content_type} info...')
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        frame_link = soup.select_one('a.round-button')['href'].strip()
-        content.frame_link = frame_link
-        driver = webdriver.Chrome(service=ChromeService(
-            ChromeDriverManager().install()), options=options)
-        driver.get(frame_link)
-        driver.get(frame_link)
-        print_progress(50, f'Getting {content_type} info...')
-        time.sleep(1)
-        # if isinstance(content, Movie):
-            # css_selector = '#app > script:nth-child(4)'
-        # else:
-        css_selector = '#app > script:nth-child(2)'
-        try:
-            element = driver.find_element(By.CSS_SELECTOR, css_selector)
-        except NoSuchElementException:
-            # If reload method is not working, try to click on the recaptcha checkbox
-            try:
-                time.sleep(1)
-                driver.switch_to.frame(
-                    driver.find_element(By.TAG_NAME, "iframe"))
-                driver.find_element(
-                    By.CSS_SELECTOR, '.recaptcha-checkbox-border').click()
-                # driver.switch_to.default_content()
-                time.sleep(2)
-                element = driver.find_element(By.CSS_SELECTOR, css_selector)
-            except NoSuchElementException:
-                driver.close()
-                return False
-        print_progress(75, f'Getting {content_type} info...')
-        script_content = element.get_attribute('innerHTML')
-        info_dict = js2py.eval_js(script_content).to_dict()
         print_progress(85, f'Getting {content_type} info...')
         if isinstance(content, Movie):
             content.id = int(info_dict['id_movie'])
@@ -164,14 +361,106 @@ class Lookmovie:
                 season_dict.setdefault(int(season['season']), []).append(
                     Episode(episode_number, title, id))
             content.seasons = season_dict
+        metadata_cache.store(content)
         print_progress(100, f'Getting {content_type} info...')
         print()
-        driver.close()
+
+    @classmethod
+    def refresh_hash(cls, content: Movie | Series) -> bool:
+        """Get a new hash and expiry for the stream links of the content.
+
+        Unlike ``update_info`` the episodes of a series are kept, so the
+        links already resolved and the user's choice of episodes stay valid.
+
+        Parameters
+        ----------
+        content : Movie | Series
+            Content to update.
+
+        Returns
+        -------
+        bool
+            True if the hash was refreshed.
+        """
+        info_dict = cls._get_player_config(content, show_progress=False)
+        if info_dict is None:
+            return False
+        content.hash = info_dict['hash'].strip()
+        content.expiry = int(info_dict['expires'])
+        metadata_cache.store_hash(content)
+        return True
 
     @staticmethod
-    def set_m3u8_n_subtitle(content: Movie | Series, quality: int) -> None | bool:
+    def _set_resources(item: Movie | Episode, resources: dict, domain: str, quality: int) -> None:
+        """Set the m3u8 link and subtitle of a movie or an episode from its access resources.
+
+        Parameters
+        ----------
+        item : Movie | Episode
+            Movie or episode to update.
+        resources : dict
+            Response of the access api.
+        domain : str
+            Domain of the player.
+        quality : int
+            Quality of the m3u8 file.
+        """
+        for subtitle in resources['subtitles']:
+            if subtitle['language'].lower() == 'english':
+                item.subtitle = 'https://'+domain+subtitle['file']
+                break
+        for stream in resources['streams']:
+            if int(stream.replace('p', '').strip()) == quality:
+                item.m3u8 = resources['streams'][stream]
+                break
+        # If the desired quality is not available, set the first quality
+        if item.m3u8 == '':
+            item.m3u8 = resources['streams'][list(
+                resources['streams'].keys())[0]]
+
+    @classmethod
+    def resolve_episode(cls, content: Series, episode: Episode, quality: int) -> None | tuple[bool, str]:
+        """Set the m3u8 link and subtitle of an episode.
+
+        Parameters
+        ----------
+        content : Series
+            Series the episode belongs to.
+        episode : Episode
+            Episode to update.
+        quality : int
+            Quality of the m3u8 file.
+
+        Returns
+        -------
+        None | tuple[bool, str]
+            None if the episode was resolved, else False and the error message.
+        """
+        domain = urlparse(content.frame_link).netloc
+        resources_link = f'https://{domain}/api/v1/security/'
+        resources_link += f'episode-access?id_episode={episode.id}&hash={content.hash}&expires={content.expiry}'
+        try:
+            resp = session.get(resources_link)
+            resp.raise_for_status()
+        except requests.exceptions.HTTPError:
+            return (False, 'HTTP Error')
+        except requests.exceptions.RequestException:
+            return (False, 'Connection Error')
+        try:
+            resources = resp.json()
+            if resources['success'] == False:
+                return (False, resources['message'])
+            cls._set_resources(episode, resources, domain, quality)
+        except (KeyError, TypeError, ValueError):
+            return (False, 'Invalid response')
+
+    @classmethod
+    def set_m3u8_n_subtitle(cls, content: Movie | Series, quality: int) -> None | tuple[bool, str]:
         """Set the m3u8 link and subtitle of the content.
 
+        The episodes of a series are resolved one by one with
+        ``resolve_episode``, so only movies are handled here.
+
         Parameters
         ----------
         content : Movie | Series
@@ -181,60 +470,26 @@ class Lookmovie:
 
         Returns
         -------
-        None | bool
-            None if their is no exception while sending request, else False if an exception is raised.
+        None | tuple[bool, str]
+            None if their is no exception while sending request, else False and the error message.
         """
         domain = urlparse(content.frame_link).netloc
         resources_link = f'https://{domain}/api/v1/security/'
-        if isinstance(content, Movie):
-            resources_link += f'movie-access?id_movie={content.id}&hash={content.hash}&expires={content.expiry}'
-            try:
-                resp = requests.get(resources_link)
-                resp.raise_for_status()
-                resources = resp.json()
-                if resources['success'] == False:
-                    return (False, resources['message'])
-                for subtitle in resources['subtitles']:
-                    if subtitle['language'].lower() == 'english':
-                        content.subtitle = 'https://'+domain+subtitle['file']
-                        break
-                for stream in resources['streams']:
-                    if int(stream.replace('p', '').strip()) == quality:
-                        content.m3u8 = resources['streams'][stream]
-                        break
-                # If the desired quality is not available, set the first quality
-                if content.m3u8 == '':
-                    content.m3u8 = resources['streams'][list(
-                        resources['streams'].keys())[0]]
-            except requests.exceptions.HTTPError:
-                return (False, 'HTTP Error')
-        else:
-            try:
-                for season in content.seasons:
-                    for episode in content.seasons[season]:
-                        resources_link = f'https://{domain}/api/v1/security/'
-                        resources_link += f'episode-access?id_episode={episode.id}&hash={content.hash}&expires={content.expiry}'
-                        resp = requests.get(resources_link)
-                        resp.raise_for_status()
-                        resources = resp.json()
-                        if resources['success'] == False:
-                            return (False, resources['message'])
-                        for subtitle in resources['subtitles']:
-                            if subtitle['language'].lower() == 'english':
-                                episode.subtitle = 'https://' + \
-                                    domain+subtitle['file']
-                                break
-                        for stream in resources['streams']:
-                            if int(stream.replace('p', '').strip()) == quality:
-                                episode.m3u8 = resources['streams'][stream]
-                                break
-                        # If the desired quality is not available, set the first quality
-                        if episode.m3u8 == '':
-                            episode.m3u8 = resources['streams'][list(
-                                resources['streams'].keys())[0]]
-            except requests.exceptions.HTTPError:
-                return (False, 'HTTP Error')
-
+        resources_link += f'movie-access?id_movie={content.id}&hash={content.hash}&expires={content.expiry}'
+        try:
+            resp = session.get(resources_link)
+            resp.raise_for_status()
+        except requests.exceptions.HTTPError:
+            return (False, 'HTTP Error')
+        except requests.exceptions.RequestException:
+            return (False, 'Connection Error')
+        try:
+            resources = resp.json()
+            if resources['success'] == False:
+                return (False, resources['message'])
+            cls._set_resources(content, resources, domain, quality)
+        except (KeyError, TypeError, ValueError):
+            return (False, 'Invalid response')
 
 if __name__ == '__main__':
     results = Lookmovie.search('The Haunting Of Hill House')
@@ -0,0 +1,226 @@
+import concurrent.futures
+import importlib
+import pkgutil
+import threading
+import time
+
+from providers.base import Provider
+from utility.content import Movie, Series
+from utility.metrics import metrics
+from utility.title_index import normalize
+
+# Seconds a search waits for the providers. Providers answering later are
+# left out of the results.
+SEARCH_DEADLINE = 15
+# Weight of the latest search in the health and latency of a provider.
+HEALTH_SMOOTHING = 0.3
+# Maximum number of providers searched at once.
+MAX_SEARCH_WORKERS = 8
+# Modules of this package that aren't providers.
+NON_PROVIDER_MODULES = ('base', 'registry')
+
+
+class ProviderStats:
+    """Health and latency of a provider, as moving averages over its searches.
+
+    Attributes
+    ----------
+    success_rate : float
+        Share of recent searches that answered in time, starting at 1.
+    latency : float
+        Seconds recent searches took, starting at 0.
+
+    Methods
+    -------
+    record(success: bool, latency: float) -> None
+        Record a search.
+    score() -> float
+        Get the rank of the provider, higher is better.
+    """
+
+    def __init__(self):
+        self.success_rate = 1.0
+        self.latency = 0.0
+        self._searches = 0
+
+    def record(self, success: bool, latency: float) -> None:
+        """Record a search.
+
+        Parameters
+        ----------
+        success : bool
+            The search answered in time.
+        latency : float
+            Seconds the search took.
+        """
+        if self._searches == 0:
+            self.latency = latency
+        else:
+            self.latency += HEALTH_SMOOTHING*(latency-self.latency)
+        self.success_rate += HEALTH_SMOOTHING*(success-self.success_rate)
+        self._searches += 1
+
+    def score(self) -> float:
+        """Get the rank of the provider, higher is better.
+
+        Returns
+        -------
+        float
+            Success rate divided by one plus the latency.
+        """
+        return self.success_rate/(1+self.latency)
+
+
+class ProviderRegistry:
+    """Registry of providers, searching all of them at once.
+
+    Attributes
+    ----------
+    deadline : float
+        Seconds a search waits for the providers.
+
+    Methods
+    -------
+    register(provider: type[Provider]) -> type[Provider]
+        Add a provider.
+    discover() -> None
+        Import every provider module of the ``providers`` package.
+    providers() -> list[type[Provider]]
+        Get the providers, best ranked first.
+    stats(provider: type[Provider]) -> ProviderStats
+        Get the health and latency of a provider.
+    search(query: str) -> list[Movie | Series]
+        Search every provider and merge their results.
+    """
+
+    def __init__(self, deadline: float = SEARCH_DEADLINE):
+        self.deadline = deadline
+        self._providers: dict[str, type[Provider]] = {}
+        self._stats: dict[str, ProviderStats] = {}
+        self._lock = threading.Lock()
+        self._discovered = False
+        self._discover_lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_SEARCH_WORKERS)
+
+    def register(self, provider: type[Provider]) -> type[Provider]:
+        """Add a provider, replacing any with the same name.
+
+        Can be used as a class decorator.
+
+        Parameters
+        ----------
+        provider : type[Provider]
+            The provider.
+
+        Returns
+        -------
+        type[Provider]
+            The provider.
+        """
+        with self._lock:
+            self._providers[provider.name] = provider
+            self._stats.setdefault(provider.name, ProviderStats())
+        return provider
+
+    def discover(self) -> None:
+        """Import every provider module of the ``providers`` package.
+
+        Providers register themselves when their module is imported, so a
+        new provider only needs a module in the package. The modules are only
+        looked for once, and a call made while another thread imports them
+        waits for it.
+        """
+        with self._discover_lock:
+            if self._discovered:
+                return
+            import providers
+            for module in pkgutil.iter_modules(providers.__path__):
+                if module.name not in NON_PROVIDER_MODULES:
+                    importlib.import_module(f'providers.{module.name}')
+            self._discovered = True
+
+    def providers(self) -> list[type[Provider]]:
+        """Get the providers, best ranked first.
+
+        Returns
+        -------
+        list[type[Provider]]
+            The providers, by their health and latency.
+        """
+        with self._lock:
+            return sorted(self._providers.values(), key=lambda provider: self._stats[provider.name].score(),
+                          reverse=True)
+
+    def stats(self, provider: type[Provider]) -> ProviderStats:
+        """Get the health and latency of a provider.
+
+        Parameters
+        ----------
+        provider : type[Provider]
+            A registered provider.
+
+        Returns
+        -------
+        ProviderStats
+            Its health and latency.
+        """
+        with self._lock:
+            return self._stats[provider.name]
+
+    def search(self, query: str) -> list[Movie | Series]:
+        """Search every provider and merge their results.
+
+        Providers are searched at the same time, and those that don't answer
+        within ``deadline`` seconds are left out. Results are ordered by the
+        rank of their provider. A movie or series found by several
+        providers, by its type, normalized title and year, is only kept
+        from the best ranked one.
+
+        Parameters
+        ----------
+        query : str
+            Query to search for.
+
+        Returns
+        -------
+        list[Movie | Series]
+            List of movies and series, empty list if no results or every
+            provider failed.
+        """
+        futures = [(provider, self._executor.submit(self._search_provider, provider, query))
+                   for provider in self.providers()]
+        concurrent.futures.wait([future for _, future in futures], timeout=self.deadline)
+        results = []
+        seen = set()
+        for provider, future in futures:
+            if not future.done():
+                metrics.increment(f'search.{provider.name}.deadline')
+                continue
+            if future.exception() is not None:
+                continue
+            for result in future.result():
+                key = (type(result), normalize(result.title), result.year)
+                if key not in seen:
+                    seen.add(key)
+                    results.append(result)
+        return results
+
+    def _search_provider(self, provider: type[Provider], query: str) -> list[Movie | Series]:
+        start = time.monotonic()
+        success = False
+        try:
+            results = provider.search(query)
+            success = True
+            return results
+        except Exception:
+            metrics.increment(f'search.{provider.name}.error')
+            raise
+        finally:
+            latency = time.monotonic()-start
+            with self._lock:
+                self._stats[provider.name].record(success and latency <= self.deadline, latency)
+
+
+# Providers of this installation.
+registry = ProviderRegistry()
+register = registry.register
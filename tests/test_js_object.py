@@ -0,0 +1,68 @@
+import math
+import os
+import sys
+
+import pytest
+
+from utility.js_object import JSParseError, parse_object_literal
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from player_config import make_script
+
+
+def test_structure_inside_strings():
+    config = parse_object_literal("""x = {a: 'b,}', "c": "]{,", d: 'e'};""")
+    assert config == {'a': 'b,}', 'c': ']{,', 'd': 'e'}
+
+
+def test_escapes():
+    config = parse_object_literal(r"""x = {a: 'It\'s', b: "say \"hi\"", c: 'é\x41\n', d: '\u{1F600}'}""")
+    assert config == {'a': "It's", 'b': 'say "hi"', 'c': 'éA\n', 'd': '\U0001F600'}
+
+
+def test_comments_and_trailing_commas():
+    source = """x = {
+        // a comment with a } in it
+        a: [1, 2, /* and a ] here */ 3,],
+        b: {c: null,},
+    };"""
+    assert parse_object_literal(source) == {'a': [1, 2, 3], 'b': {'c': None}}
+
+
+def test_numbers_and_constants():
+    config = parse_object_literal(
+        'x = {a: -1, b: 2.5e3, c: 0x1f, d: .5, e: true, f: false, g: undefined, '
+        'h: Infinity, i: -Infinity, j: +Infinity, k: NaN, l: -NaN}')
+    assert (config['a'], config['b'], config['c'], config['d']) == (-1, 2500.0, 31, 0.5)
+    assert (config['e'], config['f'], config['g']) == (True, False, None)
+    assert (config['h'], config['i'], config['j']) == (math.inf, -math.inf, math.inf)
+    assert math.isnan(config['k']) and math.isnan(config['l'])
+
+
+def test_assignment_with_brackets_on_the_left():
+    assert parse_object_literal("window['a{b'] = {c: 1};") == {'c': 1}
+
+
+@pytest.mark.parametrize('source', [
+    'no object here',
+    'x = {a: 1',
+    'x = {a 1}',
+    'x = {a: 1 b: 2}',
+    'x = {a: [1 2]}',
+    'x = {a: foo}',
+    'x = {a: -Infinityx}',
+    "x = {a: 'unterminated}",
+])
+def test_invalid_sources(source):
+    with pytest.raises(JSParseError):
+        parse_object_literal(source)
+
+
+def test_player_config():
+    config = parse_object_literal(make_script(45))
+    assert config['hash'] == 'AbCdEf0123456789_-' and config['expires'] == 1671341126
+    assert len(config['seasons']) == 45
+    assert config['seasons'][44] == {
+        'title': 'Episode 44 - It\'s "{here}"', 'index': 44, 'episode': '5',
+        'id_episode': 100044, 'season': '3', 'still': 'https://img.example/44.jpg'}
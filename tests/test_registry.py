@@ -0,0 +1,86 @@
+import time
+
+from providers.base import Provider, ProviderError
+from providers.registry import ProviderRegistry
+from utility.content import Movie, Series
+from utility.metrics import metrics
+
+# Seconds the registries of these tests wait for their providers.
+DEADLINE = 0.3
+
+
+def make_provider(name: str, titles: list[tuple[str, int]] = (), delay: float = 0,
+                  fail: bool = False) -> type[Provider]:
+    """Make a stub provider.
+
+    Parameters
+    ----------
+    name : str
+        Name of the provider.
+    titles : list[tuple[str, int]], optional
+        Title and year of the movies it finds, by default none
+    delay : float, optional
+        Seconds a search takes, by default 0
+    fail : bool, optional
+        Searches raise ProviderError, by default False
+
+    Returns
+    -------
+    type[Provider]
+        The provider.
+    """
+
+    class Stub(Provider):
+        @classmethod
+        def search(cls, query: str) -> list[Movie | Series]:
+            time.sleep(delay)
+            if fail:
+                raise ProviderError(f'{cls.name} is down')
+            return [Movie(title, year, f'https://{cls.name}/{index}', cls)
+                    for index, (title, year) in enumerate(titles)]
+
+    Stub.name = name
+    return Stub
+
+
+def test_late_provider_is_dropped():
+    registry = ProviderRegistry(deadline=DEADLINE)
+    fast = registry.register(make_provider('fast', [('Dark', 2017)]))
+    registry.register(make_provider('late', [('Dark Matter', 2015)], delay=DEADLINE+0.2))
+    before = metrics.get('search.late.deadline')
+
+    start = time.monotonic()
+    results = registry.search('dark')
+
+    assert time.monotonic()-start < DEADLINE+0.15
+    assert [(result.title, result.provider) for result in results] == [('Dark', fast)]
+    assert metrics.get('search.late.deadline') == before+1
+
+
+def test_duplicates_are_kept_from_the_better_ranked_provider():
+    registry = ProviderRegistry(deadline=DEADLINE)
+    worse = registry.register(make_provider('worse', [('Dark', 2017), ('Dark', 2011)]))
+    better = registry.register(make_provider('better', [('DARK!', 2017)]))
+    registry.stats(worse).record(False, 1.0)
+
+    results = registry.search('dark')
+
+    assert [(result.title, result.year, result.provider) for result in results] == [
+        ('DARK!', 2017, better), ('Dark', 2011, worse)]
+
+
+def test_providers_are_ranked_by_health_and_latency():
+    registry = ProviderRegistry(deadline=DEADLINE)
+    failing = registry.register(make_provider('failing', fail=True))
+    late = registry.register(make_provider('late', delay=DEADLINE+0.1))
+    slow = registry.register(make_provider('slow', delay=DEADLINE/2))
+    fast = registry.register(make_provider('fast'))
+    assert registry.providers() == [failing, late, slow, fast]
+
+    registry.search('dark')
+    # The late search is recorded when it ends, after the deadline.
+    time.sleep(0.2)
+
+    assert registry.providers() == [fast, slow, failing, late]
+    scores = [registry.stats(provider).score() for provider in registry.providers()]
+    assert scores == sorted(scores, reverse=True)
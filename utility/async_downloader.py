@@ -0,0 +1,548 @@
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import threading
+import time
+from collections.abc import Callable
+from urllib.parse import urlparse
+
+import aiohttp
+from tqdm import tqdm
+
+from utility import integrity, ratelimit, session
+from utility.config import DEFAULT_CONNECTIONS_PER_HOST
+from utility.concurrency import AdaptiveLimiter, throughput
+from utility.hls import (Playlist, PlaylistParser, Segment, decrypt,
+                         select_variant)
+from utility.m3u8_downloader import (DEFAULT_WINDOW, THROTTLE_STATUS_CODES,
+                                     TOKEN_STATUS_CODES, RemuxError,
+                                     RemuxWriter, SegmentWriter,
+                                     can_stream_remux, convert_to_mp4,
+                                     is_downloaded, open_writer)
+from utility.manifest import Manifest
+from utility.metrics import metrics
+from utility.retry import (TRIAL_POLL_INTERVAL, RetryBudget, RetryPolicy, SegmentError,
+                           TokenExpiredError, circuit_breaker)
+
+connections_per_host = DEFAULT_CONNECTIONS_PER_HOST
+
+_loop: asyncio.AbstractEventLoop | None = None
+_session: aiohttp.ClientSession | None = None
+_keys: dict[str, bytes] = {}
+_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Get the event loop running the downloads, starting it if needed.
+
+    All downloads of the process share one event loop running in a daemon
+    thread, so that they also share one ``ClientSession`` and its connection
+    pool no matter which thread calls ``start_download``.
+
+    Returns
+    -------
+    asyncio.AbstractEventLoop
+        The running event loop.
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='async-downloader', daemon=True).start()
+            atexit.register(close)
+        return _loop
+
+
+async def _get_session() -> aiohttp.ClientSession:
+    """Get the shared client session, creating it on first use.
+
+    Returns
+    -------
+    aiohttp.ClientSession
+        The client session.
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=connections_per_host)
+        timeout = aiohttp.ClientTimeout(sock_connect=session.timeout, sock_read=session.timeout)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+
+async def get_playlist(m3u8_url: str) -> Playlist:
+    """Get and parse an m3u8 file.
+
+    The playlist is parsed line by line while it is being received.
+
+    Parameters
+    ----------
+    m3u8_url : str
+        m3u8 file url.
+
+    Returns
+    -------
+    Playlist
+        The parsed playlist.
+
+    Raises
+    ------
+    TokenExpiredError
+        If hash is wrong.
+    """
+    client = await _get_session()
+    async with client.get(m3u8_url) as resp:
+        if resp.status in TOKEN_STATUS_CODES:
+            raise TokenExpiredError(f'Access denied to playlist: {m3u8_url}')
+        resp.raise_for_status()
+        parser = PlaylistParser(m3u8_url)
+        async for line in resp.content:
+            parser.feed(line.decode())
+    return parser.playlist
+
+
+async def get_segments(m3u8_url: str, quality: int | None = None) -> list[Segment]:
+    """Get segments from m3u8 file.
+
+    If the file is a master playlist, a variant is selected based on the
+    quality and on the throughput measured in earlier downloads, and its
+    segments are returned.
+
+    Parameters
+    ----------
+    m3u8_url : str
+        m3u8 file url.
+    quality : int | None, optional
+        Highest video height to download, by default None
+
+    Returns
+    -------
+    list[Segment]
+        List of segments.
+
+    Raises
+    ------
+    TokenExpiredError
+        If hash is wrong.
+    """
+    playlist = await get_playlist(m3u8_url)
+    if playlist.is_master:
+        variant = select_variant(playlist.variants, quality, throughput.value)
+        playlist = await get_playlist(variant.uri)
+    return playlist.segments
+
+
+async def get_key(uri: str) -> bytes:
+    """Get an encryption key.
+
+    Keys are cached, so every key is downloaded once even though it is
+    shared by many segments.
+
+    Parameters
+    ----------
+    uri : str
+        Url of the key.
+
+    Returns
+    -------
+    bytes
+        The key.
+    """
+    if uri not in _keys:
+        _keys[uri] = await get_response(uri)
+    return _keys[uri]
+
+
+async def fetch_segment(segment: Segment, limiter: AdaptiveLimiter | None = None,
+                        budget: RetryBudget | None = None, priority: str = ratelimit.DEFAULT_PRIORITY) -> bytes:
+    """Download a segment and decrypt it if needed.
+
+    Decryption runs in the default executor so it doesn't block the loop.
+    If ``integrity.verify_segments`` is set, a segment that isn't valid
+    MPEG-TS is downloaded again, up to ``integrity.MAX_REFETCHES`` times
+    while the retry budget lasts.
+
+    Parameters
+    ----------
+    segment : Segment
+        Segment to download.
+    limiter : AdaptiveLimiter | None, optional
+        Limiter to report the latency, size and errors of the request to, by
+        default None
+    budget : RetryBudget | None, optional
+        Retry budget of the download, by default None
+    priority : str, optional
+        Priority class of the download, by default
+        ratelimit.DEFAULT_PRIORITY
+
+    Returns
+    -------
+    bytes
+        Content of the segment.
+
+    Raises
+    ------
+    SegmentError
+        If the segment can't be downloaded, or is still corrupt after being
+        downloaded again.
+    """
+    for attempt in range(1, integrity.MAX_REFETCHES+1):
+        data = await get_response(segment.uri, limiter, budget, segment.headers(), priority=priority)
+        await asyncio.sleep(ratelimit.bandwidth.reserve(len(data), priority))
+        if segment.key is not None:
+            key = await get_key(segment.key.uri)
+            data = await asyncio.get_running_loop().run_in_executor(
+                None, decrypt, data, key, segment.iv)
+        if not integrity.verify_segments:
+            return data
+        try:
+            integrity.check_segment(data)
+            return data
+        except integrity.CorruptSegmentError as e:
+            metrics.increment('segments.corrupt')
+            if attempt == integrity.MAX_REFETCHES or (budget is not None and not budget.spend()):
+                raise SegmentError(f'Corrupt segment: {segment.uri} ({e})') from e
+            print(
+                '\033[91m', # Red foreground
+                '\033[40m', # Black background
+                f'Corrupt segment: {segment.uri} ({e}), downloading it again '
+                f'({attempt}/{integrity.MAX_REFETCHES-1})...',
+                '\033[0m'
+            )
+
+
+async def get_response(segment: str, limiter: AdaptiveLimiter | None = None, budget: RetryBudget | None = None,
+                       headers: dict[str, str] | None = None, policy: RetryPolicy = RetryPolicy(),
+                       priority: str = ratelimit.DEFAULT_PRIORITY) -> bytes:
+    """Get the content of a segment.
+
+    Failed requests are retried with exponential backoff, as long as the
+    retry budget of the download lasts and the circuit breaker of the host
+    is closed. While the circuit breaker is open, requests wait for its
+    cooldown and take turns at its trial request, every cooldown costing a
+    retry. Every attempt waits for the global request rate limit first,
+    which isn't counted in the latency reported to the limiter. A body
+    shorter or longer than its Content-Length header counts as a failed
+    request.
+
+    Parameters
+    ----------
+    segment : str
+        Segment url.
+    limiter : AdaptiveLimiter | None, optional
+        Limiter to report the latency, size and errors of the request to, by
+        default None
+    budget : RetryBudget | None, optional
+        Retry budget of the download, by default None
+    headers : dict[str, str] | None, optional
+        Headers to send with the request, by default None
+    policy : RetryPolicy, optional
+        Backoff policy, by default RetryPolicy()
+    priority : str, optional
+        Priority class of the download, by default
+        ratelimit.DEFAULT_PRIORITY
+
+    Returns
+    -------
+    bytes
+        Content of the segment.
+
+    Raises
+    ------
+    TokenExpiredError
+        If the server refuses the access token in the url.
+    SegmentError
+        If the segment can't be downloaded.
+    """
+    client = await _get_session()
+    breaker = circuit_breaker(urlparse(segment).netloc)
+    for attempt in range(1, policy.max_attempts+1):
+        waits = 0
+        while not breaker.allow():
+            delay = breaker.retry_after()
+            if delay > 0:
+                waits += 1
+                if waits > policy.max_attempts or (budget is not None and not budget.spend()):
+                    raise SegmentError(f'Too many errors from {urlparse(segment).netloc}')
+            await asyncio.sleep(max(delay, TRIAL_POLL_INTERVAL))
+        try:
+            await asyncio.sleep(ratelimit.request_rate.reserve(1, priority))
+            start = time.monotonic()
+            async with client.get(segment, headers=headers, raise_for_status=True) as resp:
+                content = await resp.read()
+            integrity.check_length(content, resp.headers.get('Content-Length'), resp.headers.get('Content-Encoding'))
+        except (aiohttp.ClientError, asyncio.TimeoutError, integrity.CorruptSegmentError) as e:
+            status = e.status if isinstance(e, aiohttp.ClientResponseError) else None
+            if status in TOKEN_STATUS_CODES:
+                # The host answered, which ends a trial request too.
+                breaker.record_success()
+                raise TokenExpiredError(f'Access denied to segment: {segment}') from e
+            breaker.record_failure()
+            if limiter is not None:
+                limiter.on_error(throttled=status in THROTTLE_STATUS_CODES)
+            if attempt == policy.max_attempts or (budget is not None and not budget.spend()):
+                raise SegmentError(f'Could not download segment: {segment}') from e
+            print(
+                '\033[91m', # Red foreground
+                '\033[40m', # Black background
+                f'Error while downloading segment: {segment}, retrying ({attempt}/{policy.max_attempts-1})...',
+                '\033[0m'
+            )
+            await asyncio.sleep(policy.delay(attempt))
+            continue
+        except BaseException:
+            # Cancelled before the host answered.
+            breaker.release()
+            raise
+        breaker.record_success()
+        if limiter is not None:
+            limiter.on_success(len(content), time.monotonic()-start)
+        return content
+
+
+async def download_segments(segments: list[Segment], writer: SegmentWriter, window: int = DEFAULT_WINDOW,
+                            adaptive: bool = True, priority: str = ratelimit.DEFAULT_PRIORITY) -> None:
+    """Download segments into a writer on the event loop.
+
+    Works like ``m3u8_downloader.download_segments`` but keeps the segments
+    in flight as tasks on the event loop instead of threads. Writes are
+    handed to a dedicated thread so they never block the loop. The writer is
+    closed when the download ends, whether it succeeds or not.
+
+    Parameters
+    ----------
+    segments : list[Segment]
+        Segments of the playlist.
+    writer : SegmentWriter
+        Writer to hand the segments over to, starting at its next index.
+    window : int, optional
+        Size of the sliding window of segments, by default DEFAULT_WINDOW
+    adaptive : bool, optional
+        Adapt the number of segments downloaded at once to the measured
+        throughput and errors, up to ``window``, by default True
+    priority : str, optional
+        Priority class of the download, by default
+        ratelimit.DEFAULT_PRIORITY
+    """
+    loop = asyncio.get_running_loop()
+    # A single thread keeps the writes in the order they are handed over.
+    file_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    limiter = AdaptiveLimiter(window) if adaptive else None
+    budget = RetryBudget.for_segments(len(segments)-writer.next_index)
+    in_flight = {}
+    next_segment = writer.next_index
+    start, start_offset = time.monotonic(), writer.offset
+    try:
+        with tqdm(desc=os.path.basename(writer.file_name), total=len(segments), initial=writer.next_index,
+                  colour='green') as progress:
+            while writer.next_index < len(segments):
+                while (next_segment < len(segments) and writer.can_accept(next_segment)
+                       and (limiter is None or len(in_flight) < limiter.limit)
+                       and ratelimit.segments.try_acquire()):
+                    task = asyncio.create_task(fetch_segment(segments[next_segment], limiter, budget, priority))
+                    task.add_done_callback(lambda _: ratelimit.segments.release())
+                    in_flight[task] = next_segment
+                    next_segment += 1
+                if not in_flight:
+                    # Every slot of the global segment budget is taken by
+                    # other downloads.
+                    await asyncio.sleep(0.05)
+                    continue
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    await loop.run_in_executor(
+                        file_executor, writer.put, in_flight.pop(task), task.result())
+                    progress.update(1)
+    finally:
+        for task in in_flight:
+            task.cancel()
+        await loop.run_in_executor(file_executor, writer.close)
+        file_executor.shutdown()
+    throughput.add((writer.offset-start_offset)/max(time.monotonic()-start, 1e-6))
+
+
+async def repair_segments(file_name: str, segments: list[Segment], bad: dict[int, str],
+                          window: int = DEFAULT_WINDOW, priority: str = ratelimit.DEFAULT_PRIORITY) -> None:
+    """Download again the bad segments of an earlier run and replace them.
+
+    If the manifest belongs to another playlist, the segments can't be
+    matched, so the manifest is removed and the download starts over.
+
+    Parameters
+    ----------
+    file_name : str
+        Path of the ``.ts`` output file.
+    segments : list[Segment]
+        Segments of the playlist.
+    bad : dict[int, str]
+        Why every bad segment is bad, by index, see ``integrity.verify_file``.
+    window : int, optional
+        Maximum number of segments downloaded at once, by default
+        DEFAULT_WINDOW
+    priority : str, optional
+        Priority class of the download, by default
+        ratelimit.DEFAULT_PRIORITY
+
+    Raises
+    ------
+    SegmentError
+        If a segment can't be downloaded. The file is left as it was.
+    """
+    loop = asyncio.get_running_loop()
+    manifest = Manifest(file_name)
+    fingerprint = Manifest.fingerprint_of([segment.name for segment in segments])
+    if (not await loop.run_in_executor(None, manifest.load) or manifest.segment_count != len(segments)
+            or manifest.fingerprint != fingerprint):
+        manifest.remove()
+        return
+    print(
+        '\033[91m', # Red foreground
+        '\033[40m', # Black background
+        f'Downloading again {len(bad)} bad segment(s) of {os.path.basename(file_name)}.',
+        '\033[0m'
+    )
+    budget = RetryBudget.for_segments(len(bad))
+    semaphore = asyncio.Semaphore(window)
+
+    async def fetch(index: int) -> bytes:
+        async with semaphore:
+            # The global segment budget is shared with the other downloads.
+            while not ratelimit.segments.try_acquire():
+                await asyncio.sleep(0.05)
+            try:
+                return await fetch_segment(segments[index], None, budget, priority)
+            finally:
+                ratelimit.segments.release()
+
+    data = await asyncio.gather(*(fetch(index) for index in bad))
+    await loop.run_in_executor(None, integrity.replace_segments, file_name, dict(zip(bad, data)))
+
+
+async def download(m3u8: str, file_name: str, window: int = DEFAULT_WINDOW, adaptive: bool = True,
+                   quality: int | None = None, stream_remux: bool = False,
+                   priority: str = ratelimit.DEFAULT_PRIORITY, bad: dict[int, str] | None = None) -> None:
+    """Download the segments of an m3u8 file.
+
+    The segments are written to ``file_name.ts``, or piped into FFmpeg to
+    produce ``file_name.mp4`` when ``stream_remux`` is set.
+
+    Parameters
+    ----------
+    m3u8 : str
+        m3u8 file url.
+    file_name : str
+        File name.
+    window : int, optional
+        Size of the sliding window of segments, by default DEFAULT_WINDOW
+    adaptive : bool, optional
+        Adapt the number of segments downloaded at once to the measured
+        throughput and errors, up to ``window``, by default True
+    quality : int | None, optional
+        Highest video height to download if the m3u8 file is a master
+        playlist, by default None
+    stream_remux : bool, optional
+        Pipe the segments straight into FFmpeg, by default False
+    priority : str, optional
+        Priority class of the download, by default
+        ratelimit.DEFAULT_PRIORITY
+    bad : dict[int, str] | None, optional
+        Bad segments of an earlier run to download again first, see
+        ``integrity.verify_file``, by default None
+    """
+    segments = await get_segments(m3u8, quality)
+    loop = asyncio.get_running_loop()
+    if bad:
+        await repair_segments(file_name+'.ts', segments, bad, window, priority)
+        if await loop.run_in_executor(None, is_downloaded, file_name):
+            return
+    if can_stream_remux(file_name, stream_remux):
+        try:
+            writer = await loop.run_in_executor(None, RemuxWriter, file_name, len(segments), window)
+            await download_segments(segments, writer, window, adaptive, priority)
+            return
+        except RemuxError:
+            print(
+                '\033[91m', # Red foreground
+                '\033[40m', # Black background
+                'FFmpeg failed, downloading to a .ts file instead.',
+                '\033[0m'
+            )
+    writer = await loop.run_in_executor(None, open_writer, file_name+'.ts', segments, window)
+    await download_segments(segments, writer, window, adaptive, priority)
+
+
+def start_download(m3u8: str, file_name: str, window: int = DEFAULT_WINDOW, adaptive: bool = True,
+                   quality: int | None = None, stream_remux: bool = False,
+                   on_remux: Callable[[], None] | None = None,
+                   priority: str = ratelimit.DEFAULT_PRIORITY) -> None:
+    """Start download.
+
+    Drop-in replacement for ``m3u8_downloader.start_download`` that runs the
+    download on the shared event loop. It can be called from several threads
+    at once, and all the downloads share the same connection pool. If
+    ``integrity.verify_segments`` is set, the segments of an earlier run are
+    checked first, and the bad ones downloaded again.
+
+    Parameters
+    ----------
+    m3u8 : str
+        m3u8 file url.
+    file_name : str
+        File name.
+    window : int, optional
+        Size of the sliding window of segments, by default DEFAULT_WINDOW
+    adaptive : bool, optional
+        Adapt the number of segments downloaded at once to the measured
+        throughput and errors, up to ``window``, by default True
+    quality : int | None, optional
+        Highest video height to download if the m3u8 file is a master
+        playlist, by default None
+    stream_remux : bool, optional
+        Pipe the segments straight into FFmpeg, so the ``.mp4`` file is
+        written during the download instead of converting the ``.ts`` file
+        afterwards, by default False
+    on_remux : Callable[[], None] | None, optional
+        Called when the ``.ts`` file starts being converted, by default None
+    priority : str, optional
+        Priority class of the download, sharing the global bandwidth and
+        request rate limits with the other downloads in proportion to
+        ``ratelimit.PRIORITY_WEIGHTS``, by default ratelimit.DEFAULT_PRIORITY
+
+    Raises
+    ------
+    TokenExpiredError
+        If the hash of the stream is wrong or has expired.
+    SegmentError
+        If a segment can't be downloaded.
+    """
+    bad = integrity.verify_file(file_name+'.ts') if integrity.verify_segments else {}
+    if not bad and is_downloaded(file_name):
+        convert_to_mp4(file_name, on_remux)
+        return
+    future = asyncio.run_coroutine_threadsafe(
+        download(m3u8, file_name, window, adaptive, quality, stream_remux, priority, bad), _get_loop())
+    try:
+        future.result()
+    except KeyboardInterrupt:
+        future.cancel()
+        print(
+            '\033[91m', # Red foreground
+            '\033[40m', # Black background
+            'Download interrupted.',
+            '\033[0m'
+        )
+        exit()
+    convert_to_mp4(file_name, on_remux)
+
+
+def close() -> None:
+    """Close the shared client session and stop the event loop."""
+    global _loop, _session
+    with _lock:
+        if _loop is None:
+            return
+        if _session is not None:
+            asyncio.run_coroutine_threadsafe(_session.close(), _loop).result()
+            _session = None
+        _loop.call_soon_threadsafe(_loop.stop)
+        _loop = None
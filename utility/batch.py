@@ -0,0 +1,361 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections.abc import Callable
+
+from utility.config import QUALITIES
+from utility.ratelimit import PRIORITIES
+from utility.content import Episode, Movie, Series
+from utility.scheduler import DownloadJob, DownloadScheduler
+from utility.title_index import normalize
+
+# Default number of titles downloaded at the same time in batch mode. The
+# episodes of every title are downloaded in parallel too.
+DEFAULT_PARALLEL_JOBS = 2
+# Types of content a job can ask for.
+KINDS = ('movie', 'series')
+# Priority class of jobs that don't give one.
+DEFAULT_JOB_PRIORITY = 'batch'
+
+
+class JobFileError(ValueError):
+    """Raised when a job file can't be read or holds an invalid job."""
+
+
+class BatchJob:
+    """A movie or series to download in batch mode.
+
+    Attributes
+    ----------
+    title : str
+        Title to search for. Only results with the same title, ignoring
+        case and punctuation, are downloaded.
+    year : int | None
+        Year of the result, None for any year.
+    kind : str | None
+        ``movie`` or ``series``, None for either.
+    seasons : dict[int, list[int] | None] | None
+        Episode numbers to download by season, None for a whole season.
+        None to download every season.
+    quality : int | None
+        Wanted quality, None for the quality of the config.
+    priority : str
+        Priority class of the downloads, one of ``ratelimit.PRIORITIES``.
+
+    Methods
+    -------
+    from_dict(values: dict, where: str) -> BatchJob
+        Make a job from an entry of a job file.
+    matches(content: Movie | Series) -> bool
+        Check whether a search result is the title of the job.
+    select(seasons: dict[int, list[Episode]]) -> tuple[dict[int, list[Episode]], list[str]]
+        Select the episodes of the job.
+    describe() -> dict
+        Describe the job for the report.
+    """
+
+    def __init__(self, title: str, year: int | None = None, kind: str | None = None,
+                 seasons: dict[int, list[int] | None] | None = None, quality: int | None = None,
+                 priority: str = DEFAULT_JOB_PRIORITY):
+        self.title = title
+        self.year = year
+        self.kind = kind
+        self.seasons = seasons
+        self.quality = quality
+        self.priority = priority
+
+    @classmethod
+    def from_dict(cls, values: dict, where: str) -> 'BatchJob':
+        """Make a job from an entry of a job file.
+
+        Parameters
+        ----------
+        values : dict
+            The entry: ``title`` and optionally ``year``, ``type``,
+            ``seasons``, ``quality`` and ``priority``. ``seasons`` maps
+            season numbers to a list of episode numbers or ``"all"``, and
+            may itself be ``"all"``.
+        where : str
+            Location of the entry, used in error messages.
+
+        Returns
+        -------
+        BatchJob
+            The job.
+
+        Raises
+        ------
+        JobFileError
+            If the entry isn't valid.
+        """
+        if not isinstance(values, dict) or not isinstance(values.get('title'), str) or not values['title'].strip():
+            raise JobFileError(f'{where}: a job needs a title')
+        try:
+            year = int(values['year']) if values.get('year') is not None else None
+            quality = int(values['quality']) if values.get('quality') is not None else None
+            assert quality is None or quality in QUALITIES
+        except (AssertionError, TypeError, ValueError):
+            raise JobFileError(f'{where}: invalid year or quality')
+        kind = values.get('type')
+        if kind is not None and kind not in KINDS:
+            raise JobFileError(f'{where}: type must be movie or series')
+        priority = values.get('priority', DEFAULT_JOB_PRIORITY)
+        if priority not in PRIORITIES:
+            raise JobFileError(f'{where}: priority must be {" or ".join(PRIORITIES)}')
+        seasons = values.get('seasons', 'all')
+        try:
+            if seasons == 'all':
+                seasons = None
+            else:
+                seasons = {int(season): None if episodes == 'all' else sorted(
+                    {int(episode) for episode in ([episodes] if isinstance(episodes, int) else episodes)})
+                    for season, episodes in seasons.items()}
+        except (AttributeError, TypeError, ValueError):
+            raise JobFileError(f'{where}: seasons must map season numbers to "all" or episode numbers')
+        return cls(values['title'].strip(), year, kind, seasons, quality, priority)
+
+    def matches(self, content: Movie | Series) -> bool:
+        """Check whether a search result is the title of the job.
+
+        Parameters
+        ----------
+        content : Movie | Series
+            A search result.
+
+        Returns
+        -------
+        bool
+            True if its title, and the year and type of the job if set, match.
+        """
+        if self.kind is not None and self.kind != ('movie' if isinstance(content, Movie) else 'series'):
+            return False
+        if self.year is not None and self.year != content.year:
+            return False
+        return normalize(content.title) == normalize(self.title)
+
+    def select(self, seasons: dict[int, list[Episode]]) -> tuple[dict[int, list[Episode]], list[str]]:
+        """Select the episodes of the job.
+
+        Parameters
+        ----------
+        seasons : dict[int, list[Episode]]
+            Every episode of the series, by season.
+
+        Returns
+        -------
+        tuple[dict[int, list[Episode]], list[str]]
+            The selected episodes by season, and the name of every selected
+            season or episode the series doesn't have.
+        """
+        if self.seasons is None:
+            return seasons, []
+        selected = {}
+        missing = []
+        for season, numbers in self.seasons.items():
+            if season not in seasons:
+                missing.append(f'Season {season}')
+                continue
+            if numbers is None:
+                selected[season] = seasons[season]
+                continue
+            episodes = {episode.number: episode for episode in seasons[season]}
+            missing.extend(f'Season {season} Episode {number}' for number in numbers if number not in episodes)
+            if any(number in episodes for number in numbers):
+                selected[season] = [episodes[number] for number in numbers if number in episodes]
+        return selected, missing
+
+    def describe(self) -> dict:
+        """Describe the job for the report.
+
+        Returns
+        -------
+        dict
+            Title, year, type, quality and priority of the job.
+        """
+        return {'title': self.title, 'year': self.year, 'type': self.kind, 'quality': self.quality,
+                'priority': self.priority}
+
+
+def load_jobs(path: str) -> list[BatchJob]:
+    """Read a job file.
+
+    A ``.toml`` file holds an array of ``[[job]]`` tables. Any other file is
+    read as JSON lines, one job object per line, where blank lines and lines
+    starting with ``#`` are skipped.
+
+    Parameters
+    ----------
+    path : str
+        Path of the job file.
+
+    Returns
+    -------
+    list[BatchJob]
+        The jobs, in the order of the file.
+
+    Raises
+    ------
+    JobFileError
+        If the file can't be read or holds an invalid job.
+    """
+    try:
+        if path.endswith('.toml'):
+            try:
+                import tomllib
+            except ImportError:
+                raise JobFileError('TOML job files need Python 3.11 or later, use JSON lines instead')
+            with open(path, 'rb') as f_jobs:
+                entries = tomllib.load(f_jobs).get('job', [])
+            if not isinstance(entries, list):
+                raise JobFileError(f'{path}: jobs must be [[job]] tables')
+            return [BatchJob.from_dict(entry, f'{path}: job {number}') for number, entry in enumerate(entries, 1)]
+        jobs = []
+        with open(path, encoding='utf-8') as f_jobs:
+            for number, line in enumerate(f_jobs, 1):
+                if not line.strip() or line.lstrip().startswith('#'):
+                    continue
+                try:
+                    values = json.loads(line)
+                except ValueError as e:
+                    raise JobFileError(f'{path}: line {number}: {e}')
+                jobs.append(BatchJob.from_dict(values, f'{path}: line {number}'))
+        return jobs
+    except OSError as e:
+        raise JobFileError(f'Could not read {path}: {e.strerror}')
+    except ValueError as e:
+        if isinstance(e, JobFileError):
+            raise
+        raise JobFileError(f'{path} is not valid: {e}')
+
+
+def run_job(job: BatchJob, search: Callable[[str], list[Movie | Series]],
+            download: Callable[[Movie | Series, int | None, Callable[[str], None] | None, str], list[DownloadJob]],
+            on_state: Callable[[str], None] | None = None) -> dict:
+    """Find, resolve and download the title of a job.
+
+    Parameters
+    ----------
+    job : BatchJob
+        The job.
+    search : Callable[[str], list[Movie | Series]]
+        Function searching the providers.
+    download : Callable[[Movie | Series, int | None, Callable[[str], None] | None, str], list[DownloadJob]]
+        Function downloading a movie or the episodes of a series in a
+        quality, returning a job per movie or episode. It is given
+        ``on_state`` to report when the downloads and conversions start,
+        and the priority class of the job.
+    on_state : Callable[[str], None] | None, optional
+        Called with ``resolving``, ``downloading`` and ``remuxing`` as the
+        job gets there, by default None
+
+    Returns
+    -------
+    dict
+        Entry of the report: the job, its ``status`` (``done``, ``partial``,
+        ``failed`` or ``not_found``), the result downloaded, the ``items``
+        downloaded with their status, ``missing`` episodes and ``error``.
+    """
+    entry = {'job': job.describe(), 'status': 'failed', 'match': None, 'items': [], 'missing': [], 'error': None}
+    if on_state is not None:
+        on_state('resolving')
+    matches = [result for result in search(job.title) if job.matches(result)]
+    if not matches:
+        entry['status'] = 'not_found'
+        return entry
+    # Results are ordered by the rank of their provider.
+    content = matches[0]
+    entry['match'] = {'title': content.title, 'year': content.year, 'provider': content.provider.name,
+                      'link': content.link}
+    if content.provider.update_info(content) is False:
+        entry['error'] = 'Failed to get info'
+        return entry
+    if isinstance(content, Series):
+        content.seasons, entry['missing'] = job.select(content.seasons)
+        if not content.seasons:
+            entry['status'] = 'not_found'
+            return entry
+    for item in download(content, job.quality, on_state, job.priority):
+        entry['items'].append({'name': item.name, 'status': 'done' if item.result else 'failed',
+                               'error': str(item.error) if item.error is not None else None})
+    done = sum(item['status'] == 'done' for item in entry['items'])
+    if done == len(entry['items']) and not entry['missing']:
+        entry['status'] = 'done'
+    elif done:
+        entry['status'] = 'partial'
+    return entry
+
+
+def write_report(path: str, entries: list[dict], started: float) -> None:
+    """Write the report of a batch.
+
+    Parameters
+    ----------
+    path : str
+        Path of the JSON report.
+    entries : list[dict]
+        Entries of the jobs that have finished, see ``run_job``.
+    started : float
+        Time the batch started, as a UNIX timestamp.
+    """
+    statuses = [entry['status'] for entry in entries]
+    report = {
+        'started': started,
+        'updated': time.time(),
+        'summary': {status: statuses.count(status) for status in ('done', 'partial', 'failed', 'not_found')},
+        'jobs': entries,
+    }
+    with open(path+'.tmp', 'w', encoding='utf-8') as f_report:
+        json.dump(report, f_report, indent=2, ensure_ascii=False)
+    os.replace(path+'.tmp', path)
+
+
+def run_batch(jobs: list[BatchJob], search: Callable[[str], list[Movie | Series]],
+              download: Callable[[Movie | Series, int | None, Callable[[str], None] | None, str], list[DownloadJob]],
+              report_path: str, parallel: int = DEFAULT_PARALLEL_JOBS) -> list[dict]:
+    """Run the jobs of a batch, a few at a time.
+
+    The report is written again every time a job finishes, so an
+    interrupted batch still leaves the report of the jobs that finished.
+
+    Parameters
+    ----------
+    jobs : list[BatchJob]
+        The jobs.
+    search : Callable[[str], list[Movie | Series]]
+        Function searching the providers.
+    download : Callable[[Movie | Series, int | None, Callable[[str], None] | None, str], list[DownloadJob]]
+        Function downloading a movie or the episodes of a series, see
+        ``run_job``.
+    report_path : str
+        Path of the JSON report.
+    parallel : int, optional
+        Number of jobs running at the same time, by default
+        DEFAULT_PARALLEL_JOBS
+
+    Returns
+    -------
+    list[dict]
+        Entry of every job, in the order of the jobs.
+    """
+    started = time.time()
+    entries: list[dict | None] = [None]*len(jobs)
+    lock = threading.Lock()
+    write_report(report_path, [], started)
+
+    def run(index: int) -> None:
+        try:
+            entry = run_job(jobs[index], search, download)
+        except Exception as e:
+            entry = {'job': jobs[index].describe(), 'status': 'failed', 'match': None, 'items': [],
+                     'missing': [], 'error': str(e)}
+        with lock:
+            entries[index] = entry
+            write_report(report_path, [entry for entry in entries if entry is not None], started)
+
+    scheduler = DownloadScheduler(parallel)
+    for index, job in enumerate(jobs):
+        scheduler.add(job.title, functools.partial(run, index), priority=index)
+    scheduler.run()
+    return entries
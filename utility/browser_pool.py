@@ -0,0 +1,149 @@
+import atexit
+import contextlib
+import functools
+import threading
+from collections.abc import Iterator
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options as ChromeOptions
+from selenium.webdriver.chrome.service import Service as ChromeService
+from webdriver_manager.chrome import ChromeDriverManager
+
+# Default number of browsers kept open.
+DEFAULT_POOL_SIZE = 2
+
+
+@functools.lru_cache(maxsize=None)
+def driver_path() -> str:
+    """Get the path of chromedriver, installing it if needed.
+
+    The version check of ``webdriver_manager`` runs once per process.
+
+    Returns
+    -------
+    str
+        Path of the chromedriver executable.
+    """
+    return ChromeDriverManager().install()
+
+
+class BrowserPool:
+    """Pool of headless Chrome browsers kept open between lookups.
+
+    Starting Chrome takes seconds, while loading a page in a browser that is
+    already running takes a fraction of that. Browsers are started when they
+    are first needed, up to ``size`` of them, and handed out one at a time.
+    Each keeps its tab and cookies, so a captcha solved once stays solved.
+
+    Attributes
+    ----------
+    options : ChromeOptions
+        Options the browsers are started with.
+    size : int
+        Maximum number of browsers open at the same time.
+
+    Methods
+    -------
+    browser() -> Iterator[webdriver.Chrome]
+        Context manager borrowing a browser from the pool.
+    close() -> None
+        Quit every browser of the pool.
+    """
+
+    def __init__(self, options: ChromeOptions, size: int = DEFAULT_POOL_SIZE):
+        self.options = options
+        self.size = size
+        self._idle: list[webdriver.Chrome] = []
+        self._drivers: list[webdriver.Chrome] = []
+        # Browsers open or starting.
+        self._count = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        atexit.register(self.close)
+
+    @contextlib.contextmanager
+    def browser(self) -> Iterator[webdriver.Chrome]:
+        """Context manager borrowing a browser from the pool.
+
+        The browser goes back to the pool when the block ends. If the block
+        raises a ``WebDriverException`` the browser is assumed to be broken
+        and is quit instead.
+
+        Yields
+        ------
+        webdriver.Chrome
+            A browser, with its tab on the last page it loaded.
+        """
+        driver = self._acquire()
+        try:
+            yield driver
+        except WebDriverException:
+            self._discard(driver)
+            raise
+        except BaseException:
+            self._release(driver)
+            raise
+        else:
+            self._release(driver)
+
+    def close(self) -> None:
+        """Quit every browser of the pool.
+
+        ``quit`` also stops the chromedriver process, which ``close`` leaves
+        running.
+        """
+        with self._condition:
+            self._closed = True
+            drivers, self._drivers, self._idle = self._drivers, [], []
+            self._condition.notify_all()
+        for driver in drivers:
+            with contextlib.suppress(Exception):
+                driver.quit()
+
+    def _acquire(self) -> webdriver.Chrome:
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError('The browser pool is closed')
+                if self._idle:
+                    return self._idle.pop()
+                if self._count < self.size:
+                    self._count += 1
+                    break
+                self._condition.wait()
+        # Chrome is started outside the lock, other lookups may go on.
+        try:
+            driver = webdriver.Chrome(service=ChromeService(driver_path()), options=self.options)
+        except BaseException:
+            with self._condition:
+                self._count -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            if not self._closed:
+                self._drivers.append(driver)
+                return driver
+        driver.quit()
+        raise RuntimeError('The browser pool is closed')
+
+    def _release(self, driver: webdriver.Chrome) -> None:
+        with contextlib.suppress(WebDriverException):
+            # The next lookup starts on the page, not inside a frame.
+            driver.switch_to.default_content()
+        with self._condition:
+            if not self._closed:
+                self._idle.append(driver)
+                self._condition.notify()
+                return
+        with contextlib.suppress(Exception):
+            driver.quit()
+
+    def _discard(self, driver: webdriver.Chrome) -> None:
+        with self._condition:
+            if driver in self._drivers:
+                self._drivers.remove(driver)
+            self._count -= 1
+            self._condition.notify()
+        with contextlib.suppress(Exception):
+            driver.quit()
@@ -0,0 +1,206 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+from utility.content import Episode, Movie, Series
+
+# Default path of the metadata cache.
+DEFAULT_CACHE_PATH = os.path.join('.cache', 'metadata.sqlite')
+# Least number of seconds a cached hash must still be valid for to be used,
+# so that downloads don't start with a hash that is about to expire.
+MIN_HASH_TTL = 300
+
+
+class TTLCache:
+    """In-memory cache that drops the least recently used entries and the expired ones.
+
+    Attributes
+    ----------
+    maxsize : int
+        Maximum number of entries.
+    ttl : float
+        Seconds an entry stays valid.
+
+    Methods
+    -------
+    get(key: Any, default: Any = None) -> Any
+        Get the value of a key.
+    set(key: Any, value: Any) -> None
+        Set the value of a key.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """Get the value of a key.
+
+        Parameters
+        ----------
+        key : Any
+            The key.
+        default : Any, optional
+            Value returned if the key is missing or expired, by default None
+
+        Returns
+        -------
+        Any
+            The value.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if time.monotonic() > entry[0]:
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: Any, value: Any) -> None:
+        """Set the value of a key.
+
+        Parameters
+        ----------
+        key : Any
+            The key.
+        value : Any
+            The value.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic()+self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key, self) is not self
+
+
+class MetadataCache:
+    """Persistent cache of the metadata of movies and series.
+
+    Entries are keyed by the link of the content and hold its frame link,
+    id, hash, expiry and episodes. The episodes are kept until the content
+    is looked up again, while the hash is only used until its expiry.
+
+    Attributes
+    ----------
+    path : str
+        Path of the sqlite database.
+
+    Methods
+    -------
+    load(content: Movie | Series) -> bool
+        Fill the metadata of the content from the cache.
+    store(content: Movie | Series) -> None
+        Store the metadata of the content.
+    store_hash(content: Movie | Series) -> None
+        Store a new hash and expiry of the content.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Opened on first use, so that importing doesn't create the file.
+        if self._connection is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS content ('
+                'link TEXT PRIMARY KEY, frame_link TEXT, id INTEGER, hash TEXT, '
+                'expiry INTEGER, seasons TEXT, updated REAL)')
+        return self._connection
+
+    def load(self, content: Movie | Series) -> bool:
+        """Fill the metadata of the content from the cache.
+
+        The frame link, id and episodes are filled whenever the content is
+        cached. The hash and expiry are only filled if the hash is valid for
+        at least ``MIN_HASH_TTL`` more seconds.
+
+        Parameters
+        ----------
+        content : Movie | Series
+            Content to fill, looked up by its link.
+
+        Returns
+        -------
+        bool
+            True if every field was filled, so the content needs no lookup.
+        """
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    'SELECT frame_link, id, hash, expiry, seasons FROM content WHERE link = ?',
+                    (content.link,)).fetchone()
+        except sqlite3.Error:
+            return False
+        if row is None:
+            return False
+        frame_link, id, hash, expiry, seasons = row
+        content.frame_link = frame_link
+        if isinstance(content, Movie):
+            content.id = id
+        else:
+            content.seasons = {int(season): [Episode(number, title, id) for number, title, id in episodes]
+                               for season, episodes in json.loads(seasons).items()}
+        if expiry-time.time() < MIN_HASH_TTL:
+            return False
+        content.hash = hash
+        content.expiry = expiry
+        return True
+
+    def store(self, content: Movie | Series) -> None:
+        """Store the metadata of the content.
+
+        Parameters
+        ----------
+        content : Movie | Series
+            Content whose metadata was looked up.
+        """
+        seasons = None
+        if isinstance(content, Series):
+            seasons = json.dumps({season: [[episode.number, episode.title, episode.id] for episode in episodes]
+                                  for season, episodes in content.seasons.items()})
+        try:
+            with self._lock:
+                with self._connect() as connection:
+                    connection.execute(
+                        'INSERT OR REPLACE INTO content VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (content.link, content.frame_link, getattr(content, 'id', None), content.hash,
+                         content.expiry, seasons, time.time()))
+        except sqlite3.Error:
+            # The cache only saves time, a download never fails because of it.
+            pass
+
+    def store_hash(self, content: Movie | Series) -> None:
+        """Store a new hash and expiry of the content.
+
+        The episodes stored stay as they are, as ``content.seasons`` may only
+        hold the episodes chosen for download.
+
+        Parameters
+        ----------
+        content : Movie | Series
+            Content whose hash was refreshed.
+        """
+        try:
+            with self._lock:
+                with self._connect() as connection:
+                    connection.execute(
+                        'UPDATE content SET hash = ?, expiry = ?, updated = ? WHERE link = ?',
+                        (content.hash, content.expiry, time.time(), content.link))
+        except sqlite3.Error:
+            pass
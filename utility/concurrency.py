@@ -0,0 +1,176 @@
+import threading
+import time
+
+# Number of segments downloaded at once when a download starts.
+DEFAULT_INITIAL_LIMIT = 4
+
+
+class AdaptiveLimiter:
+    """Adapt the number of segments downloaded at once to the connection.
+
+    The limiter works in rounds. A round ends once as many segments have
+    completed as the current limit allows in flight, and the throughput of
+    the round is compared with the best one seen so far:
+
+    - while the throughput keeps improving the limit grows, doubling at the
+      start of the download and by one after the first round without gain;
+    - if the throughput falls clearly below the best one the limit shrinks
+      by one;
+    - an error, or a 429/503 response, halves the limit at once.
+
+    The best throughput slowly decays so that the limiter keeps probing when
+    the conditions of the connection change.
+
+    Attributes
+    ----------
+    minimum : int
+        Lowest limit.
+    maximum : int
+        Highest limit.
+    throughput : float
+        Throughput of the last complete round, in bytes per second.
+    latency : float
+        Average time to download a segment in the last complete round, in
+        seconds.
+
+    Methods
+    -------
+    limit -> int
+        Current number of segments that may be downloaded at once.
+    on_success(size: int, latency: float) -> None
+        Record a segment that has been downloaded.
+    on_error(throttled: bool = False) -> None
+        Record a failed request.
+    """
+
+    # Relative gain needed to count a round as an improvement.
+    increase_threshold = 0.05
+    # Relative loss below the best throughput that makes the limit shrink.
+    decrease_threshold = 0.2
+    # Factor applied to the best throughput after every round.
+    decay = 0.98
+
+    def __init__(self, maximum: int, minimum: int = 1, initial: int = DEFAULT_INITIAL_LIMIT):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.throughput = 0.0
+        self.latency = 0.0
+        self._limit = min(max(initial, minimum), self.maximum)
+        self._slow_start = True
+        self._best = 0.0
+        self._lock = threading.Lock()
+        self._reset_round()
+
+    @property
+    def limit(self) -> int:
+        """Current number of segments that may be downloaded at once."""
+        return self._limit
+
+    def on_success(self, size: int, latency: float) -> None:
+        """Record a segment that has been downloaded.
+
+        Parameters
+        ----------
+        size : int
+            Size of the segment in bytes.
+        latency : float
+            Time it took to download the segment, in seconds.
+        """
+        with self._lock:
+            self._round_bytes += size
+            self._round_latency += latency
+            self._round_count += 1
+            if self._round_count >= self._limit:
+                self._end_round()
+
+    def on_error(self, throttled: bool = False) -> None:
+        """Record a failed request.
+
+        The limit is halved at most once per round, so that a burst of
+        errors caused by the same overload does not drop it to the minimum.
+
+        Parameters
+        ----------
+        throttled : bool, optional
+            True if the server answered with 429 or 503, by default False
+        """
+        with self._lock:
+            if self._round_error:
+                return
+            self._round_error = True
+            self._slow_start = False
+            self._limit = max(self.minimum, self._limit//2)
+            if throttled:
+                # The old best was reached at a rate the server refuses now.
+                self._best = 0.0
+
+    def _end_round(self) -> None:
+        elapsed = max(time.monotonic()-self._round_start, 1e-6)
+        self.throughput = self._round_bytes/elapsed
+        self.latency = self._round_latency/self._round_count
+        if self._round_error:
+            pass
+        elif self.throughput > self._best*(1+self.increase_threshold):
+            self._best = self.throughput
+            if self._slow_start:
+                self._limit = min(self.maximum, self._limit*2)
+            else:
+                self._limit = min(self.maximum, self._limit+1)
+        else:
+            self._slow_start = False
+            if self.throughput < self._best*(1-self.decrease_threshold):
+                self._limit = max(self.minimum, self._limit-1)
+        self._best *= self.decay
+        self._reset_round()
+
+    def _reset_round(self) -> None:
+        self._round_start = time.monotonic()
+        self._round_bytes = 0
+        self._round_latency = 0.0
+        self._round_count = 0
+        self._round_error = False
+
+
+class ThroughputEstimator:
+    """Moving average of the throughput of finished downloads.
+
+    Attributes
+    ----------
+    weight : float
+        Weight of the newest measurement in the average.
+
+    Methods
+    -------
+    value -> float | None
+        Estimated throughput in bytes per second.
+    add(throughput: float) -> None
+        Add a measurement.
+    """
+
+    def __init__(self, weight: float = 0.5):
+        self.weight = weight
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> float | None:
+        """Estimated throughput in bytes per second, None until measured."""
+        return self._value
+
+    def add(self, throughput: float) -> None:
+        """Add a measurement.
+
+        Parameters
+        ----------
+        throughput : float
+            Throughput of a download in bytes per second.
+        """
+        with self._lock:
+            if self._value is None:
+                self._value = throughput
+            else:
+                self._value = self.weight*throughput+(1-self.weight)*self._value
+
+
+# Throughput of the downloads of this process, used to pick variant streams.
+throughput = ThroughputEstimator()
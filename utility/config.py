@@ -0,0 +1,201 @@
+import functools
+import json
+
+# Default path of the config file.
+CONFIG_PATH = 'Config.json'
+# Download qualities the providers offer.
+QUALITIES = (1080, 720, 480)
+# Engines that download segments, see ``Config.download_engine``.
+ENGINES = ('thread', 'async')
+# Default number of segments that may be downloading or waiting to be
+# written at the same time. This is also the upper bound on how many
+# segments are held in memory during a download.
+DEFAULT_WINDOW = 16
+# Default number of downloads that run at the same time.
+DEFAULT_PARALLEL_DOWNLOADS = 3
+# Seconds to wait for the server to accept the connection and to send data.
+DEFAULT_TIMEOUT = 30
+# Number of times a request is retried on connection errors and on 500, 502
+# and 504 responses before giving up.
+DEFAULT_RETRIES = 3
+# Default maximum number of open connections to a single host, shared by
+# every download running in the process.
+DEFAULT_CONNECTIONS_PER_HOST = 32
+
+
+class ConfigError(ValueError):
+    """Raised when the config file is missing or holds an invalid value."""
+
+
+class Config:
+    """Settings read from the config file.
+
+    Attributes
+    ----------
+    tmdb_api_key : str
+        Key of the TMDB API.
+    download_quality : int
+        Wanted quality, one of ``QUALITIES``.
+    download_window : int
+        Maximum number of segments downloading or waiting to be written.
+    adaptive_concurrency : bool
+        Adjust the number of segments downloaded at once during a download.
+    stream_remux : bool
+        Pipe segments into FFmpeg during the download.
+    download_engine : str
+        Engine downloading segments, one of ``ENGINES``.
+    connections_per_host : int
+        Maximum number of connections to a host with the ``async`` engine.
+    request_timeout : float
+        Seconds to wait for a server before a request fails.
+    request_retries : int
+        Number of retries of a failed request.
+    parallel_downloads : int
+        Number of episodes downloaded at the same time.
+    max_segments_in_flight : int
+        Maximum number of segments downloading at once, 0 for no limit.
+    max_bytes_per_second : float
+        Maximum download rate, 0 for no limit.
+    max_requests_per_second : float
+        Maximum number of requests sent per second, 0 for no limit.
+    verify_segments : bool
+        Check segments are MPEG-TS when downloaded and before resuming.
+    hash_segments : bool
+        Record a hash of every segment in the manifest.
+
+    Methods
+    -------
+    from_dict(values: dict) -> Config
+        Make a config from the values of a config file.
+    """
+
+    def __init__(self, tmdb_api_key: str = '', download_quality: int = QUALITIES[0],
+                 download_window: int = DEFAULT_WINDOW, adaptive_concurrency: bool = True,
+                 stream_remux: bool = False, download_engine: str = ENGINES[0],
+                 connections_per_host: int = DEFAULT_CONNECTIONS_PER_HOST,
+                 request_timeout: float = DEFAULT_TIMEOUT, request_retries: int = DEFAULT_RETRIES,
+                 parallel_downloads: int = DEFAULT_PARALLEL_DOWNLOADS, max_segments_in_flight: int = 0,
+                 max_bytes_per_second: float = 0, max_requests_per_second: float = 0,
+                 verify_segments: bool = True, hash_segments: bool = False):
+        self.tmdb_api_key = tmdb_api_key
+        self.download_quality = download_quality
+        self.download_window = download_window
+        self.adaptive_concurrency = adaptive_concurrency
+        self.stream_remux = stream_remux
+        self.download_engine = download_engine
+        self.connections_per_host = connections_per_host
+        self.request_timeout = request_timeout
+        self.request_retries = request_retries
+        self.parallel_downloads = parallel_downloads
+        self.max_segments_in_flight = max_segments_in_flight
+        self.max_bytes_per_second = max_bytes_per_second
+        self.max_requests_per_second = max_requests_per_second
+        self.verify_segments = verify_segments
+        self.hash_segments = hash_segments
+
+    @classmethod
+    def from_dict(cls, values: dict) -> 'Config':
+        """Make a config from the values of a config file.
+
+        Parameters
+        ----------
+        values : dict
+            Values by key. ``download_quality`` is required, the other keys
+            have defaults.
+
+        Returns
+        -------
+        Config
+            The config.
+
+        Raises
+        ------
+        ConfigError
+            If a value is missing or invalid, with a message for the user.
+        """
+        try:
+            download_quality = int(values['download_quality'])
+            assert download_quality in QUALITIES
+        except (KeyError, AssertionError, TypeError, ValueError):
+            raise ConfigError('Invalid download quality! Valid Options- 1080, 720, 480')
+        try:
+            download_window = int(values.get('download_window', DEFAULT_WINDOW))
+            assert download_window > 0
+        except (AssertionError, TypeError, ValueError):
+            raise ConfigError('Invalid download window! It must be a positive integer')
+        try:
+            parallel_downloads = int(values.get('parallel_downloads', DEFAULT_PARALLEL_DOWNLOADS))
+            max_segments_in_flight = int(values.get('max_segments_in_flight', 0))
+            max_bytes_per_second = float(values.get('max_bytes_per_second', 0))
+            max_requests_per_second = float(values.get('max_requests_per_second', 0))
+            assert parallel_downloads > 0 and max_segments_in_flight >= 0 and max_bytes_per_second >= 0
+            assert max_requests_per_second >= 0
+        except (AssertionError, TypeError, ValueError):
+            raise ConfigError('Invalid parallel downloads or download limits in Config.json!')
+        try:
+            request_timeout = float(values.get('request_timeout', DEFAULT_TIMEOUT))
+            request_retries = int(values.get('request_retries', DEFAULT_RETRIES))
+            assert request_timeout > 0 and request_retries >= 0
+        except (AssertionError, TypeError, ValueError):
+            raise ConfigError('Invalid request timeout or retries in Config.json!')
+        try:
+            download_engine = values.get('download_engine', ENGINES[0])
+            connections_per_host = int(values.get('connections_per_host', DEFAULT_CONNECTIONS_PER_HOST))
+            assert download_engine in ENGINES and connections_per_host > 0
+        except (AssertionError, TypeError, ValueError):
+            raise ConfigError('Invalid download engine or connections per host in Config.json!')
+        adaptive_concurrency = values.get('adaptive_concurrency', True)
+        stream_remux = values.get('stream_remux', False)
+        verify_segments = values.get('verify_segments', True)
+        hash_segments = values.get('hash_segments', False)
+        # Only true and false, so that "false" in the file isn't read as on.
+        if not all(isinstance(value, bool)
+                   for value in (adaptive_concurrency, stream_remux, verify_segments, hash_segments)):
+            raise ConfigError('Invalid adaptive_concurrency, stream_remux, verify_segments or hash_segments '
+                              'in Config.json! They must be true or false')
+        return cls(
+            tmdb_api_key=str(values.get('TMDB_API_KEY', '')),
+            download_quality=download_quality,
+            download_window=download_window,
+            adaptive_concurrency=adaptive_concurrency,
+            stream_remux=stream_remux,
+            download_engine=download_engine,
+            connections_per_host=connections_per_host,
+            request_timeout=request_timeout,
+            request_retries=request_retries,
+            parallel_downloads=parallel_downloads,
+            max_segments_in_flight=max_segments_in_flight,
+            max_bytes_per_second=max_bytes_per_second,
+            max_requests_per_second=max_requests_per_second,
+            verify_segments=verify_segments,
+            hash_segments=hash_segments,
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def load_config(path: str = CONFIG_PATH) -> Config:
+    """Read and validate the config file, once per path.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path of the config file, by default CONFIG_PATH
+
+    Returns
+    -------
+    Config
+        The config.
+
+    Raises
+    ------
+    ConfigError
+        If the file is missing, isn't valid JSON or holds an invalid value.
+    """
+    try:
+        with open(path) as config_file:
+            values = json.load(config_file)
+    except FileNotFoundError:
+        raise ConfigError(f'{path} not found!')
+    except ValueError:
+        raise ConfigError(f'{path} is not valid JSON!')
+    return Config.from_dict(values)
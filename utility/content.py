@@ -1,11 +1,131 @@
+import atexit
+import concurrent.futures
+import functools
 import json
+import os
+import threading
+from types import ModuleType
+from typing import Callable
 
-import tmdbsimple as tmdb
+from utility import ratelimit
+from utility.config import load_config
 
-with open("Config.json") as config_file:
-    config = json.load(config_file)
+# Default path of the synopsis cache.
+SYNOPSIS_CACHE_PATH = os.path.join('.cache', 'synopses.json')
+NO_SYNOPSIS = "No synopsis found"
+# Number of synopses fetched at once.
+SYNOPSIS_WORKERS = 4
+# Requests per second sent to TMDB for synopses, well under its rate limit.
+SYNOPSIS_RATE = 10
 
-tmdb.API_KEY = config["TMDB_API_KEY"]
+
+class SynopsisCache:
+    """Cache of synopses, kept in memory and saved to a JSON file.
+
+    Attributes
+    ----------
+    path : str
+        Path of the JSON file.
+
+    Methods
+    -------
+    get(key: str) -> str | None
+        Get a synopsis.
+    set(key: str, synopsis: str) -> None
+        Set a synopsis.
+    save() -> None
+        Save the cache if it has changed.
+    """
+
+    def __init__(self, path: str = SYNOPSIS_CACHE_PATH):
+        self.path = path
+        self._synopses: dict[str, str] | None = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        """Get a synopsis.
+
+        Parameters
+        ----------
+        key : str
+            Key of the content, see ``Content.synopsis_key``.
+
+        Returns
+        -------
+        str | None
+            The synopsis, None if it isn't cached.
+        """
+        with self._lock:
+            return self._load().get(key)
+
+    def set(self, key: str, synopsis: str) -> None:
+        """Set a synopsis.
+
+        Parameters
+        ----------
+        key : str
+            Key of the content, see ``Content.synopsis_key``.
+        synopsis : str
+            The synopsis.
+        """
+        with self._lock:
+            self._load()[key] = synopsis
+            self._dirty = True
+
+    def save(self) -> None:
+        """Save the cache if it has changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path+'.tmp', 'w', encoding='utf-8') as f_cache:
+                    json.dump(self._synopses, f_cache, ensure_ascii=False)
+                os.replace(self.path+'.tmp', self.path)
+                self._dirty = False
+            except OSError:
+                # The cache only saves requests.
+                pass
+
+    def _load(self) -> dict[str, str]:
+        # Read on first use, so that importing stays fast.
+        if self._synopses is None:
+            try:
+                with open(self.path, encoding='utf-8') as f_cache:
+                    self._synopses = json.load(f_cache)
+            except (OSError, ValueError):
+                self._synopses = {}
+        return self._synopses
+
+
+# Synopses fetched by this installation.
+synopses = SynopsisCache()
+atexit.register(synopses.save)
+# Shared by every batch, so that batches can't exceed the rate together.
+synopsis_rate = ratelimit.TokenBucket(rate=SYNOPSIS_RATE)
+synopsis_executor = concurrent.futures.ThreadPoolExecutor(max_workers=SYNOPSIS_WORKERS)
+
+
+@functools.lru_cache(maxsize=None)
+def get_tmdb() -> ModuleType:
+    """Get ``tmdbsimple``, set up with the API key and the shared session.
+
+    It is only imported on first use, as importing it and ``requests`` is a
+    large part of the startup time.
+
+    Returns
+    -------
+    ModuleType
+        The ``tmdbsimple`` module.
+    """
+    import tmdbsimple as tmdb
+
+    from utility import session
+    tmdb.API_KEY = load_config().tmdb_api_key
+    tmdb.REQUESTS_SESSION = session.session
+    return tmdb
 
 
 class Content:
@@ -27,6 +147,8 @@ class Content:
         Expiry of the content.
     frame_link : str
         Link to the frame of the content.
+    synopsis : str | None
+        Synopsis of the content, None until it is fetched.
 
     Methods
     -------
@@ -42,17 +164,46 @@ class Content:
         self.hash = ''
         self.expiry = 0
         self.frame_link = ''
+        self.synopsis = None
+
+    @property
+    def synopsis_key(self) -> str:
+        """Key of the synopsis of the content, its type, title and year."""
+        kind = 'movie' if isinstance(self, Movie) else 'series'
+        return f'{kind}|{self.title.strip().lower()}|{self.year}'
 
     def get_synopsis(self) -> str:
-        if isinstance(self, Movie):
-            result = tmdb.Search().movie(query=self.title, include_adult=True, year=self.year)
-        else:
-            result = tmdb.Search().tv(query=self.title, include_adult=True,
-                                      first_air_date_year=self.year)
-        try:
-            return result["results"][0]["overview"]
-        except:
-            return "No synopsis found"
+        """Get the synopsis of the content, from the cache or TMDB.
+
+        Returns
+        -------
+        str
+            The synopsis, ``NO_SYNOPSIS`` if there is none or TMDB can't be
+            reached.
+        """
+        synopsis = synopses.get(self.synopsis_key)
+        if synopsis is None:
+            tmdb = get_tmdb()
+            import requests
+            synopsis_rate.consume(1)
+            ratelimit.request_rate.consume(1)
+            try:
+                if isinstance(self, Movie):
+                    result = tmdb.Search().movie(query=self.title, include_adult=True, year=self.year)
+                else:
+                    result = tmdb.Search().tv(query=self.title, include_adult=True,
+                                              first_air_date_year=self.year)
+            except requests.exceptions.RequestException:
+                # Not cached, so it is asked again next time.
+                self.synopsis = NO_SYNOPSIS
+                return self.synopsis
+            try:
+                synopsis = result["results"][0]["overview"] or NO_SYNOPSIS
+            except (KeyError, IndexError):
+                synopsis = NO_SYNOPSIS
+            synopses.set(self.synopsis_key, synopsis)
+        self.synopsis = synopsis
+        return synopsis
 
 
 class Movie(Content):
@@ -161,6 +312,48 @@ class Series(Content):
             provider: {self.provider}, seasons: {self.seasons}, hash: {self.hash}, expiry: {self.expiry}, frame_link: {self.frame_link}"
 
 
+def fetch_synopses(contents: list[Content],
+                   callback: Callable[[Content], None] | None = None) -> list[concurrent.futures.Future]:
+    """Fetch the synopses of contents in the background.
+
+    Cached synopses are set at once, the others are fetched concurrently, in
+    the order of the contents, under a shared rate limit. Contents with the
+    same type, title and year share a request.
+
+    Parameters
+    ----------
+    contents : list[Content]
+        Contents whose ``synopsis`` is set.
+    callback : Callable[[Content], None] | None, optional
+        Called with every content once its synopsis is set, possibly from
+        another thread, by default None
+
+    Returns
+    -------
+    list[concurrent.futures.Future]
+        Futures of the requests, which can be cancelled if the synopses are
+        no longer needed.
+    """
+    pending: dict[str, list[Content]] = {}
+    for content in contents:
+        synopsis = synopses.get(content.synopsis_key)
+        if synopsis is None:
+            pending.setdefault(content.synopsis_key, []).append(content)
+            continue
+        content.synopsis = synopsis
+        if callback is not None:
+            callback(content)
+
+    def fetch(group: list[Content]) -> None:
+        synopsis = group[0].get_synopsis()
+        for content in group:
+            content.synopsis = synopsis
+            if callback is not None:
+                callback(content)
+
+    return [synopsis_executor.submit(fetch, group) for group in pending.values()]
+
+
 if __name__ == "__main__":
     mov = Movie("Into the Wild", 2009, "", None)
     print(mov.get_synopsis())
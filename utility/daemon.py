@@ -0,0 +1,403 @@
+import functools
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utility import ratelimit
+from utility.batch import DEFAULT_JOB_PRIORITY, BatchJob, JobFileError
+from utility.job_queue import DEFAULT_QUEUE_PATH, STATES, JobQueue
+
+# Default port of the API of the service. It only listens on localhost.
+DEFAULT_PORT = 8790
+# Default number of worker processes, each running one job at a time.
+DEFAULT_WORKERS = 2
+# Folder of the logs of the worker processes.
+DEFAULT_LOG_DIR = os.path.join('.cache', 'logs')
+# Seconds an idle worker waits before looking for a queued job again.
+POLL_INTERVAL = 2
+# Seconds between two checks that every worker process is still running.
+MONITOR_INTERVAL = 5
+# Longest time a worker that keeps stopping without a job, e.g. because it
+# can't start, waits before it is started again.
+MAX_RESTART_DELAY = 300
+# Seconds between two updates of the share of the download limits of a
+# worker, as limits change and jobs start and end.
+LIMITS_INTERVAL = 2
+# Seconds the workers are given to finish their job when the service stops.
+# Jobs still running are queued again when the service starts.
+SHUTDOWN_TIMEOUT = 10
+# Largest request body the API accepts, in bytes.
+MAX_BODY_SIZE = 1 << 20
+
+
+def share_limits(queue: JobQueue, worker: int, applied: tuple | None = None) -> tuple:
+    """Apply the share of the download limits of a worker process.
+
+    The limits of the service are shared by the running jobs in proportion
+    to the weight of their priority class, so an interactive job gets most
+    of the bandwidth while batch jobs get the rest. A worker without a job
+    gets the share of a batch job. The limits are only applied if they
+    changed, as changing them disturbs the downloads running.
+
+    Parameters
+    ----------
+    queue : JobQueue
+        The job queue, holding the limits and the running jobs.
+    worker : int
+        Process id of the worker.
+    applied : tuple | None, optional
+        Share returned by the previous call, by default None
+
+    Returns
+    -------
+    tuple
+        Share of the limits of the worker, as arguments of
+        ``ratelimit.configure``.
+    """
+    limits = queue.get_limits()
+    jobs = queue.running()
+    own = [job for job in jobs if job['worker'] == worker]
+    weights = [ratelimit.PRIORITY_WEIGHTS[job['job'].get('priority', DEFAULT_JOB_PRIORITY)] for job in jobs]
+    if own:
+        weight = ratelimit.PRIORITY_WEIGHTS[own[0]['job'].get('priority', DEFAULT_JOB_PRIORITY)]
+    else:
+        weight = ratelimit.PRIORITY_WEIGHTS[DEFAULT_JOB_PRIORITY]
+        weights.append(weight)
+    share = weight/sum(weights)
+    values = (
+        max(1, round(limits['max_segments_in_flight']*share)) if limits['max_segments_in_flight'] else 0,
+        limits['max_bytes_per_second']*share,
+        limits['max_requests_per_second']*share
+    )
+    if values != applied:
+        ratelimit.configure(*values)
+    return values
+
+
+def work(queue_path: str, run: Callable[[dict, Callable[[str], None]], dict], initializer: Callable[[], None] | None,
+         log_dir: str) -> None:
+    """Run queued jobs until the process gets SIGTERM.
+
+    Runs in a worker process, whose output goes to its own log file. The job
+    running when SIGTERM comes is finished first. The share of the download
+    limits of the worker is updated every ``LIMITS_INTERVAL`` seconds.
+
+    Parameters
+    ----------
+    queue_path : str
+        Path of the job queue.
+    run : Callable[[dict, Callable[[str], None]], dict]
+        Function running a job, given the job and a function to call with
+        its new state, and returning its report entry, see
+        ``utility.batch.run_job``.
+    initializer : Callable[[], None] | None
+        Function called once before the first job.
+    log_dir : str
+        Folder of the log file.
+    """
+    # The service stops the workers itself, Ctrl+C must not kill a download
+    # half way.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    os.makedirs(log_dir, exist_ok=True)
+    log = open(os.path.join(log_dir, f'worker-{os.getpid()}.log'), 'a', buffering=1, encoding='utf-8')
+    # File descriptors are redirected too, so that FFmpeg writes to the log.
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    sys.stdout = sys.stderr = log
+    if initializer is not None:
+        initializer()
+    queue = JobQueue(queue_path)
+    worker = os.getpid()
+
+    def update_limits() -> None:
+        applied = None
+        while True:
+            try:
+                applied = share_limits(queue, worker, applied)
+            except Exception as e:
+                print(f'Could not update the download limits: {e}')
+            if stop.wait(LIMITS_INTERVAL):
+                return
+
+    threading.Thread(target=update_limits, daemon=True).start()
+    while not stop.is_set():
+        job = queue.claim(worker)
+        if job is None:
+            stop.wait(POLL_INTERVAL)
+            continue
+        try:
+            entry = run(job['job'], functools.partial(queue.set_state, job['id']))
+        # Downloads exit when they can't go on, which only fails the job.
+        except (Exception, SystemExit) as e:
+            entry = {'job': job['job'], 'status': 'failed', 'match': None, 'items': [], 'missing': [],
+                     'error': str(e) or type(e).__name__}
+        queue.finish(job['id'], entry)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Handler of the requests of the API, see ``Daemon``."""
+
+    server: '_Server'
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body: dict | list) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _job_id(self) -> int | None:
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit():
+            return int(parts[1])
+        return None
+
+    def _read_json(self) -> dict | list | None:
+        # Replies with an error and returns None if the body isn't JSON.
+        if self.headers.get('Content-Length') is None:
+            self._reply(411, {'error': 'Content-Length required'})
+            return None
+        try:
+            length = int(self.headers['Content-Length'])
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._reply(400, {'error': 'Invalid Content-Length'})
+            return None
+        if length > MAX_BODY_SIZE:
+            self._reply(413, {'error': 'Request too large'})
+            return None
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self._reply(400, {'error': f'Invalid JSON: {e}'})
+            return None
+
+    def do_GET(self) -> None:
+        path, _, query = self.path.partition('?')
+        if path.rstrip('/') == '/limits':
+            self._reply(200, self.server.queue.get_limits())
+            return
+        if path.rstrip('/') == '/jobs':
+            state = dict(parameter.partition('=')[::2] for parameter in query.split('&') if parameter).get('state')
+            if state is not None and state not in STATES:
+                self._reply(400, {'error': f'state must be one of {", ".join(STATES)}'})
+                return
+            self._reply(200, self.server.queue.jobs(state))
+            return
+        id = self._job_id()
+        job = self.server.queue.get(id) if id is not None else None
+        if job is None:
+            self._reply(404, {'error': 'Not found'})
+            return
+        self._reply(200, job)
+
+    def do_POST(self) -> None:
+        if self.path.split('?')[0].rstrip('/') != '/jobs':
+            self._reply(404, {'error': 'Not found'})
+            return
+        values = self._read_json()
+        if values is None:
+            return
+        # A list submits several jobs at once, none if any is invalid.
+        entries = values if isinstance(values, list) else [values]
+        try:
+            for number, entry in enumerate(entries, 1):
+                BatchJob.from_dict(entry, f'job {number}')
+        except JobFileError as e:
+            self._reply(400, {'error': str(e)})
+            return
+        jobs = [self.server.queue.submit(entry) for entry in entries]
+        self._reply(201, jobs if isinstance(values, list) else jobs[0])
+
+    def do_PUT(self) -> None:
+        if self.path.split('?')[0].rstrip('/') != '/limits':
+            self._reply(404, {'error': 'Not found'})
+            return
+        values = self._read_json()
+        if values is None:
+            return
+        if not isinstance(values, dict):
+            self._reply(400, {'error': 'Limits must be an object'})
+            return
+        try:
+            self._reply(200, self.server.queue.set_limits(values))
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+
+    def do_DELETE(self) -> None:
+        id = self._job_id()
+        job = self.server.queue.get(id) if id is not None else None
+        if job is None:
+            self._reply(404, {'error': 'Not found'})
+            return
+        if not self.server.queue.cancel(id):
+            self._reply(409, {'error': f'Job is {job["state"]}, only queued jobs can be cancelled'})
+            return
+        self._reply(200, self.server.queue.get(id))
+
+
+class _Server(ThreadingHTTPServer):
+    """HTTP server of the API, holding the job queue of the service."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], queue: JobQueue):
+        super().__init__(address, _Handler)
+        self.queue = queue
+
+
+class Daemon:
+    """Long-running service downloading the jobs submitted to its API.
+
+    Jobs are kept in a ``JobQueue`` and run by worker processes, one job at
+    a time each, so a job that crashes its process doesn't stop the others.
+    A worker that stops is started again and its job queued again, and jobs
+    left running when the service stopped are queued again when it starts.
+    A worker that keeps stopping without a job is started again later and
+    later, up to ``MAX_RESTART_DELAY`` seconds.
+
+    The API listens on localhost:
+
+    - ``POST /jobs`` submits a job, or a list of jobs, as the entries of a
+      job file.
+    - ``GET /jobs`` lists the jobs, optionally only those in ``?state=``.
+    - ``GET /jobs/<id>`` gets a job, with its report entry once it ended.
+    - ``DELETE /jobs/<id>`` cancels a queued job.
+    - ``GET /limits`` gets the download limits shared by the workers, and
+      ``PUT /limits`` changes some of them while jobs run.
+
+    Attributes
+    ----------
+    run : Callable[[dict, Callable[[str], None]], dict]
+        Function running a job in a worker process, see ``work``. It must
+        be importable, as it is given to the worker processes.
+    initializer : Callable[[], None] | None
+        Function called once in every worker process before its first job.
+    workers : int
+        Number of worker processes.
+    port : int
+        Port of the API.
+    queue : JobQueue
+        The job queue.
+    log_dir : str
+        Folder of the logs of the worker processes.
+    limits : dict[str, float] | None
+        Download limits the service starts with, see ``JobQueue.set_limits``,
+        None to keep the limits of the last run.
+
+    Methods
+    -------
+    serve_forever() -> None
+        Start the workers and serve the API until interrupted.
+    stop() -> None
+        Stop the API and the workers.
+    """
+
+    def __init__(self, run: Callable[[dict, Callable[[str], None]], dict],
+                 initializer: Callable[[], None] | None = None, workers: int = DEFAULT_WORKERS,
+                 port: int = DEFAULT_PORT, queue_path: str = DEFAULT_QUEUE_PATH, log_dir: str = DEFAULT_LOG_DIR,
+                 limits: dict[str, float] | None = None):
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+        self.run = run
+        self.initializer = initializer
+        self.workers = workers
+        self.port = port
+        self.queue = JobQueue(queue_path)
+        self.log_dir = log_dir
+        self.limits = limits
+        # Worker processes are spawned rather than forked, as the API and
+        # monitor threads may be running when a worker is started again.
+        self._context = multiprocessing.get_context('spawn')
+        self._stop = threading.Event()
+        self._processes: list[multiprocessing.Process] = []
+        # Times every worker stopped without a job in a row, and when the
+        # stopped workers are started again, by index.
+        self._failures: list[int] = []
+        self._restart_at: dict[int, float] = {}
+        self._server: _Server | None = None
+
+    def _spawn(self) -> multiprocessing.Process:
+        process = self._context.Process(
+            target=work, args=(self.queue.path, self.run, self.initializer, self.log_dir),
+            daemon=True)
+        process.start()
+        return process
+
+    def _monitor(self) -> None:
+        while not self._stop.wait(MONITOR_INTERVAL):
+            for index, process in enumerate(self._processes):
+                if process.is_alive():
+                    continue
+                if index not in self._restart_at:
+                    if self.queue.requeue(process.pid):
+                        self._failures[index] = 0
+                    else:
+                        self._failures[index] += 1
+                    delay = min(MAX_RESTART_DELAY, MONITOR_INTERVAL*(2**min(self._failures[index], 10)-1))
+                    self._restart_at[index] = time.monotonic()+delay
+                    if delay > 0:
+                        print(
+                            '\033[91m', # Red foreground
+                            '\033[40m', # Black background
+                            f'Worker {process.pid} stopped without a job, starting it again in {delay} seconds. '
+                            f'See {self.log_dir} for its log.',
+                            '\033[0m'
+                        )
+                if time.monotonic() >= self._restart_at[index]:
+                    del self._restart_at[index]
+                    self._processes[index] = self._spawn()
+
+    def serve_forever(self) -> None:
+        """Start the workers and serve the API until interrupted.
+
+        SIGTERM stops the service like Ctrl+C, raising KeyboardInterrupt.
+
+        Raises
+        ------
+        OSError
+            If the port is already in use.
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+        self.queue.requeue()
+        if self.limits is not None:
+            self.queue.set_limits(self.limits)
+        self._server = _Server(('127.0.0.1', self.port), self.queue)
+        self._processes = [self._spawn() for _ in range(self.workers)]
+        self._failures = [0]*self.workers
+        threading.Thread(target=self._monitor, daemon=True).start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """Stop the API and the workers.
+
+        Workers finishing a job are given ``SHUTDOWN_TIMEOUT`` seconds, then
+        killed. Their jobs are queued again when the service starts.
+        """
+        self._stop.set()
+        if self._server is not None:
+            self._server.server_close()
+        for process in self._processes:
+            process.terminate()
+        deadline = time.monotonic()+SHUTDOWN_TIMEOUT
+        for process in self._processes:
+            process.join(max(deadline-time.monotonic(), 0))
+            if process.is_alive():
+                process.kill()
@@ -0,0 +1,334 @@
+import re
+from collections.abc import Iterable
+from urllib.parse import urljoin, urlparse
+
+from utility.retry import SegmentError, TokenExpiredError
+
+# Matches one attribute of a tag, e.g. BANDWIDTH=1280000 or URI="key.bin".
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_attributes(attribute_list: str) -> dict[str, str]:
+    """Parse the attribute list of a tag.
+
+    Parameters
+    ----------
+    attribute_list : str
+        Text after the colon of the tag.
+
+    Returns
+    -------
+    dict[str, str]
+        Attribute values keyed by name, with the quotes removed.
+    """
+    return {name: value.strip('"') for name, value in ATTRIBUTE_PATTERN.findall(attribute_list)}
+
+
+class Key:
+    """Class for encryption keys.
+
+    Attributes
+    ----------
+    method : str
+        Encryption method, ``AES-128`` is the only one supported.
+    uri : str
+        Url of the key.
+    iv : bytes | None
+        Initialization vector, None if the media sequence number is used.
+    """
+
+    def __init__(self, method: str, uri: str, iv: bytes | None):
+        self.method = method
+        self.uri = uri
+        self.iv = iv
+
+
+class Segment:
+    """Class for media segments.
+
+    Attributes
+    ----------
+    uri : str
+        Url of the segment.
+    duration : float
+        Duration of the segment in seconds.
+    sequence : int
+        Media sequence number of the segment.
+    key : Key | None
+        Key the segment is encrypted with, None if it isn't encrypted.
+    byte_range : tuple[int, int] | None
+        Length and offset of the segment in the resource at ``uri``, None if
+        the segment is the whole resource.
+
+    Methods
+    -------
+    name -> str
+        Name identifying the segment in its playlist.
+    iv -> bytes
+        Initialization vector to decrypt the segment with.
+    headers() -> dict[str, str]
+        Get the headers to request the segment with.
+    """
+
+    def __init__(self, uri: str, duration: float, sequence: int,
+                 key: Key | None = None, byte_range: tuple[int, int] | None = None):
+        self.uri = uri
+        self.duration = duration
+        self.sequence = sequence
+        self.key = key
+        self.byte_range = byte_range
+
+    @property
+    def name(self) -> str:
+        """Name identifying the segment in its playlist.
+
+        The last path component of the url, without the access token in the
+        rest of the url, plus the offset for byte range segments.
+        """
+        name = urlparse(self.uri).path.rsplit('/', 1)[-1]
+        if self.byte_range is not None:
+            name += f'@{self.byte_range[1]}'
+        return name
+
+    @property
+    def iv(self) -> bytes:
+        """Initialization vector to decrypt the segment with."""
+        if self.key is not None and self.key.iv is not None:
+            return self.key.iv
+        return self.sequence.to_bytes(16, 'big')
+
+    def headers(self) -> dict[str, str]:
+        """Get the headers to request the segment with.
+
+        Returns
+        -------
+        dict[str, str]
+            A Range header for byte range segments, otherwise no headers.
+        """
+        if self.byte_range is None:
+            return {}
+        length, offset = self.byte_range
+        return {'Range': f'bytes={offset}-{offset+length-1}'}
+
+
+class Variant:
+    """Class for the variant streams of a master playlist.
+
+    Attributes
+    ----------
+    uri : str
+        Url of the media playlist of the variant.
+    bandwidth : int
+        Peak bit rate of the variant in bits per second.
+    height : int | None
+        Height of the video in pixels, None if it isn't given.
+    """
+
+    def __init__(self, uri: str, bandwidth: int, height: int | None):
+        self.uri = uri
+        self.bandwidth = bandwidth
+        self.height = height
+
+
+class Playlist:
+    """Class for m3u8 playlists.
+
+    Attributes
+    ----------
+    url : str
+        Url of the playlist.
+    segments : list[Segment]
+        Segments of a media playlist.
+    variants : list[Variant]
+        Variant streams of a master playlist.
+
+    Methods
+    -------
+    is_master -> bool
+        Check whether this is a master playlist.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.segments: list[Segment] = []
+        self.variants: list[Variant] = []
+
+    @property
+    def is_master(self) -> bool:
+        """Check whether this is a master playlist."""
+        return len(self.variants) > 0
+
+
+class PlaylistParser:
+    """Incremental parser for m3u8 playlists.
+
+    Lines are fed one at a time as they are received, so a playlist can be
+    parsed while it is still being downloaded.
+
+    Attributes
+    ----------
+    playlist : Playlist
+        Playlist parsed so far.
+
+    Methods
+    -------
+    feed(line: str) -> None
+        Parse the next line of the playlist.
+    """
+
+    def __init__(self, url: str):
+        self.playlist = Playlist(url)
+        self._sequence = 0
+        self._key: Key | None = None
+        self._duration: float | None = None
+        self._byte_range: tuple[int, int] | None = None
+        self._variant: dict[str, str] | None = None
+        # Where the last byte range of every resource ended.
+        self._range_ends: dict[str, int] = {}
+
+    def feed(self, line: str) -> None:
+        """Parse the next line of the playlist.
+
+        Parameters
+        ----------
+        line : str
+            Line of the playlist.
+
+        Raises
+        ------
+        TokenExpiredError
+            If the server answered with a wrong hash message instead of a
+            playlist.
+        SegmentError
+            If the playlist uses an encryption method that isn't supported.
+        """
+        line = line.strip()
+        if not line:
+            return
+        if 'HASH' in line:
+            raise TokenExpiredError('The hash of the stream is wrong or has expired')
+        if not line.startswith('#'):
+            self._add_uri(urljoin(self.playlist.url, line))
+            return
+        tag, _, value = line.partition(':')
+        if tag == '#EXT-X-MEDIA-SEQUENCE':
+            self._sequence = int(value)
+        elif tag == '#EXTINF':
+            self._duration = float(value.split(',', 1)[0])
+        elif tag == '#EXT-X-BYTERANGE':
+            length, _, offset = value.partition('@')
+            self._byte_range = (int(length), int(offset) if offset else -1)
+        elif tag == '#EXT-X-KEY':
+            self._key = self._parse_key(parse_attributes(value))
+        elif tag == '#EXT-X-STREAM-INF':
+            self._variant = parse_attributes(value)
+
+    def _add_uri(self, uri: str) -> None:
+        if self._variant is not None:
+            resolution = self._variant.get('RESOLUTION', '')
+            height = int(resolution.split('x')[1]) if 'x' in resolution else None
+            self.playlist.variants.append(
+                Variant(uri, int(self._variant.get('BANDWIDTH', 0)), height))
+            self._variant = None
+            return
+        byte_range = None
+        if self._byte_range is not None:
+            length, offset = self._byte_range
+            if offset < 0:
+                # Without an offset the range starts where the last one ended.
+                offset = self._range_ends.get(uri, 0)
+            byte_range = (length, offset)
+            self._range_ends[uri] = offset+length
+        self.playlist.segments.append(
+            Segment(uri, self._duration or 0.0, self._sequence, self._key, byte_range))
+        self._sequence += 1
+        self._duration = None
+        self._byte_range = None
+
+    def _parse_key(self, attributes: dict[str, str]) -> Key | None:
+        method = attributes.get('METHOD', 'NONE')
+        if method == 'NONE':
+            return None
+        if method != 'AES-128':
+            raise SegmentError(f'Unsupported encryption method: {method}')
+        iv = attributes.get('IV')
+        return Key(method, urljoin(self.playlist.url, attributes['URI']),
+                   bytes.fromhex(iv[2:].rjust(32, '0')) if iv else None)
+
+
+def parse_playlist(url: str, lines: Iterable[str]) -> Playlist:
+    """Parse an m3u8 playlist.
+
+    Parameters
+    ----------
+    url : str
+        Url of the playlist, used to resolve relative urls.
+    lines : Iterable[str]
+        Lines of the playlist.
+
+    Returns
+    -------
+    Playlist
+        The parsed playlist.
+    """
+    parser = PlaylistParser(url)
+    for line in lines:
+        parser.feed(line)
+    return parser.playlist
+
+
+def select_variant(variants: list[Variant], quality: int | None = None,
+                   bandwidth: float | None = None) -> Variant:
+    """Select the variant stream to download.
+
+    The best variant is picked among those not taller than ``quality`` and,
+    once the throughput of the connection has been measured, not needing
+    more than 80% of it. If no variant fits, the smallest one is picked.
+
+    Parameters
+    ----------
+    variants : list[Variant]
+        Variants of a master playlist.
+    quality : int | None, optional
+        Highest video height to download, by default None
+    bandwidth : float | None, optional
+        Measured throughput of the connection in bytes per second, by
+        default None
+
+    Returns
+    -------
+    Variant
+        The selected variant.
+    """
+    candidates = variants
+    if quality is not None:
+        candidates = [variant for variant in candidates
+                      if variant.height is None or variant.height <= quality]
+    if bandwidth:
+        candidates = [variant for variant in candidates
+                      if variant.bandwidth <= bandwidth*8*0.8]
+    if not candidates:
+        return min(variants, key=lambda variant: variant.bandwidth)
+    return max(candidates, key=lambda variant: (variant.height or 0, variant.bandwidth))
+
+
+def decrypt(data: bytes, key: bytes, iv: bytes) -> bytes:
+    """Decrypt an AES-128 encrypted segment.
+
+    Parameters
+    ----------
+    data : bytes
+        Encrypted segment.
+    key : bytes
+        Key of the segment.
+    iv : bytes
+        Initialization vector of the segment.
+
+    Returns
+    -------
+    bytes
+        Decrypted segment, with the PKCS7 padding removed.
+    """
+    from Crypto.Cipher import AES
+    data = AES.new(key, AES.MODE_CBC, iv).decrypt(data)
+    return data[:-data[-1]] if data and 1 <= data[-1] <= 16 else data
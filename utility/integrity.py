@@ -0,0 +1,201 @@
+import hashlib
+import os
+
+from utility.manifest import Manifest
+
+# Size of the packets of an MPEG transport stream.
+TS_PACKET_SIZE = 188
+# First byte of every packet of an MPEG transport stream.
+TS_SYNC_BYTE = 0x47
+# Number of times a segment failing validation is downloaded again before
+# the download fails.
+MAX_REFETCHES = 3
+
+# Check that segments are MPEG-TS before writing them, see ``configure``.
+verify_segments = True
+# Record a hash of every segment in the manifest, see ``configure``.
+hash_segments = False
+
+
+class CorruptSegmentError(Exception):
+    """Raised when a downloaded segment isn't a valid MPEG-TS segment."""
+
+
+def configure(verify: bool = True, hash: bool = False) -> None:
+    """Configure the validation of the segments of every download.
+
+    Parameters
+    ----------
+    verify : bool, optional
+        Check that segments are MPEG-TS before writing them, and check the
+        segments of an earlier run before resuming or converting it, by
+        default True
+    hash : bool, optional
+        Record a hash of every segment written in the manifest, so that
+        bytes changed on disk are found too, by default False
+    """
+    global verify_segments, hash_segments
+    verify_segments = verify
+    hash_segments = hash
+
+
+def check_length(data: bytes, content_length: str | None, content_encoding: str | None) -> None:
+    """Check that a response body is as long as its Content-Length header.
+
+    Parameters
+    ----------
+    data : bytes
+        Body received.
+    content_length : str | None
+        Value of the Content-Length header, None if there is none.
+    content_encoding : str | None
+        Value of the Content-Encoding header. The length isn't checked for
+        a compressed body, as the header gives its compressed length.
+
+    Raises
+    ------
+    CorruptSegmentError
+        If the body is shorter or longer than the header says.
+    """
+    if content_length is None or content_encoding not in (None, 'identity') or not content_length.isdigit():
+        return
+    if len(data) != int(content_length):
+        raise CorruptSegmentError(f'Received {len(data)} of {content_length} bytes')
+
+
+def check_segment(data: bytes) -> None:
+    """Check that a segment is made of MPEG-TS packets.
+
+    Every packet is 188 bytes long and starts with the sync byte, so an
+    error page, a truncated segment or a segment decrypted with the wrong
+    key fails the check.
+
+    Parameters
+    ----------
+    data : bytes
+        Content of the segment, decrypted.
+
+    Raises
+    ------
+    CorruptSegmentError
+        If the segment isn't valid.
+    """
+    if not data:
+        raise CorruptSegmentError('Empty segment')
+    if len(data) % TS_PACKET_SIZE:
+        raise CorruptSegmentError(f'Length {len(data)} is not a multiple of {TS_PACKET_SIZE}')
+    # Slicing gathers the first byte of every packet at C speed.
+    sync = data[::TS_PACKET_SIZE]
+    if sync.count(TS_SYNC_BYTE) != len(sync):
+        packet = next(index for index, byte in enumerate(sync) if byte != TS_SYNC_BYTE)
+        raise CorruptSegmentError(f'Packet {packet} has no sync byte')
+
+
+def segment_digest(data: bytes) -> str:
+    """Compute the hash of a segment recorded in the manifest.
+
+    Parameters
+    ----------
+    data : bytes
+        Content of the segment.
+
+    Returns
+    -------
+    str
+        Hex digest.
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def verify_file(file_name: str) -> dict[int, str]:
+    """Find the bad segments of a ``.ts`` file, guided by its manifest.
+
+    Only the segments a resumed download would keep are checked. A segment
+    is bad if its hash, when recorded, doesn't match, or if it fails
+    ``check_segment`` while segments are verified.
+
+    Parameters
+    ----------
+    file_name : str
+        Path of the ``.ts`` file.
+
+    Returns
+    -------
+    dict[int, str]
+        Why every bad segment is bad, by index. Empty if the file or its
+        manifest is missing.
+    """
+    manifest = Manifest(file_name)
+    if not manifest.load() or not os.path.exists(file_name):
+        return {}
+    count, _ = manifest.resume_point(os.path.getsize(file_name))
+    bad = {}
+    with open(file_name, 'rb') as f_segments:
+        for index in range(count):
+            offset, length = manifest.segments[index]
+            f_segments.seek(offset)
+            data = f_segments.read(length)
+            digest = manifest.hashes.get(index)
+            if digest is not None and segment_digest(data) != digest:
+                bad[index] = 'Hash does not match'
+                continue
+            if verify_segments:
+                try:
+                    check_segment(data)
+                except CorruptSegmentError as e:
+                    bad[index] = str(e)
+    return bad
+
+
+def replace_segments(file_name: str, replacements: dict[int, bytes]) -> None:
+    """Replace segments of a ``.ts`` file and update its manifest.
+
+    Segments of the same length are overwritten in place. Otherwise the
+    file is written again with the segments after them moved, and replaced
+    at once so an interruption leaves the old file.
+
+    Parameters
+    ----------
+    file_name : str
+        Path of the ``.ts`` file.
+    replacements : dict[int, bytes]
+        New content of segments recorded in the manifest, by index.
+    """
+    manifest = Manifest(file_name)
+    manifest.load()
+    count, _ = manifest.resume_point(os.path.getsize(file_name))
+
+    def digest(index: int, data: bytes) -> str | None:
+        if hash_segments or index in manifest.hashes:
+            return segment_digest(data)
+        return None
+
+    if all(len(data) == manifest.segments[index][1] for index, data in replacements.items()):
+        with open(file_name, 'r+b') as f_segments:
+            for index, data in replacements.items():
+                f_segments.seek(manifest.segments[index][0])
+                f_segments.write(data)
+        # A later record of a segment replaces the earlier one.
+        for index, data in replacements.items():
+            manifest.add(index, manifest.segments[index][0], len(data), digest(index, data))
+        manifest.close()
+        return
+    records = []
+    offset = 0
+    with open(file_name, 'rb') as f_old, open(file_name+'.tmp', 'wb') as f_new:
+        for index in range(count):
+            if index in replacements:
+                data = replacements[index]
+                record_digest = digest(index, data)
+            else:
+                f_old.seek(manifest.segments[index][0])
+                data = f_old.read(manifest.segments[index][1])
+                record_digest = manifest.hashes.get(index)
+            f_new.write(data)
+            records.append((index, offset, len(data), record_digest))
+            offset += len(data)
+    os.replace(file_name+'.tmp', file_name)
+    manifest.start(manifest.segment_count, manifest.fingerprint)
+    for record in records:
+        manifest.add(*record)
+    manifest.close()
@@ -0,0 +1,345 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utility.batch import BatchJob
+
+# Default path of the job queue of the service.
+DEFAULT_QUEUE_PATH = os.path.join('.cache', 'jobs.sqlite')
+# States of a job, in the order a job goes through them.
+STATES = ('queued', 'resolving', 'downloading', 'remuxing', 'done', 'failed', 'cancelled')
+# States of a job a worker is working on.
+ACTIVE_STATES = ('resolving', 'downloading', 'remuxing')
+# Seconds a connection waits for another process to release the database.
+BUSY_TIMEOUT = 30
+# Number of times a job is taken up before it fails, so that a job
+# crashing its worker doesn't crash every worker started after it.
+MAX_ATTEMPTS = 3
+# Download limits shared by the workers, see ``utility.ratelimit.configure``.
+LIMITS = ('max_segments_in_flight', 'max_bytes_per_second', 'max_requests_per_second')
+
+
+class JobQueue:
+    """Durable queue of the jobs of the service, shared by its processes.
+
+    Jobs are rows of a sqlite database, so they survive restarts, and every
+    process opens its own connection to it. A job is claimed by a single
+    worker in a write transaction, goes through the active states while the
+    worker runs it and ends ``done``, ``failed`` or ``cancelled``.
+
+    Attributes
+    ----------
+    path : str
+        Path of the sqlite database.
+
+    Methods
+    -------
+    submit(values: dict) -> dict
+        Add a job to the queue.
+    claim(worker: int) -> dict | None
+        Take the oldest queued job.
+    set_state(id: int, state: str) -> None
+        Move a running job to a later active state.
+    finish(id: int, entry: dict) -> None
+        Store the result of a job.
+    get(id: int) -> dict | None
+        Get a job.
+    jobs(state: str | None = None) -> list[dict]
+        List the jobs, oldest first.
+    running() -> list[dict]
+        List the jobs a worker is working on.
+    cancel(id: int) -> bool
+        Cancel a queued job.
+    requeue(worker: int | None = None) -> int
+        Queue again the jobs left active by a worker that stopped.
+    get_limits() -> dict[str, float]
+        Get the download limits shared by the workers.
+    set_limits(values: dict[str, float]) -> dict[str, float]
+        Change some of the download limits shared by the workers.
+    """
+
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Opened on first use, so that a queue made before the worker
+        # processes start isn't shared with them.
+        if self._connection is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Transactions are started explicitly, so that claiming a job
+            # locks the database before reading it.
+            self._connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                                               check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, spec TEXT NOT NULL, state TEXT NOT NULL, '
+                'worker INTEGER, attempts INTEGER NOT NULL DEFAULT 0, result TEXT, created REAL NOT NULL, '
+                'updated REAL NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS limits (name TEXT PRIMARY KEY, value REAL NOT NULL)')
+        return self._connection
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        return {'id': row['id'], 'job': json.loads(row['spec']), 'state': row['state'], 'worker': row['worker'],
+                'attempts': row['attempts'],
+                'result': json.loads(row['result']) if row['result'] is not None else None,
+                'created': row['created'], 'updated': row['updated']}
+
+    def submit(self, values: dict) -> dict:
+        """Add a job to the queue.
+
+        Parameters
+        ----------
+        values : dict
+            The job, as an entry of a job file, see ``BatchJob.from_dict``.
+
+        Returns
+        -------
+        dict
+            The queued job.
+
+        Raises
+        ------
+        JobFileError
+            If the job isn't valid.
+        """
+        BatchJob.from_dict(values, 'job')
+        now = time.time()
+        with self._lock:
+            cursor = self._connect().execute(
+                'INSERT INTO jobs (spec, state, created, updated) VALUES (?, ?, ?, ?)',
+                (json.dumps(values, ensure_ascii=False), 'queued', now, now))
+            row = self._connection.execute('SELECT * FROM jobs WHERE id = ?', (cursor.lastrowid,)).fetchone()
+        return self._to_dict(row)
+
+    def claim(self, worker: int) -> dict | None:
+        """Take the oldest queued job.
+
+        Parameters
+        ----------
+        worker : int
+            Process id of the worker taking the job.
+
+        Returns
+        -------
+        dict | None
+            The job, now ``resolving``, or None if no job is queued.
+        """
+        with self._lock:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute(
+                    "SELECT id FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE jobs SET state = 'resolving', worker = ?, attempts = attempts + 1, updated = ? "
+                        "WHERE id = ?",
+                        (worker, time.time(), row['id']))
+                    row = connection.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone()
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        return self._to_dict(row) if row is not None else None
+
+    def set_state(self, id: int, state: str) -> None:
+        """Move a running job to a later active state.
+
+        The episodes of a series are downloaded and converted in parallel, so
+        a job only moves forward: a job already ``remuxing`` stays so when
+        another episode starts downloading.
+
+        Parameters
+        ----------
+        id : int
+            Id of the job.
+        state : str
+            One of ``ACTIVE_STATES``.
+        """
+        earlier = ACTIVE_STATES[:ACTIVE_STATES.index(state)]
+        with self._lock:
+            self._connect().execute(
+                f'UPDATE jobs SET state = ?, updated = ? WHERE id = ? '
+                f'AND state IN ({", ".join("?"*len(earlier))})',
+                (state, time.time(), id, *earlier))
+
+    def finish(self, id: int, entry: dict) -> None:
+        """Store the result of a job.
+
+        Parameters
+        ----------
+        id : int
+            Id of the job.
+        entry : dict
+            Report entry of the job, see ``utility.batch.run_job``. The job
+            is ``done`` if the entry is, ``failed`` otherwise.
+        """
+        state = 'done' if entry['status'] == 'done' else 'failed'
+        with self._lock:
+            self._connect().execute(
+                'UPDATE jobs SET state = ?, result = ?, updated = ? WHERE id = ?',
+                (state, json.dumps(entry, ensure_ascii=False), time.time(), id))
+
+    def get(self, id: int) -> dict | None:
+        """Get a job.
+
+        Parameters
+        ----------
+        id : int
+            Id of the job.
+
+        Returns
+        -------
+        dict | None
+            The job, or None if there is no such job.
+        """
+        with self._lock:
+            row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def jobs(self, state: str | None = None) -> list[dict]:
+        """List the jobs, oldest first.
+
+        Parameters
+        ----------
+        state : str | None, optional
+            Only list the jobs in this state, by default None for every job
+
+        Returns
+        -------
+        list[dict]
+            The jobs.
+        """
+        with self._lock:
+            if state is None:
+                rows = self._connect().execute('SELECT * FROM jobs ORDER BY id').fetchall()
+            else:
+                rows = self._connect().execute('SELECT * FROM jobs WHERE state = ? ORDER BY id', (state,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def running(self) -> list[dict]:
+        """List the jobs a worker is working on.
+
+        Returns
+        -------
+        list[dict]
+            The jobs in one of ``ACTIVE_STATES``, oldest first.
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT * FROM jobs WHERE state IN ({', '.join('?'*len(ACTIVE_STATES))}) ORDER BY id",
+                ACTIVE_STATES).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def cancel(self, id: int) -> bool:
+        """Cancel a queued job.
+
+        Parameters
+        ----------
+        id : int
+            Id of the job.
+
+        Returns
+        -------
+        bool
+            True if the job was cancelled, False if there is no such job or
+            a worker already took it.
+        """
+        with self._lock:
+            cursor = self._connect().execute(
+                "UPDATE jobs SET state = 'cancelled', updated = ? WHERE id = ? AND state = 'queued'",
+                (time.time(), id))
+        return cursor.rowcount == 1
+
+    def requeue(self, worker: int | None = None) -> int:
+        """Queue again the jobs left active by a worker that stopped.
+
+        Downloads resume from the segments already written, so a job taken
+        up again only fetches what is missing. A job already taken up
+        ``MAX_ATTEMPTS`` times fails instead.
+
+        Parameters
+        ----------
+        worker : int | None, optional
+            Process id of the worker, by default None for every worker, as
+            when the service starts after a restart
+
+        Returns
+        -------
+        int
+            Number of jobs queued again.
+        """
+        condition = f"state IN ({', '.join('?'*len(ACTIVE_STATES))})"
+        parameters = [*ACTIVE_STATES]
+        if worker is not None:
+            condition += ' AND worker = ?'
+            parameters.append(worker)
+        result = json.dumps({'status': 'failed', 'error': f'Worker stopped {MAX_ATTEMPTS} times running the job'})
+        with self._lock:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    f"UPDATE jobs SET state = 'failed', result = ?, updated = ? "
+                    f"WHERE {condition} AND attempts >= ?",
+                    (result, time.time(), *parameters, MAX_ATTEMPTS))
+                cursor = connection.execute(
+                    f"UPDATE jobs SET state = 'queued', worker = NULL, updated = ? WHERE {condition}",
+                    (time.time(), *parameters))
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        return cursor.rowcount
+
+    def get_limits(self) -> dict[str, float]:
+        """Get the download limits shared by the workers.
+
+        Returns
+        -------
+        dict[str, float]
+            Value of every limit of ``LIMITS``, 0 for no limit.
+        """
+        with self._lock:
+            rows = self._connect().execute('SELECT name, value FROM limits').fetchall()
+        limits = dict.fromkeys(LIMITS, 0.0)
+        limits.update((row['name'], row['value']) for row in rows if row['name'] in LIMITS)
+        return limits
+
+    def set_limits(self, values: dict[str, float]) -> dict[str, float]:
+        """Change some of the download limits shared by the workers.
+
+        Running workers pick the new limits up within a few seconds.
+
+        Parameters
+        ----------
+        values : dict[str, float]
+            New value of some of the limits of ``LIMITS``, 0 for no limit.
+
+        Returns
+        -------
+        dict[str, float]
+            Value of every limit.
+
+        Raises
+        ------
+        ValueError
+            If a limit is unknown or negative.
+        """
+        for name, value in values.items():
+            if name not in LIMITS:
+                raise ValueError(f'Unknown limit: {name}')
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not value >= 0:
+                raise ValueError(f'{name} must be a number of at least 0')
+        with self._lock:
+            self._connect().executemany('INSERT OR REPLACE INTO limits VALUES (?, ?)', values.items())
+        return self.get_limits()
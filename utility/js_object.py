@@ -0,0 +1,150 @@
+import re
+from typing import Any
+
+# Tokens of an object literal, after any white space and comments. Strings
+# are matched whole, with their escape sequences, so brackets and commas
+# inside them are never mistaken for structure.
+TOKEN_PATTERN = re.compile(r'''
+    (?:\s|//[^\n]*|/\*.*?\*/)*(?:
+        (?P<punct>[{}\[\]:,])
+      | '(?P<single>(?:[^'\\]|\\.)*)'
+      | "(?P<double>(?:[^"\\]|\\.)*)"
+      | (?P<number>[+-]?(?:0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?
+                         |(?:Infinity|NaN)(?![\w$])))
+      | (?P<name>[A-Za-z_$][\w$]*)
+    )''', re.VERBOSE | re.DOTALL)
+# Start of an object literal assigned to a variable or property.
+ASSIGNMENT_PATTERN = re.compile(r'=\s*\{')
+# Escape sequences of a string.
+ESCAPE_PATTERN = re.compile(r'\\(u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|\r\n|.)', re.DOTALL)
+SIMPLE_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v', '0': '\0',
+                  '\n': '', '\r\n': ''}
+# Values of the bare words allowed as values. Infinity and NaN are numbers,
+# so that they can be signed.
+CONSTANTS = {'true': True, 'false': False, 'null': None, 'undefined': None}
+
+
+class JSParseError(ValueError):
+    """Raised when a source isn't a valid object literal."""
+
+
+def _unescape(match: re.Match) -> str:
+    escape = match[1]
+    if escape[0] == 'u' and len(escape) > 1:
+        return chr(int(escape[1:].strip('{}'), 16))
+    if escape[0] == 'x' and len(escape) == 3:
+        return chr(int(escape[1:], 16))
+    return SIMPLE_ESCAPES.get(escape, escape)
+
+
+class _Parser:
+    """Recursive descent parser over the tokens of an object literal."""
+
+    def __init__(self, source: str, position: int):
+        self.source = source
+        self.position = position
+
+    def next_token(self) -> tuple[str, str]:
+        match = TOKEN_PATTERN.match(self.source, self.position)
+        if match is None:
+            raise JSParseError(f'Unexpected character after {self.position}')
+        self.position = match.end()
+        return match.lastgroup, match[match.lastgroup]
+
+    def peek_punct(self) -> str | None:
+        match = TOKEN_PATTERN.match(self.source, self.position)
+        return match['punct'] if match is not None else None
+
+    def value(self) -> Any:
+        kind, text = self.next_token()
+        if kind == 'punct':
+            if text == '{':
+                return self.object()
+            if text == '[':
+                return self.array()
+            raise JSParseError(f'Unexpected {text!r} at {self.position-1}')
+        if kind == 'single' or kind == 'double':
+            return ESCAPE_PATTERN.sub(_unescape, text) if '\\' in text else text
+        if kind == 'number':
+            return self.number(text)
+        if text in CONSTANTS:
+            return CONSTANTS[text]
+        raise JSParseError(f'Unexpected name {text!r} at {self.position-len(text)}')
+
+    def object(self) -> dict[str, Any]:
+        result = {}
+        while True:
+            kind, key = self.next_token()
+            if kind == 'punct':
+                if key == '}':
+                    # Empty object or trailing comma.
+                    return result
+                raise JSParseError(f'Unexpected {key!r} at {self.position-1}')
+            if kind == 'single' or kind == 'double':
+                key = ESCAPE_PATTERN.sub(_unescape, key) if '\\' in key else key
+            if self.next_token() != ('punct', ':'):
+                raise JSParseError(f'Expected : at {self.position-1}')
+            result[key] = self.value()
+            kind, text = self.next_token()
+            if text == '}':
+                return result
+            if text != ',':
+                raise JSParseError(f'Expected , or }} at {self.position-1}')
+
+    def array(self) -> list[Any]:
+        result = []
+        while True:
+            if self.peek_punct() == ']':
+                # Empty array or trailing comma.
+                self.next_token()
+                return result
+            result.append(self.value())
+            kind, text = self.next_token()
+            if text == ']':
+                return result
+            if text != ',':
+                raise JSParseError(f'Expected , or ] at {self.position-1}')
+
+    @staticmethod
+    def number(text: str) -> int | float:
+        if text.lstrip('+-')[:2] in ('0x', '0X'):
+            return int(text, 16)
+        if text.lstrip('+-') in ('Infinity', 'NaN'):
+            return float(text)
+        try:
+            return int(text)
+        except ValueError:
+            return float(text)
+
+
+def parse_object_literal(source: str) -> dict[str, Any]:
+    """Parse the first object literal of a JavaScript source.
+
+    Only literals are supported: objects, arrays, strings, numbers, including
+    a signed ``Infinity`` or ``NaN``, and the constants ``true``, ``false``,
+    ``null`` and ``undefined``. Keys may be names or strings, trailing commas
+    and comments are allowed. Nothing is executed, so the source can't run
+    any code, and anything around the literal, e.g.
+    ``window['storage'] = ... ;``, is ignored.
+
+    Parameters
+    ----------
+    source : str
+        JavaScript source containing an object literal.
+
+    Returns
+    -------
+    dict[str, Any]
+        The object, with nested objects as dicts and arrays as lists.
+
+    Raises
+    ------
+    JSParseError
+        If the source has no object literal or it isn't valid.
+    """
+    # The literal is usually assigned, and the left side may hold strings.
+    match = ASSIGNMENT_PATTERN.search(source)
+    start = match.end()-1 if match is not None else source.find('{')
+    if start < 0:
+        raise JSParseError('No object literal found')
+    return _Parser(source, start+1).object()
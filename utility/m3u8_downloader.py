@@ -1,107 +1,750 @@
 import concurrent.futures
+import functools
 import os
+import shutil
 import subprocess
 import time
+from collections.abc import Callable
+from urllib.parse import urlparse
 
 import requests
 from tqdm import tqdm
 
+from utility import integrity, ratelimit, session
+from utility.config import DEFAULT_WINDOW
+from utility.concurrency import AdaptiveLimiter, throughput
+from utility.hls import (Playlist, Segment, decrypt, parse_playlist,
+                         select_variant)
+from utility.manifest import Manifest
+from utility.metrics import metrics
+from utility.retry import (TRIAL_POLL_INTERVAL, RetryBudget, RetryPolicy, SegmentError,
+                           TokenExpiredError, circuit_breaker)
 
-def get_segments(m3u8_url: str) -> list[str]:
+# Status codes a server uses to ask for fewer requests.
+THROTTLE_STATUS_CODES = (429, 503)
+# Status codes the CDN answers with when the token in the url is not valid.
+TOKEN_STATUS_CODES = (401, 403, 410)
+
+_keys: dict[str, bytes] = {}
+
+
+class SegmentWriter:
+    """Write downloaded segments to a file in playlist order.
+
+    Segments can be handed over in any order. A segment that arrives before
+    the ones preceding it is held back until the gap is filled, and only
+    segments inside the sliding window are accepted, so memory use never
+    exceeds ``window`` segments no matter how long the playlist is. Every
+    segment written is recorded in the manifest, if one is given, with its
+    hash if ``integrity.hash_segments`` is set.
+
+    Attributes
+    ----------
+    file_name : str
+        Path of the output file.
+    window : int
+        Maximum number of segments between the next segment to write and the
+        last segment that may be accepted.
+    next_index : int
+        Index of the next segment to be written to disk.
+    offset : int
+        Offset in the output file at which the next segment is written.
+    manifest : Manifest | None
+        Manifest recording the written segments.
+
+    Methods
+    -------
+    can_accept(index: int) -> bool
+        Check whether a segment falls inside the window.
+    put(index: int, data: bytes) -> None
+        Hand over a downloaded segment.
+    close() -> None
+        Close the output file and the manifest.
+    """
+
+    def __init__(self, file_name: str, window: int = DEFAULT_WINDOW,
+                 manifest: Manifest | None = None, start_index: int = 0, offset: int = 0):
+        if window < 1:
+            raise ValueError('window must be at least 1')
+        self.file_name = file_name
+        self.window = window
+        self.next_index = start_index
+        self.offset = offset
+        self.manifest = manifest
+        self._pending: dict[int, bytes] = {}
+        self._file = self._open()
+
+    def _open(self):
+        if self.next_index > 0:
+            # Keep the segments already on disk and drop anything after them.
+            f_output = open(self.file_name, 'r+b')
+            f_output.truncate(self.offset)
+            f_output.seek(self.offset)
+            return f_output
+        return open(self.file_name, 'wb')
+
+    def can_accept(self, index: int) -> bool:
+        """Check whether a segment falls inside the window.
+
+        Parameters
+        ----------
+        index : int
+            Index of the segment in the playlist.
+
+        Returns
+        -------
+        bool
+            True if the segment can be requested without growing the buffer
+            beyond the window.
+        """
+        return index < self.next_index + self.window
+
+    def put(self, index: int, data: bytes) -> None:
+        """Hand over a downloaded segment.
+
+        The segment is written immediately if it is the next one in order,
+        otherwise it is buffered until the preceding segments arrive.
+
+        Parameters
+        ----------
+        index : int
+            Index of the segment in the playlist.
+        data : bytes
+            Content of the segment.
+        """
+        self._pending[index] = data
+        while self.next_index in self._pending:
+            data = self._pending.pop(self.next_index)
+            self._file.write(data)
+            if self.manifest is not None:
+                # The segment must be on disk before it is recorded.
+                self._file.flush()
+                digest = integrity.segment_digest(data) if integrity.hash_segments else None
+                self.manifest.add(self.next_index, self.offset, len(data), digest)
+            self.offset += len(data)
+            self.next_index += 1
+
+    def close(self) -> None:
+        """Close the output file and the manifest."""
+        self._file.close()
+        if self.manifest is not None:
+            self.manifest.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RemuxError(Exception):
+    """Raised when FFmpeg fails while segments are piped into it."""
+
+
+class RemuxWriter(SegmentWriter):
+    """Pipe downloaded segments into FFmpeg in playlist order.
+
+    FFmpeg remuxes the stream into ``<file_name>.mp4.part`` while the
+    download is running, and the file is renamed to ``<file_name>.mp4`` once
+    every segment has been written and FFmpeg has exited successfully. If the
+    download fails the partial file is removed.
+
+    Attributes
+    ----------
+    segment_count : int
+        Number of segments of the playlist.
+
+    Methods
+    -------
+    put(index: int, data: bytes) -> None
+        Hand over a downloaded segment.
+    close() -> None
+        Wait for FFmpeg to finish and move the ``.mp4`` file in place.
+    """
+
+    def __init__(self, file_name: str, segment_count: int, window: int = DEFAULT_WINDOW):
+        self.segment_count = segment_count
+        self._process = None
+        super().__init__(file_name, window)
+
+    def _open(self):
+        self._process = subprocess.Popen(
+            ['ffmpeg', '-y', '-f', 'mpegts', '-i', 'pipe:0', '-c', 'copy', '-bsf:a', 'aac_adtstoasc',
+             '-f', 'mp4', f'{self.file_name}.mp4.part'],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return self._process.stdin
+
+    def put(self, index: int, data: bytes) -> None:
+        """Hand over a downloaded segment.
+
+        Parameters
+        ----------
+        index : int
+            Index of the segment in the playlist.
+        data : bytes
+            Content of the segment.
+
+        Raises
+        ------
+        RemuxError
+            If FFmpeg has exited.
+        """
+        try:
+            super().put(index, data)
+        except OSError as e:
+            raise RemuxError('FFmpeg stopped reading the stream') from e
+
+    def close(self) -> None:
+        """Wait for FFmpeg to finish and move the ``.mp4`` file in place.
+
+        Raises
+        ------
+        RemuxError
+            If every segment was written but FFmpeg failed.
+        """
+        try:
+            self._file.close()
+        except OSError:
+            pass
+        complete = self.next_index >= self.segment_count
+        if not complete:
+            self._process.kill()
+        self._process.wait()
+        if complete and self._process.returncode == 0:
+            os.replace(f'{self.file_name}.mp4.part', f'{self.file_name}.mp4')
+            return
+        if os.path.exists(f'{self.file_name}.mp4.part'):
+            os.remove(f'{self.file_name}.mp4.part')
+        if complete:
+            raise RemuxError(f'FFmpeg exited with code {self._process.returncode}')
+
+
+def get_playlist(m3u8_url: str) -> Playlist:
+    """Get and parse an m3u8 file.
+
+    The playlist is parsed line by line while it is being received.
+
+    Parameters
+    ----------
+    m3u8_url : str
+        m3u8 file url.
+
+    Returns
+    -------
+    Playlist
+        The parsed playlist.
+
+    Raises
+    ------
+    TokenExpiredError
+        If hash is wrong.
+    """
+    resp = session.get(m3u8_url, stream=True)
+    if resp.status_code in TOKEN_STATUS_CODES:
+        raise TokenExpiredError(f'Access denied to playlist: {m3u8_url}')
+    resp.raise_for_status()
+    resp.encoding = resp.encoding or 'utf-8'
+    return parse_playlist(m3u8_url, resp.iter_lines(decode_unicode=True))
+
+
+def get_segments(m3u8_url: str, quality: int | None = None) -> list[Segment]:
     """Get segments from m3u8 file.
 
+    If the file is a master playlist, a variant is selected based on the
+    quality and on the throughput measured in earlier downloads, and its
+    segments are returned.
+
     Parameters
     ----------
     m3u8_url : str
         m3u8 file url.
+    quality : int | None, optional
+        Highest video height to download, by default None
 
     Returns
     -------
-    list[str]
+    list[Segment]
         List of segments.
 
     Raises
     ------
-    ValueError
+    TokenExpiredError
         If hash is wrong.
     """
-    base_url = m3u8_url.rsplit('/', 1)[0]+'/'
-    resp = requests.get(m3u8_url)
-    resp.raise_for_status()
-    m3u8_content = resp.text
-    if 'HASH' in m3u8_content:
-        raise ValueError
-    # Create list of segments
-    segments = resp.text.replace('\n', '')
-    segments = segments.split(',')
-    segments.pop(0)
-    for segment in enumerate(segments):
-        segments[segment[0]] = base_url+segment[1].split('.')[0]+'.ts'
-    return segments
-
-def get_response(segment: str) -> requests.Response:
+    playlist = get_playlist(m3u8_url)
+    if playlist.is_master:
+        variant = select_variant(playlist.variants, quality, throughput.value)
+        playlist = get_playlist(variant.uri)
+    return playlist.segments
+
+
+def get_key(uri: str) -> bytes:
+    """Get an encryption key.
+
+    Keys are cached, so every key is downloaded once even though it is
+    shared by many segments.
+
+    Parameters
+    ----------
+    uri : str
+        Url of the key.
+
+    Returns
+    -------
+    bytes
+        The key.
+    """
+    if uri not in _keys:
+        _keys[uri] = get_response(uri).content
+    return _keys[uri]
+
+
+def fetch_segment(segment: Segment, limiter: AdaptiveLimiter | None = None,
+                  budget: RetryBudget | None = None, priority: str = ratelimit.DEFAULT_PRIORITY) -> bytes:
+    """Download a segment and decrypt it if needed.
+
+    Waits after the download as long as the global bandwidth limit requires
+    for the priority class of the download. If ``integrity.verify_segments``
+    is set, a segment that isn't valid MPEG-TS is downloaded again, up to
+    ``integrity.MAX_REFETCHES`` times while the retry budget lasts.
+
+    Parameters
+    ----------
+    segment : Segment
+        Segment to download.
+    limiter : AdaptiveLimiter | None, optional
+        Limiter to report the latency, size and errors of the request to, by
+        default None
+    budget : RetryBudget | None, optional
+        Retry budget of the download, by default None
+    priority : str, optional
+        Priority class of the download, by default
+        ratelimit.DEFAULT_PRIORITY
+
+    Returns
+    -------
+    bytes
+        Content of the segment.
+
+    Raises
+    ------
+    SegmentError
+        If the segment can't be downloaded, or is still corrupt after being
+        downloaded again.
+    """
+    for attempt in range(1, integrity.MAX_REFETCHES+1):
+        data = get_response(segment.uri, limiter, budget, segment.headers(), priority=priority).content
+        ratelimit.bandwidth.consume(len(data), priority)
+        if segment.key is not None:
+            data = decrypt(data, get_key(segment.key.uri), segment.iv)
+        if not integrity.verify_segments:
+            return data
+        try:
+            integrity.check_segment(data)
+            return data
+        except integrity.CorruptSegmentError as e:
+            metrics.increment('segments.corrupt')
+            if attempt == integrity.MAX_REFETCHES or (budget is not None and not budget.spend()):
+                raise SegmentError(f'Corrupt segment: {segment.uri} ({e})') from e
+            print(
+                '\033[91m', # Red foreground
+                '\033[40m', # Black background
+                f'Corrupt segment: {segment.uri} ({e}), downloading it again '
+                f'({attempt}/{integrity.MAX_REFETCHES-1})...',
+                '\033[0m'
+            )
+
+def get_response(segment: str, limiter: AdaptiveLimiter | None = None, budget: RetryBudget | None = None,
+                 headers: dict[str, str] | None = None, policy: RetryPolicy = RetryPolicy(),
+                 priority: str = ratelimit.DEFAULT_PRIORITY) -> requests.Response:
     """Get response from segment url.
 
+    Failed requests are retried with exponential backoff, as long as the
+    retry budget of the download lasts and the circuit breaker of the host
+    is closed. While the circuit breaker is open, requests wait for its
+    cooldown and take turns at its trial request, every cooldown costing a
+    retry. Every attempt waits for the global request rate limit first,
+    which isn't counted in the latency reported to the limiter. A body
+    shorter or longer than its Content-Length header counts as a failed
+    request.
+
     Parameters
     ----------
     segment : str
         Segment url.
+    limiter : AdaptiveLimiter | None, optional
+        Limiter to report the latency, size and errors of the request to, by
+        default None
+    budget : RetryBudget | None, optional
+        Retry budget of the download, by default None
+    headers : dict[str, str] | None, optional
+        Headers to send with the request, by default None
+    policy : RetryPolicy, optional
+        Backoff policy, by default RetryPolicy()
+    priority : str, optional
+        Priority class of the download, by default
+        ratelimit.DEFAULT_PRIORITY
 
     Returns
     -------
     requests.Response
         Response.
+
+    Raises
+    ------
+    TokenExpiredError
+        If the server refuses the access token in the url.
+    SegmentError
+        If the segment can't be downloaded.
     """
-    while True: # This is the infinite loop
+    breaker = circuit_breaker(urlparse(segment).netloc)
+    for attempt in range(1, policy.max_attempts+1):
+        waits = 0
+        while not breaker.allow():
+            delay = breaker.retry_after()
+            if delay > 0:
+                waits += 1
+                if waits > policy.max_attempts or (budget is not None and not budget.spend()):
+                    raise SegmentError(f'Too many errors from {urlparse(segment).netloc}')
+            time.sleep(max(delay, TRIAL_POLL_INTERVAL))
         try:
-            resp = requests.get(segment)
+            ratelimit.request_rate.consume(1, priority)
+            start = time.monotonic()
+            resp = session.get(segment, priority=None, headers=headers)
             resp.raise_for_status()
-            return resp  # This is the exit from the loop
-        except:
+            integrity.check_length(resp.content, resp.headers.get('Content-Length'),
+                                   resp.headers.get('Content-Encoding'))
+        except (requests.exceptions.RequestException, integrity.CorruptSegmentError) as e:
+            response = getattr(e, 'response', None)
+            status = response.status_code if response is not None else None
+            if status in TOKEN_STATUS_CODES:
+                # The host answered, which ends a trial request too.
+                breaker.record_success()
+                raise TokenExpiredError(f'Access denied to segment: {segment}') from e
+            breaker.record_failure()
+            if limiter is not None:
+                limiter.on_error(throttled=status in THROTTLE_STATUS_CODES)
+            if attempt == policy.max_attempts or (budget is not None and not budget.spend()):
+                raise SegmentError(f'Could not download segment: {segment}') from e
             print(
                 '\033[91m', # Red foreground
                 '\033[40m', # Black background
-                f'Error while downloading segment: {segment}, retrying...',
+                f'Error while downloading segment: {segment}, retrying ({attempt}/{policy.max_attempts-1})...',
                 '\033[0m'
             )
-            time.sleep(5) # Wait 5 seconds before trying
+            time.sleep(policy.delay(attempt))
             continue
+        except BaseException:
+            # Interrupted before the host answered.
+            breaker.release()
+            raise
+        breaker.record_success()
+        if limiter is not None:
+            limiter.on_success(len(resp.content), time.monotonic()-start)
+        return resp
+
+def open_writer(file_name: str, segments: list[Segment], window: int = DEFAULT_WINDOW) -> SegmentWriter:
+    """Open the output file of a download, resuming it if possible.
+
+    If a manifest from an earlier run of the same playlist is found, the
+    segments it records are kept and the writer continues after them.
+    Otherwise a new file and manifest are started.
+
+    Parameters
+    ----------
+    file_name : str
+        Path of the ``.ts`` output file.
+    segments : list[Segment]
+        Segments of the playlist.
+    window : int, optional
+        Size of the sliding window of segments, by default DEFAULT_WINDOW
+
+    Returns
+    -------
+    SegmentWriter
+        Writer positioned at the first missing segment.
+    """
+    manifest = Manifest(file_name)
+    fingerprint = Manifest.fingerprint_of([segment.name for segment in segments])
+    if (manifest.load() and os.path.exists(file_name)
+            and manifest.segment_count == len(segments) and manifest.fingerprint == fingerprint):
+        start_index, offset = manifest.resume_point(os.path.getsize(file_name))
+        manifest.trim(start_index)
+        return SegmentWriter(file_name, window, manifest, start_index, offset)
+    manifest.start(len(segments), fingerprint)
+    return SegmentWriter(file_name, window, manifest)
+
+
+def repair_segments(file_name: str, segments: list[Segment], bad: dict[int, str], window: int = DEFAULT_WINDOW,
+                    priority: str = ratelimit.DEFAULT_PRIORITY) -> None:
+    """Download again the bad segments of an earlier run and replace them.
+
+    If the manifest belongs to another playlist, the segments can't be
+    matched, so the manifest is removed and the download starts over.
+
+    Parameters
+    ----------
+    file_name : str
+        Path of the ``.ts`` output file.
+    segments : list[Segment]
+        Segments of the playlist.
+    bad : dict[int, str]
+        Why every bad segment is bad, by index, see ``integrity.verify_file``.
+    window : int, optional
+        Maximum number of segments downloaded at once, by default
+        DEFAULT_WINDOW
+    priority : str, optional
+        Priority class of the download, by default
+        ratelimit.DEFAULT_PRIORITY
+
+    Raises
+    ------
+    SegmentError
+        If a segment can't be downloaded. The file is left as it was.
+    """
+    manifest = Manifest(file_name)
+    fingerprint = Manifest.fingerprint_of([segment.name for segment in segments])
+    if not manifest.load() or manifest.segment_count != len(segments) or manifest.fingerprint != fingerprint:
+        manifest.remove()
+        return
+    print(
+        '\033[91m', # Red foreground
+        '\033[40m', # Black background
+        f'Downloading again {len(bad)} bad segment(s) of {os.path.basename(file_name)}.',
+        '\033[0m'
+    )
+    budget = RetryBudget.for_segments(len(bad))
+
+    def fetch(index: int) -> bytes:
+        ratelimit.segments.acquire()
+        try:
+            return fetch_segment(segments[index], None, budget, priority)
+        finally:
+            ratelimit.segments.release()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(window, len(bad))) as executor:
+        futures = {index: executor.submit(fetch, index) for index in bad}
+        replacements = {index: future.result() for index, future in futures.items()}
+    integrity.replace_segments(file_name, replacements)
+
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_available() -> bool:
+    """Check whether FFmpeg is installed, looking it up only once.
+
+    Returns
+    -------
+    bool
+        True if ``ffmpeg`` is on the PATH.
+    """
+    return shutil.which('ffmpeg') is not None
+
+
+def can_stream_remux(file_name: str, stream_remux: bool = True) -> bool:
+    """Check whether a download can be piped straight into FFmpeg.
+
+    Parameters
+    ----------
+    file_name : str
+        File name, without extension.
+    stream_remux : bool, optional
+        Whether piping into FFmpeg is wanted, by default True
+
+    Returns
+    -------
+    bool
+        True if piping is wanted, FFmpeg is available and there is no partial
+        ``.ts`` download to resume.
+    """
+    return (stream_remux and ffmpeg_available()
+            and not os.path.exists(Manifest(file_name+'.ts').path))
+
+
+def is_downloaded(file_name: str) -> bool:
+    """Check whether a download has already been completed.
+
+    Parameters
+    ----------
+    file_name : str
+        File name, without extension.
+
+    Returns
+    -------
+    bool
+        True if every segment of the ``.ts`` file is on disk, or if the file
+        has already been converted to ``.mp4``.
+    """
+    manifest = Manifest(file_name+'.ts')
+    if not manifest.load():
+        return os.path.exists(file_name+'.mp4')
+    if not os.path.exists(file_name+'.ts'):
+        return False
+    count, _ = manifest.resume_point(os.path.getsize(file_name+'.ts'))
+    return count == manifest.segment_count
+
 
-def start_download(m3u8: str, file_name: str) -> None:
+def convert_to_mp4(file_name: str, on_remux: Callable[[], None] | None = None) -> None:
+    """Convert the downloaded ``.ts`` file to ``.mp4`` if FFmpeg is available.
+
+    The ``.ts`` file and its manifest are only removed if the conversion
+    succeeds.
+
+    Parameters
+    ----------
+    file_name : str
+        File name, without extension.
+    on_remux : Callable[[], None] | None, optional
+        Called when the conversion starts, by default None
+    """
+    if not ffmpeg_available() or not os.path.exists(file_name+'.ts'):
+        return
+    if on_remux is not None:
+        on_remux()
+    result = subprocess.run(['ffmpeg', '-y', '-i', f'{file_name}.ts', '-c', 'copy', '-bsf:a', 'aac_adtstoasc', f'{file_name}.mp4'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if result.returncode == 0:
+        os.remove(file_name+'.ts')
+        Manifest(file_name+'.ts').remove()
+
+
+def download_segments(segments: list[Segment], writer: SegmentWriter, window: int = DEFAULT_WINDOW,
+                      adaptive: bool = True, priority: str = ratelimit.DEFAULT_PRIORITY) -> None:
+    """Download segments into a writer using a pool of threads.
+
+    The writer is closed when the download ends, whether it succeeds or not.
+    Segments in flight and the bytes received also count against the limits
+    of ``utility.ratelimit``, which are shared by every running download.
+
+    Parameters
+    ----------
+    segments : list[Segment]
+        Segments of the playlist.
+    writer : SegmentWriter
+        Writer to hand the segments over to, starting at its next index.
+    window : int, optional
+        Size of the sliding window of segments, by default DEFAULT_WINDOW
+    adaptive : bool, optional
+        Adapt the number of segments downloaded at once to the measured
+        throughput and errors, up to ``window``, by default True
+    priority : str, optional
+        Priority class of the download, by default
+        ratelimit.DEFAULT_PRIORITY
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=window)
+    limiter = AdaptiveLimiter(window) if adaptive else None
+    budget = RetryBudget.for_segments(len(segments)-writer.next_index)
+    in_flight = {}
+    next_segment = writer.next_index
+    start, start_offset = time.monotonic(), writer.offset
+    try:
+        with tqdm(desc=os.path.basename(writer.file_name), total=len(segments), initial=writer.next_index,
+                  colour='green') as progress:
+            while writer.next_index < len(segments):
+                # The global segment budget is shared with the other running
+                # downloads. Wait for a slot only when nothing is in flight,
+                # otherwise keep writing the segments that come in.
+                while (next_segment < len(segments) and writer.can_accept(next_segment)
+                       and (limiter is None or len(in_flight) < limiter.limit)
+                       and (ratelimit.segments.try_acquire() or not in_flight and ratelimit.segments.acquire())):
+                    future = executor.submit(fetch_segment, segments[next_segment], limiter, budget, priority)
+                    future.add_done_callback(lambda _: ratelimit.segments.release())
+                    in_flight[future] = next_segment
+                    next_segment += 1
+                done, _ = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    writer.put(in_flight.pop(future), future.result())
+                    progress.update(1)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+    throughput.add((writer.offset-start_offset)/max(time.monotonic()-start, 1e-6))
+
+
+def start_download(m3u8: str, file_name: str, window: int = DEFAULT_WINDOW, adaptive: bool = True,
+                   quality: int | None = None, stream_remux: bool = False,
+                   on_remux: Callable[[], None] | None = None,
+                   priority: str = ratelimit.DEFAULT_PRIORITY) -> None:
     """Start download.
 
+    At most ``window`` segments are downloading or waiting to be written at
+    any time. Each segment is written to disk as soon as every segment before
+    it has been written, and recorded in a manifest next to the file, so an
+    interrupted download continues where it stopped when started again. If
+    ``integrity.verify_segments`` is set, the segments of an earlier run are
+    checked first, and the bad ones downloaded again.
+
     Parameters
     ----------
     m3u8 : str
         m3u8 file url.
     file_name : str
         File name.
+    window : int, optional
+        Size of the sliding window of segments, by default DEFAULT_WINDOW
+    adaptive : bool, optional
+        Adapt the number of segments downloaded at once to the measured
+        throughput and errors, up to ``window``, by default True
+    quality : int | None, optional
+        Highest video height to download if the m3u8 file is a master
+        playlist, by default None
+    stream_remux : bool, optional
+        Pipe the segments straight into FFmpeg, so the ``.mp4`` file is
+        written during the download instead of converting the ``.ts`` file
+        afterwards. Such a download can't be resumed. Ignored if FFmpeg isn't
+        available or a partial ``.ts`` download exists, by default False
+    on_remux : Callable[[], None] | None, optional
+        Called when the ``.ts`` file starts being converted, by default None
+    priority : str, optional
+        Priority class of the download, sharing the global bandwidth and
+        request rate limits with the other downloads in proportion to
+        ``ratelimit.PRIORITY_WEIGHTS``, by default ratelimit.DEFAULT_PRIORITY
+
+    Raises
+    ------
+    TokenExpiredError
+        If the hash of the stream is wrong or has expired.
+    SegmentError
+        If a segment can't be downloaded. The segments downloaded so far
+        are kept, and the download continues from there next time.
     """
-    segments = get_segments(m3u8)
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = executor.map(get_response, segments)
-        f = open(file_name+'.ts', 'wb')
-        try:
-            for future in tqdm(futures, desc='Progress', total=len(segments), colour='green'):
-                f.write(future.content)
-        except KeyboardInterrupt:
-            print(
-                '\033[91m', # Red foreground
-                '\033[40m', # Black background
-                'Download interrupted.',
-                '\033[0m'
-            )
-            exit()
-        f.close()
-        if os.environ.get('FFMPEG') == '1':
-            subprocess.run(f'ffmpeg -i "{file_name}.ts" -c copy -bsf:a aac_adtstoasc "{file_name}.mp4"', stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            os.remove(file_name+'.ts')
-    
+    bad = integrity.verify_file(file_name+'.ts') if integrity.verify_segments else {}
+    if not bad and is_downloaded(file_name):
+        convert_to_mp4(file_name, on_remux)
+        return
+    segments = get_segments(m3u8, quality)
+    try:
+        if bad:
+            repair_segments(file_name+'.ts', segments, bad, window, priority)
+        if not is_downloaded(file_name):
+            if can_stream_remux(file_name, stream_remux):
+                try:
+                    download_segments(segments, RemuxWriter(file_name, len(segments), window), window, adaptive,
+                                      priority)
+                    return
+                except RemuxError:
+                    print(
+                        '\033[91m', # Red foreground
+                        '\033[40m', # Black background
+                        'FFmpeg failed, downloading to a .ts file instead.',
+                        '\033[0m'
+                    )
+            download_segments(segments, open_writer(file_name+'.ts', segments, window), window, adaptive,
+                              priority)
+    except KeyboardInterrupt:
+        print(
+            '\033[91m', # Red foreground
+            '\033[40m', # Black background
+            'Download interrupted.',
+            '\033[0m'
+        )
+        exit()
+    convert_to_mp4(file_name, on_remux)
+
 if __name__ == '__main__':
     import os
     import time
     if not os.path.exists('test'): os.mkdir('test')
     os.chdir('test')
-    os.environ['FFMPEG'] = '1'
     m3u8 = 'https://no1.cocarruptoo.monster/aes/1Jj2XzAOd8cIi1E8vN74Jg/1671341126/storage3/shows/7767422-sex-education-2019/164745-S1-E1-1663047988/6758cc1616fcd728a373a2dcee522d45.mp4/index.m3u8'
-    start_download(m3u8, 'test')
\ No newline at end of file
+    start_download(m3u8, 'test')
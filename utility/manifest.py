@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+
+
+class Manifest:
+    """Sidecar file recording which segments of a download are on disk.
+
+    The manifest lives next to the output file as ``<file>.manifest``. Its
+    first line is a header describing the playlist, every following line
+    records one segment that has been written, with its byte offset and
+    length in the output file, and optionally its hash. Lines are only ever
+    appended, so a crash can lose at most the last record, and a later
+    record of a segment replaces the earlier one.
+
+    Attributes
+    ----------
+    path : str
+        Path of the manifest file.
+    segment_count : int
+        Number of segments in the playlist.
+    fingerprint : str
+        Fingerprint of the playlist the manifest belongs to.
+    segments : dict[int, tuple[int, int]]
+        Offset and length of every segment on disk, keyed by segment index.
+    hashes : dict[int, str]
+        Hash of the segments recorded with one, keyed by segment index.
+
+    Methods
+    -------
+    fingerprint_of(names: list[str]) -> str
+        Compute the fingerprint of a playlist.
+    load() -> bool
+        Load the manifest from disk.
+    start(segment_count: int, fingerprint: str) -> None
+        Start a new manifest, discarding any previous records.
+    add(index: int, offset: int, length: int, digest: str | None = None) -> None
+        Record a segment that has been written.
+    resume_point(file_size: int) -> tuple[int, int]
+        Get the number of leading segments on disk and where they end.
+    trim(count: int) -> None
+        Keep only the records of the first segments and rewrite the file.
+    is_complete() -> bool
+        Check whether every segment has been recorded.
+    close() -> None
+        Close the manifest file.
+    remove() -> None
+        Delete the manifest file.
+    """
+
+    def __init__(self, file_name: str):
+        self.path = file_name+'.manifest'
+        self.segment_count = 0
+        self.fingerprint = ''
+        self.segments: dict[int, tuple[int, int]] = {}
+        self.hashes: dict[int, str] = {}
+        self._file = None
+
+    @staticmethod
+    def fingerprint_of(names: list[str]) -> str:
+        """Compute the fingerprint of a playlist.
+
+        Parameters
+        ----------
+        names : list[str]
+            Names of the segments of the playlist. They must not contain
+            the access token, which changes every time the stream is
+            resolved again.
+
+        Returns
+        -------
+        str
+            Fingerprint of the playlist.
+        """
+        return hashlib.sha1('\n'.join(names).encode()).hexdigest()
+
+    def load(self) -> bool:
+        """Load the manifest from disk.
+
+        Returns
+        -------
+        bool
+            True if a manifest was found and read, False otherwise.
+        """
+        try:
+            with open(self.path) as f_manifest:
+                lines = f_manifest.read().splitlines()
+        except FileNotFoundError:
+            return False
+        try:
+            header = json.loads(lines[0])
+            self.segment_count = int(header['segments'])
+            self.fingerprint = header['fingerprint']
+        except (IndexError, KeyError, ValueError):
+            return False
+        self.segments = {}
+        self.hashes = {}
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+                self.segments[int(record['index'])] = (
+                    int(record['offset']), int(record['length']))
+                if 'hash' in record:
+                    self.hashes[int(record['index'])] = record['hash']
+                else:
+                    self.hashes.pop(int(record['index']), None)
+            except (KeyError, ValueError):
+                # A partially written last line after a crash.
+                break
+        return True
+
+    def start(self, segment_count: int, fingerprint: str) -> None:
+        """Start a new manifest, discarding any previous records.
+
+        Parameters
+        ----------
+        segment_count : int
+            Number of segments in the playlist.
+        fingerprint : str
+            Fingerprint of the playlist.
+        """
+        self.close()
+        self.segment_count = segment_count
+        self.fingerprint = fingerprint
+        self.segments = {}
+        self.hashes = {}
+        self._file = open(self.path, 'w')
+        self._write({'segments': segment_count, 'fingerprint': fingerprint})
+
+    def add(self, index: int, offset: int, length: int, digest: str | None = None) -> None:
+        """Record a segment that has been written.
+
+        Parameters
+        ----------
+        index : int
+            Index of the segment in the playlist.
+        offset : int
+            Offset of the segment in the output file.
+        length : int
+            Length of the segment in bytes.
+        digest : str | None, optional
+            Hash of the segment, by default None
+        """
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self.segments[index] = (offset, length)
+        record = {'index': index, 'offset': offset, 'length': length}
+        if digest is not None:
+            self.hashes[index] = digest
+            record['hash'] = digest
+        else:
+            self.hashes.pop(index, None)
+        self._write(record)
+
+    def resume_point(self, file_size: int) -> tuple[int, int]:
+        """Get the number of leading segments on disk and where they end.
+
+        Segments are only counted while they are recorded without gaps from
+        the first one and their bytes are actually present in the file.
+
+        Parameters
+        ----------
+        file_size : int
+            Current size of the output file.
+
+        Returns
+        -------
+        tuple[int, int]
+            Number of segments that can be kept and the offset at which the
+            next segment has to be written.
+        """
+        count, end = 0, 0
+        while count in self.segments:
+            offset, length = self.segments[count]
+            if offset != end or offset+length > file_size:
+                break
+            end = offset+length
+            count += 1
+        return count, end
+
+    def trim(self, count: int) -> None:
+        """Keep only the records of the first segments and rewrite the file.
+
+        Parameters
+        ----------
+        count : int
+            Number of leading segments to keep.
+        """
+        kept = {index: (*self.segments[index], self.hashes.get(index)) for index in range(count)}
+        self.start(self.segment_count, self.fingerprint)
+        for index, (offset, length, digest) in kept.items():
+            self.add(index, offset, length, digest)
+
+    def is_complete(self) -> bool:
+        """Check whether every segment has been recorded.
+
+        Returns
+        -------
+        bool
+            True if the download is complete.
+        """
+        return self.segment_count > 0 and all(
+            index in self.segments for index in range(self.segment_count))
+
+    def close(self) -> None:
+        """Close the manifest file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self) -> None:
+        """Delete the manifest file."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _write(self, record: dict) -> None:
+        self._file.write(json.dumps(record)+'\n')
+        self._file.flush()
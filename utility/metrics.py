@@ -0,0 +1,63 @@
+import threading
+
+
+class Metrics:
+    """Counters of events of interest, e.g. which path a lookup took.
+
+    Methods
+    -------
+    increment(name: str, value: int = 1) -> None
+        Add to a counter.
+    get(name: str) -> int
+        Get the value of a counter.
+    snapshot() -> dict[str, int]
+        Get the value of every counter.
+    """
+
+    def __init__(self):
+        self._counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: int = 1) -> None:
+        """Add to a counter.
+
+        Parameters
+        ----------
+        name : str
+            Name of the counter, dotted by area, e.g. ``player_config.http``.
+        value : int, optional
+            Amount to add, by default 1
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0)+value
+
+    def get(self, name: str) -> int:
+        """Get the value of a counter.
+
+        Parameters
+        ----------
+        name : str
+            Name of the counter.
+
+        Returns
+        -------
+        int
+            Value of the counter, 0 if it was never incremented.
+        """
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict[str, int]:
+        """Get the value of every counter.
+
+        Returns
+        -------
+        dict[str, int]
+            Copy of the counters, keyed by name.
+        """
+        with self._lock:
+            return dict(self._counters)
+
+
+# Counters of this process.
+metrics = Metrics()
@@ -0,0 +1,342 @@
+import threading
+import time
+
+# Priority classes of downloads and requests. Interactive downloads are the
+# ones a user waits for, batch downloads run in the background.
+PRIORITIES = ('interactive', 'batch')
+# Priority class of downloads and requests that don't give one.
+DEFAULT_PRIORITY = 'interactive'
+# Share of a limited rate every priority class is guaranteed, relative to
+# the other classes using it.
+PRIORITY_WEIGHTS = {'interactive': 4, 'batch': 1}
+# Seconds a priority class keeps its share after its last request.
+ACTIVE_WINDOW = 2
+
+
+class SegmentBudget:
+    """Limit on the number of segments in flight across every download.
+
+    A limit of 0 means no limit.
+
+    Attributes
+    ----------
+    limit : int
+        Maximum number of segments in flight.
+    in_flight : int
+        Number of segments in flight.
+
+    Methods
+    -------
+    acquire(timeout: float | None = None) -> bool
+        Take a slot, waiting until one is free.
+    try_acquire() -> bool
+        Take a slot if one is free.
+    release() -> None
+        Give a slot back.
+    """
+
+    def __init__(self, limit: int = 0):
+        self.limit = limit
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        """Take a slot, waiting until one is free.
+
+        Parameters
+        ----------
+        timeout : float | None, optional
+            Maximum time to wait in seconds, by default None
+
+        Returns
+        -------
+        bool
+            True if a slot was taken, False on timeout.
+        """
+        with self._condition:
+            if not self._condition.wait_for(self._has_slot, timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def try_acquire(self) -> bool:
+        """Take a slot if one is free.
+
+        Returns
+        -------
+        bool
+            True if a slot was taken.
+        """
+        with self._condition:
+            if not self._has_slot():
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self) -> None:
+        """Give a slot back."""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def set_limit(self, limit: int) -> None:
+        """Change the limit.
+
+        Parameters
+        ----------
+        limit : int
+            Maximum number of segments in flight, 0 for no limit.
+        """
+        with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
+
+    def _has_slot(self) -> bool:
+        return self.limit <= 0 or self.in_flight < self.limit
+
+
+class TokenBucket:
+    """Token bucket limiting the rate of a quantity, e.g. bytes per second.
+
+    Callers take tokens for what they have consumed and are told how long to
+    wait so that the average rate stays at ``rate``, while bursts of up to
+    ``capacity`` go through at once. A rate of 0 means no limit.
+
+    Attributes
+    ----------
+    rate : float
+        Tokens added per second.
+    capacity : float
+        Maximum number of tokens the bucket holds.
+
+    Methods
+    -------
+    reserve(amount: float) -> float
+        Take tokens and get the time to wait before using them.
+    consume(amount: float) -> None
+        Take tokens, sleeping until they are available.
+    """
+
+    def __init__(self, rate: float = 0, capacity: float | None = None):
+        self._lock = threading.Lock()
+        self.set_rate(rate, capacity)
+
+    def set_rate(self, rate: float, capacity: float | None = None) -> None:
+        """Change the rate.
+
+        Parameters
+        ----------
+        rate : float
+            Tokens added per second, 0 for no limit.
+        capacity : float | None, optional
+            Maximum number of tokens the bucket holds, by default one second
+            worth of tokens
+        """
+        with self._lock:
+            self.rate = rate
+            self.capacity = capacity if capacity is not None else rate
+            self._tokens = self.capacity
+            self._updated = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        """Take tokens and get the time to wait before using them.
+
+        The tokens may be borrowed from the future, in which case the bucket
+        goes negative and later callers wait for it to refill.
+
+        Parameters
+        ----------
+        amount : float
+            Number of tokens to take.
+
+        Returns
+        -------
+        float
+            Time to wait in seconds.
+        """
+        with self._lock:
+            if self.rate <= 0:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens+(now-self._updated)*self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens/self.rate)
+
+    def consume(self, amount: float) -> None:
+        """Take tokens, sleeping until they are available.
+
+        Parameters
+        ----------
+        amount : float
+            Number of tokens to take.
+        """
+        delay = self.reserve(amount)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class PriorityBucket:
+    """Token bucket whose rate is shared between priority classes.
+
+    Every priority class that took tokens in the last ``ACTIVE_WINDOW``
+    seconds is active, and gets a share of the rate in proportion to its
+    weight among the active classes. A class on its own gets the whole
+    rate, so batch downloads use all the bandwidth an idle interactive
+    download leaves, and get their share back as soon as it stops. Every
+    class has its own bucket of up to one second worth of its share.
+
+    A rate of 0 means no limit.
+
+    Attributes
+    ----------
+    rate : float
+        Tokens added per second, across every priority class.
+    weights : dict[str, float]
+        Weight of every priority class.
+
+    Methods
+    -------
+    set_rate(rate: float) -> None
+        Change the rate.
+    share(priority: str) -> float
+        Get the rate a priority class gets at the moment.
+    reserve(amount: float, priority: str = DEFAULT_PRIORITY) -> float
+        Take tokens and get the time to wait before using them.
+    consume(amount: float, priority: str = DEFAULT_PRIORITY) -> None
+        Take tokens, sleeping until they are available.
+    """
+
+    def __init__(self, rate: float = 0, weights: dict[str, float] | None = None):
+        self.rate = rate
+        self.weights = dict(weights if weights is not None else PRIORITY_WEIGHTS)
+        self._lock = threading.Lock()
+        # Buckets that were never used start full.
+        self._tokens = {priority: 0.0 for priority in self.weights}
+        self._updated = {priority: -float('inf') for priority in self.weights}
+        self._used = {priority: -float('inf') for priority in self.weights}
+
+    def set_rate(self, rate: float) -> None:
+        """Change the rate.
+
+        The tokens of every priority class, or the tokens it borrowed, are
+        scaled to the new rate, so changing the rate doesn't refill the
+        buckets. Buckets start full when the rate wasn't limited before.
+
+        Parameters
+        ----------
+        rate : float
+            Tokens added per second, 0 for no limit.
+        """
+        with self._lock:
+            if self.rate > 0 and rate > 0:
+                now = time.monotonic()
+                for priority in self.weights:
+                    if self._updated[priority] == -float('inf'):
+                        continue
+                    # Refill at the old rate up to now first.
+                    share = self._share(priority, now)
+                    tokens = min(share, self._tokens[priority]+(now-self._updated[priority])*share)
+                    self._tokens[priority] = tokens*rate/self.rate
+                    self._updated[priority] = now
+            else:
+                for priority in self.weights:
+                    self._tokens[priority] = 0.0
+                    self._updated[priority] = -float('inf')
+            self.rate = rate
+
+    def share(self, priority: str) -> float:
+        """Get the rate a priority class gets at the moment.
+
+        Parameters
+        ----------
+        priority : str
+            The priority class.
+
+        Returns
+        -------
+        float
+            Tokens per second, 0 if the rate isn't limited.
+        """
+        with self._lock:
+            return self._share(priority, time.monotonic())
+
+    def _share(self, priority: str, now: float) -> float:
+        active = [other for other in self.weights if now-self._used[other] < ACTIVE_WINDOW or other == priority]
+        return self.rate*self.weights[priority]/sum(self.weights[other] for other in active)
+
+    def reserve(self, amount: float, priority: str = DEFAULT_PRIORITY) -> float:
+        """Take tokens and get the time to wait before using them.
+
+        The tokens may be borrowed from the future of the priority class, in
+        which case its later callers wait for its bucket to refill.
+
+        Parameters
+        ----------
+        amount : float
+            Number of tokens to take.
+        priority : str, optional
+            Priority class of the caller, by default DEFAULT_PRIORITY
+
+        Returns
+        -------
+        float
+            Time to wait in seconds.
+
+        Raises
+        ------
+        ValueError
+            If the priority class is unknown.
+        """
+        if priority not in self.weights:
+            raise ValueError(f'Unknown priority: {priority}')
+        with self._lock:
+            if self.rate <= 0:
+                return 0.0
+            now = time.monotonic()
+            rate = self._share(priority, now)
+            self._used[priority] = now
+            self._tokens[priority] = min(rate, self._tokens[priority]+(now-self._updated[priority])*rate)
+            self._updated[priority] = now
+            self._tokens[priority] -= amount
+            return max(0.0, -self._tokens[priority]/rate)
+
+    def consume(self, amount: float, priority: str = DEFAULT_PRIORITY) -> None:
+        """Take tokens, sleeping until they are available.
+
+        Parameters
+        ----------
+        amount : float
+            Number of tokens to take.
+        priority : str, optional
+            Priority class of the caller, by default DEFAULT_PRIORITY
+        """
+        delay = self.reserve(amount, priority)
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Limits shared by every download and request of the process.
+segments = SegmentBudget()
+bandwidth = PriorityBucket()
+request_rate = PriorityBucket()
+
+
+def configure(max_segments: int = 0, max_bytes_per_second: float = 0, max_requests_per_second: float = 0) -> None:
+    """Configure the limits shared by every download and request of the process.
+
+    They can be changed at any time, e.g. while downloads are running.
+
+    Parameters
+    ----------
+    max_segments : int, optional
+        Maximum number of segments in flight, 0 for no limit, by default 0
+    max_bytes_per_second : float, optional
+        Maximum download rate, 0 for no limit, by default 0
+    max_requests_per_second : float, optional
+        Maximum number of requests sent per second, 0 for no limit, by
+        default 0
+    """
+    segments.set_limit(max_segments)
+    bandwidth.set_rate(max_bytes_per_second)
+    request_rate.set_rate(max_requests_per_second)
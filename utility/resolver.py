@@ -0,0 +1,148 @@
+import threading
+import time
+
+from utility.content import Episode, Movie, Series
+
+# Seconds before the expiry of the hash at which it is refreshed.
+REFRESH_MARGIN = 300
+# Least number of seconds between two refreshes of the hash, so that a hash
+# that lives shorter than the margin isn't refreshed in a loop.
+MIN_REFRESH_INTERVAL = 60
+
+
+class StreamResolver:
+    """Resolve the stream links of a movie or of episodes right before they are downloaded.
+
+    The hash and expiry that the links are resolved with are stored on the
+    content. The resolver refreshes them in a background thread shortly
+    before they expire, so links resolved late in a long series are still
+    valid, and refreshes them at once if a link is refused. Only the item
+    whose link failed is resolved again.
+
+    Attributes
+    ----------
+    content : Movie | Series
+        The content being downloaded.
+    quality : int
+        Quality of the m3u8 files.
+    refresh_margin : float
+        Seconds before the expiry at which the hash is refreshed.
+    generation : int
+        Number of times the hash has been refreshed.
+
+    Methods
+    -------
+    start() -> None
+        Start refreshing the hash in the background.
+    stop() -> None
+        Stop refreshing the hash in the background.
+    resolve(item: Movie | Episode, refresh: bool = False) -> None | tuple[bool, str]
+        Set the m3u8 link and subtitle of a movie or an episode.
+    refresh(generation: int | None = None) -> bool
+        Refresh the hash of the content.
+    expires_in() -> float
+        Get the number of seconds until the hash expires.
+    """
+
+    def __init__(self, content: Movie | Series, quality: int, refresh_margin: float = REFRESH_MARGIN):
+        self.content = content
+        self.quality = quality
+        self.refresh_margin = refresh_margin
+        # Tells whether a refused link was resolved with the current hash.
+        self.generation = 0
+        self._generations: dict[Movie | Episode, int] = {}
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """Start refreshing the hash in the background."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop refreshing the hash in the background."""
+        self._stopped.set()
+
+    def expires_in(self) -> float:
+        """Get the number of seconds until the hash expires.
+
+        Returns
+        -------
+        float
+            Seconds until the expiry, infinite if the expiry is unknown.
+        """
+        if not self.content.expiry:
+            return float('inf')
+        return self.content.expiry-time.time()
+
+    def refresh(self, generation: int | None = None) -> bool:
+        """Refresh the hash of the content.
+
+        Parameters
+        ----------
+        generation : int | None, optional
+            Generation of the hash that was found to be invalid. If the hash
+            has been refreshed since, it isn't refreshed again, by default None
+
+        Returns
+        -------
+        bool
+            True if the hash is fresh.
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return True
+            if not self.content.provider.refresh_hash(self.content):
+                return False
+            self.generation += 1
+            self._refreshed_at = time.monotonic()
+            return True
+
+    def resolve(self, item: Movie | Episode, refresh: bool = False) -> None | tuple[bool, str]:
+        """Set the m3u8 link and subtitle of a movie or an episode.
+
+        The hash is refreshed first if it is about to expire, or if
+        ``refresh`` is set and it hasn't been refreshed since the item was
+        last resolved.
+
+        Parameters
+        ----------
+        item : Movie | Episode
+            The movie, or an episode of the series.
+        refresh : bool, optional
+            The link of the item was refused, by default False
+
+        Returns
+        -------
+        None | tuple[bool, str]
+            None if the item was resolved, else False and the error message.
+        """
+        generation = self._generations.get(item, self.generation)
+        if refresh or self._expires_soon():
+            if not self.refresh(generation):
+                return (False, 'Could not refresh the hash')
+        self._generations[item] = self.generation
+        # The provider only replaces a link that is empty or of the wanted
+        # quality, so clear it to get a link with the new hash.
+        item.m3u8 = ''
+        if isinstance(item, Episode):
+            return self.content.provider.resolve_episode(self.content, item, self.quality)
+        return self.content.provider.set_m3u8_n_subtitle(self.content, self.quality)
+
+    def _expires_soon(self) -> bool:
+        return (self.expires_in() < self.refresh_margin
+                and time.monotonic()-self._refreshed_at >= MIN_REFRESH_INTERVAL)
+
+    def _refresh_loop(self) -> None:
+        while not self._stopped.is_set():
+            if not self._expires_soon():
+                # Check again later, the hash may also be refreshed meanwhile
+                # because a link was refused.
+                self._stopped.wait(min(max(self.expires_in()-self.refresh_margin, 1), MIN_REFRESH_INTERVAL))
+                continue
+            if not self.refresh(self.generation):
+                # Try again after the minimum interval.
+                self._refreshed_at = time.monotonic()
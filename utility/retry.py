@@ -0,0 +1,232 @@
+import random
+import threading
+import time
+
+# Seconds between two checks of a circuit whose trial request is in flight.
+TRIAL_POLL_INTERVAL = 1
+
+
+class TokenExpiredError(ValueError):
+    """Raised when the access token of a stream has expired or is invalid.
+
+    It is a ``ValueError`` so that callers that re-resolve the stream on a
+    wrong hash handle it the same way.
+    """
+
+
+class SegmentError(Exception):
+    """Raised when a segment can't be downloaded after retrying."""
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter.
+
+    Attributes
+    ----------
+    max_attempts : int
+        Number of attempts before giving up on a request.
+    base_delay : float
+        Delay before the first retry, in seconds.
+    max_delay : float
+        Upper limit of the delay between two attempts, in seconds.
+
+    Methods
+    -------
+    delay(attempt: int) -> float
+        Get the time to wait before the next attempt.
+    """
+
+    def __init__(self, max_attempts: int = 6, base_delay: float = 0.5, max_delay: float = 30):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        """Get the time to wait before the next attempt.
+
+        Parameters
+        ----------
+        attempt : int
+            Number of attempts made so far, starting at 1.
+
+        Returns
+        -------
+        float
+            Delay in seconds, picked at random up to the exponential bound so
+            that workers that failed together don't retry together.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay*2**(attempt-1)))
+
+
+class RetryBudget:
+    """Number of retries a single download may spend in total.
+
+    A few flaky segments are retried, but a download where most requests
+    fail gives up quickly instead of retrying every segment to the limit.
+
+    Attributes
+    ----------
+    remaining : int
+        Retries left.
+
+    Methods
+    -------
+    for_segments(count: int) -> RetryBudget
+        Create a budget proportional to the number of segments.
+    spend() -> bool
+        Take one retry from the budget.
+    """
+
+    # Retries allowed per segment, and the least a download gets.
+    ratio = 0.2
+    minimum = 50
+
+    def __init__(self, retries: int):
+        self.remaining = retries
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_segments(cls, count: int) -> 'RetryBudget':
+        """Create a budget proportional to the number of segments.
+
+        Parameters
+        ----------
+        count : int
+            Number of segments of the download.
+
+        Returns
+        -------
+        RetryBudget
+            The budget.
+        """
+        return cls(max(cls.minimum, int(count*cls.ratio)))
+
+    def spend(self) -> bool:
+        """Take one retry from the budget.
+
+        Returns
+        -------
+        bool
+            True if a retry was left, False if the budget is exhausted.
+        """
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+class CircuitBreaker:
+    """Stop sending requests to a host that keeps failing.
+
+    After ``failure_threshold`` failures in a row the circuit opens and every
+    request is refused for ``cooldown`` seconds. Then a single trial request
+    is let through: if it succeeds the circuit closes, otherwise it opens
+    again.
+
+    Attributes
+    ----------
+    failure_threshold : int
+        Number of failures in a row that open the circuit.
+    cooldown : float
+        Time the circuit stays open, in seconds.
+
+    Methods
+    -------
+    allow() -> bool
+        Check whether a request may be sent.
+    retry_after() -> float
+        Get the time left before the trial request may be sent.
+    release() -> None
+        Give up a request that was let through without an answer.
+    record_success() -> None
+        Record a successful request.
+    record_failure() -> None
+        Record a failed request.
+    """
+
+    def __init__(self, failure_threshold: int = 10, cooldown: float = 30):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Check whether a request may be sent.
+
+        Returns
+        -------
+        bool
+            True if the circuit is closed, or if this is the trial request
+            after the cooldown.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic()-self._opened_at < self.cooldown:
+                return False
+            self._trial = True
+            return True
+
+    def retry_after(self) -> float:
+        """Get the time left before the trial request may be sent.
+
+        Returns
+        -------
+        float
+            Seconds left of the cooldown, 0 if the circuit is closed or the
+            cooldown is over, in which case the trial request may already be
+            in flight.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self.cooldown-(time.monotonic()-self._opened_at))
+
+    def release(self) -> None:
+        """Give up a request that was let through without an answer.
+
+        Must be called when a request ends without being recorded, e.g.
+        when it is cancelled, otherwise a trial request would keep the
+        circuit open forever. Another request may then make the trial.
+        """
+        with self._lock:
+            self._trial = False
+
+    def record_success(self) -> None:
+        """Record a successful request."""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        """Record a failed request."""
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(host: str) -> CircuitBreaker:
+    """Get the circuit breaker of a host.
+
+    Parameters
+    ----------
+    host : str
+        Host name.
+
+    Returns
+    -------
+    CircuitBreaker
+        The circuit breaker shared by every request to the host.
+    """
+    with _breakers_lock:
+        return _breakers.setdefault(host, CircuitBreaker())
@@ -0,0 +1,146 @@
+import itertools
+import math
+import queue
+import threading
+from collections.abc import Callable
+from typing import Any
+
+from utility.config import DEFAULT_PARALLEL_DOWNLOADS
+
+
+class DownloadJob:
+    """Class for the jobs of a scheduler.
+
+    Attributes
+    ----------
+    name : str
+        Name of the job, e.g. the episode it downloads.
+    target : Callable[[], Any]
+        Function doing the work.
+    priority : int
+        Jobs with a lower priority start first.
+    result : Any
+        Value returned by ``target``, None if it failed or hasn't run.
+    error : BaseException | None
+        Exception raised by ``target``, None if it succeeded or hasn't run.
+    """
+
+    def __init__(self, name: str, target: Callable[[], Any], priority: int = 0):
+        self.name = name
+        self.target = target
+        self.priority = priority
+        self.result = None
+        self.error = None
+
+
+class DownloadScheduler:
+    """Run several downloads at the same time in priority order.
+
+    The jobs only decide which downloads run together. How many segments are
+    in flight and how fast they come in is limited across every running
+    download by the limits of ``utility.ratelimit``, so a download nearing
+    its end leaves its share of the bandwidth to the others.
+
+    Jobs can be added while the scheduler is running, e.g. as the links of
+    episodes are resolved. The workers are daemon threads, so an interrupted
+    program exits without waiting for the downloads still running.
+
+    Attributes
+    ----------
+    parallel : int
+        Maximum number of jobs running at the same time.
+    jobs : list[DownloadJob]
+        Jobs added to the scheduler.
+
+    Methods
+    -------
+    add(name: str, target: Callable[[], Any], priority: int = 0) -> DownloadJob
+        Add a job.
+    start() -> None
+        Start running jobs.
+    join() -> list[DownloadJob]
+        Wait for every job to finish once no more jobs will be added.
+    run() -> list[DownloadJob]
+        Run every job and wait for them to finish.
+    """
+
+    def __init__(self, parallel: int = DEFAULT_PARALLEL_DOWNLOADS):
+        if parallel < 1:
+            raise ValueError('parallel must be at least 1')
+        self.parallel = parallel
+        self.jobs: list[DownloadJob] = []
+        self._queue = queue.PriorityQueue()
+        self._workers: list[threading.Thread] = []
+        # Keeps jobs of the same priority in the order they were added.
+        self._counter = itertools.count()
+
+    def add(self, name: str, target: Callable[[], Any], priority: int = 0) -> DownloadJob:
+        """Add a job.
+
+        Parameters
+        ----------
+        name : str
+            Name of the job.
+        target : Callable[[], Any]
+            Function doing the work.
+        priority : int, optional
+            Jobs with a lower priority start first, by default 0
+
+        Returns
+        -------
+        DownloadJob
+            The job.
+        """
+        job = DownloadJob(name, target, priority)
+        self.jobs.append(job)
+        self._queue.put((priority, next(self._counter), job))
+        return job
+
+    def start(self) -> None:
+        """Start running jobs.
+
+        Jobs already added start at once, in priority order, and jobs added
+        later start as soon as a worker is free.
+        """
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(self.parallel)]
+        for worker in self._workers:
+            worker.start()
+
+    def join(self) -> list[DownloadJob]:
+        """Wait for every job to finish once no more jobs will be added.
+
+        An exception raised by a job doesn't stop the others, it is stored in
+        the ``error`` attribute of the job.
+
+        Returns
+        -------
+        list[DownloadJob]
+            The jobs, in the order they were added.
+        """
+        for _ in self._workers:
+            # Sorted after every job, so the workers stop once the queue is empty.
+            self._queue.put((math.inf, next(self._counter), None))
+        for worker in self._workers:
+            worker.join()
+        return self.jobs
+
+    def run(self) -> list[DownloadJob]:
+        """Run every job and wait for them to finish.
+
+        Returns
+        -------
+        list[DownloadJob]
+            The jobs, in the order they were added.
+        """
+        self.start()
+        return self.join()
+
+    def _work(self) -> None:
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                return
+            try:
+                job.result = job.target()
+            except Exception as e:
+                job.error = e
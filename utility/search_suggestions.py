@@ -1,18 +1,47 @@
-import json
+import asyncio
+import concurrent.futures
 
-import tmdbsimple as tmdb
+from prompt_toolkit.application import Application, get_app_or_none
 from prompt_toolkit.completion import Completer, Completion
 
-with open("Config.json") as config_file:
-    config = json.load(config_file)
+from utility import ratelimit
+from utility.cache import TTLCache
+from utility.content import get_tmdb
+from utility.title_index import normalize, title_index
 
-tmdb.API_KEY = config["TMDB_API_KEY"]
+# Seconds to wait after a keystroke before sending a request, so that fast
+# typing sends one request instead of one per key.
+DEBOUNCE_DELAY = 0.25
+# Number of suggestions shown.
+MAX_SUGGESTIONS = 10
+# Least number of suggestions from the title index for which TMDB isn't
+# asked for more.
+MIN_LOCAL_SUGGESTIONS = 5
 
 
 class SearchAutocompletor(Completer):
     """
     Autocompletes search box
+
+    Suggestions come from the local title index first. Only when it has
+    fewer than ``MIN_LOCAL_SUGGESTIONS`` matches, more are fetched from TMDB
+    asynchronously, once the input has been left unchanged for
+    ``DEBOUNCE_DELAY`` seconds, and cached by query. Their titles are added
+    to the index, so a query is rarely sent twice across sessions. A
+    query that extends a cached query whose results were complete is
+    answered by filtering those results, without a request. A request that a
+    newer keystroke has made useless is cancelled if it hasn't started, and
+    its results are never shown.
+
+    prompt_toolkit runs one completion at a time, so keystrokes made while
+    it waits don't start another one. Whether a query is still wanted is
+    told by comparing it with the text of the prompt.
     """
+    # Suggestions of recent queries, shared by every prompt.
+    cache = TTLCache(maxsize=256, ttl=600)
+    # Few workers, so requests can't pile up on a slow connection.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
     def get_completions(self, document, complete_event) -> Completion:
         """
         Yields suggestions for the search box.
@@ -23,21 +52,153 @@ class SearchAutocompletor(Completer):
             The document that is being edited.
         complete_event : prompt_toolkit.eventloop.Event
             The event that triggered this function.
-        
+
+        Yields
+        ------
+        prompt_toolkit.completion.Completion
+            The suggestions for the search box.
+        """
+        word = document.text
+        local = title_index.search(word, MAX_SUGGESTIONS)
+        if len(local) >= MIN_LOCAL_SUGGESTIONS:
+            yield from self._completions(word, local)
+            return
+        suggestions = self.lookup(word)
+        if suggestions is None:
+            try:
+                suggestions = self.fetch(word)
+            except Exception:
+                suggestions = []
+        yield from self._completions(word, self._merge(local, suggestions))
+
+    async def get_completions_async(self, document, complete_event):
+        """
+        Yields suggestions for the search box without blocking the prompt.
+
+        Parameters
+        ----------
+        document : prompt_toolkit.document.Document
+            The document that is being edited.
+        complete_event : prompt_toolkit.eventloop.Event
+            The event that triggered this function.
+
         Yields
         ------
         prompt_toolkit.completion.Completion
             The suggestions for the search box.
         """
         word = document.text
-        try:
-            result = tmdb.search.Search().multi(query=word, include_adult=True)
-            suggestions = []
-            for i in range(min(10, len(result["results"]))):
-                if result["results"][i]["media_type"] == "movie":
-                    suggestions.append(result["results"][i]["title"])
-                else:
-                    suggestions.append(result["results"][i]["name"])
-            yield from (Completion(suggestion, start_position=-len(word)) for suggestion in suggestions)
-        except:
-            pass
+        app = get_app_or_none()
+        local = title_index.search(word, MAX_SUGGESTIONS)
+        # Shown at once, TMDB only tops them up.
+        for completion in self._completions(word, local):
+            yield completion
+        if len(local) >= MIN_LOCAL_SUGGESTIONS:
+            return
+        suggestions = self.lookup(word)
+        if suggestions is None:
+            await asyncio.sleep(DEBOUNCE_DELAY)
+            if not self._is_current(app, word):
+                return
+            try:
+                suggestions = await asyncio.wrap_future(
+                    self.executor.submit(self._fetch_if_current, app, word))
+            except Exception:
+                return
+            if suggestions is None or not self._is_current(app, word):
+                # The input has changed, the results are only cached.
+                return
+        for completion in self._completions(word, self._merge(local, suggestions)[len(local):]):
+            yield completion
+
+    @classmethod
+    def lookup(cls, query: str) -> list[str] | None:
+        """Get the suggestions of a query from the cache.
+
+        Parameters
+        ----------
+        query : str
+            The search query.
+
+        Returns
+        -------
+        list[str] | None
+            The suggestions, None if a request is needed.
+        """
+        key = query.strip().lower()
+        if not key:
+            return []
+        entry = cls.cache.get(key)
+        if entry is not None:
+            return entry[0]
+        words = key.split()
+        for length in range(len(key)-1, 0, -1):
+            entry = cls.cache.get(key[:length])
+            if entry is None:
+                continue
+            suggestions, complete = entry
+            if not complete:
+                # The shorter query had more results than were received.
+                return None
+            suggestions = [suggestion for suggestion in suggestions
+                           if all(word in suggestion.lower() for word in words)]
+            # TMDB matches more loosely than this filter, so ask it when
+            # nothing is left.
+            return suggestions or None
+        return None
+
+    @classmethod
+    def fetch(cls, query: str) -> list[str]:
+        """Get the suggestions of a query from TMDB and cache them.
+
+        Parameters
+        ----------
+        query : str
+            The search query.
+
+        Returns
+        -------
+        list[str]
+            Titles and names found.
+        """
+        tmdb = get_tmdb()
+        ratelimit.request_rate.consume(1)
+        result = tmdb.search.Search().multi(query=query, include_adult=True)
+        suggestions = []
+        for item in result["results"]:
+            if item["media_type"] == "movie":
+                suggestions.append(item["title"])
+            else:
+                suggestions.append(item["name"])
+            title_index.add(suggestions[-1], item.get("popularity") or 0.0)
+        # Only a query with every result on the first page can be used to
+        # answer longer queries.
+        complete = result.get("total_results", 0) <= len(result["results"])
+        cls.cache.set(query.strip().lower(), (suggestions, complete))
+        return suggestions
+
+    @staticmethod
+    def _is_current(app: Application | None, word: str) -> bool:
+        # The text of the prompt is still the query, always without a prompt.
+        return app is None or app.current_buffer.document.text == word
+
+    def _fetch_if_current(self, app: Application | None, query: str) -> list[str] | None:
+        if not self._is_current(app, query):
+            # A newer keystroke came in while the request was queued.
+            return None
+        return self.fetch(query)
+
+    @staticmethod
+    def _merge(local: list[str], suggestions: list[str]) -> list[str]:
+        # The local suggestions first, then those of TMDB that aren't among them.
+        seen = {normalize(title) for title in local}
+        merged = list(local)
+        for suggestion in suggestions:
+            if normalize(suggestion) not in seen:
+                seen.add(normalize(suggestion))
+                merged.append(suggestion)
+        return merged[:MAX_SUGGESTIONS]
+
+    @staticmethod
+    def _completions(word: str, suggestions: list[str]) -> list[Completion]:
+        return [Completion(suggestion, start_position=-len(word)) for suggestion in suggestions[:MAX_SUGGESTIONS]]
@@ -0,0 +1,76 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utility import ratelimit
+from utility.config import DEFAULT_RETRIES, DEFAULT_TIMEOUT
+
+# Number of keep-alive connections kept open to every host.
+DEFAULT_POOL_SIZE = 16
+
+timeout = DEFAULT_TIMEOUT
+
+session = requests.Session()
+
+
+def configure(pool_size: int = DEFAULT_POOL_SIZE, request_timeout: float = DEFAULT_TIMEOUT,
+              retries: int = DEFAULT_RETRIES) -> None:
+    """Configure the shared session.
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        Number of keep-alive connections kept open to every host. It should
+        be at least the number of segments downloaded at once, otherwise
+        connections are thrown away and opened again, by default
+        DEFAULT_POOL_SIZE
+    request_timeout : float, optional
+        Timeout of every request in seconds, by default DEFAULT_TIMEOUT
+    retries : int, optional
+        Number of retries on connection errors and server errors, by default
+        DEFAULT_RETRIES
+    """
+    global timeout
+    timeout = request_timeout
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(500, 502, 504),
+        allowed_methods=frozenset(['GET']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+
+def get(url: str, priority: str | None = ratelimit.DEFAULT_PRIORITY, **kwargs) -> requests.Response:
+    """Send a GET request through the shared session.
+
+    Waits first as long as the request rate limit of ``utility.ratelimit``
+    requires. The bytes received count against its bandwidth limit only
+    where the caller takes them, as for segments and subtitles.
+
+    Parameters
+    ----------
+    url : str
+        Url to request.
+    priority : str | None, optional
+        Priority class of the request, None if the caller already waited
+        for the request rate limit, by default ratelimit.DEFAULT_PRIORITY
+    **kwargs
+        Keyword arguments passed to ``requests.Session.get``. The configured
+        timeout is used unless ``timeout`` is given.
+
+    Returns
+    -------
+    requests.Response
+        Response.
+    """
+    kwargs.setdefault('timeout', timeout)
+    if priority is not None:
+        ratelimit.request_rate.consume(1, priority)
+    return session.get(url, **kwargs)
+
+
+configure()
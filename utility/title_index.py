@@ -0,0 +1,268 @@
+import atexit
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+
+# Default path of the title index.
+DEFAULT_INDEX_PATH = os.path.join('.cache', 'titles.json')
+# Least share of the trigrams of a query a title must contain to be
+# suggested. Below 1 so that titles with a typo in the query still match.
+MIN_SIMILARITY = 0.5
+# Bonus of titles starting with the query, which is usually being typed.
+PREFIX_BONUS = 0.5
+# Weight of the popularity, on a log scale, in the score of a title.
+POPULARITY_WEIGHT = 0.05
+# Maximum number of postings counted for a query. The trigrams shared by
+# the most titles are skipped once it is reached, and only checked on the
+# best candidates. If even the rarest trigram has more titles, only the
+# first are counted, which are the most popular ones of an export.
+MAX_SCANNED_POSTINGS = 4000
+# Maximum number of candidates scored for a query.
+MAX_CANDIDATES = 50
+
+
+def normalize(title: str) -> str:
+    """Normalize a title for matching.
+
+    Parameters
+    ----------
+    title : str
+        The title.
+
+    Returns
+    -------
+    str
+        The title in lower case, without accents and with every run of
+        punctuation and white space replaced with a single space.
+    """
+    title = unicodedata.normalize('NFKD', title)
+    title = ''.join(char for char in title if not unicodedata.combining(char))
+    return ' '.join(re.sub(r'[\W_]+', ' ', title.lower()).split())
+
+
+def trigrams(text: str) -> set[str]:
+    """Get the trigrams of a padded text.
+
+    Parameters
+    ----------
+    text : str
+        Normalized text, padded with two spaces in front so that its first
+        letters form trigrams of their own.
+
+    Returns
+    -------
+    set[str]
+        The trigrams.
+    """
+    return {text[i:i+3] for i in range(len(text)-2)}
+
+
+class TitleIndex:
+    """Trigram index of movie and series titles, for suggestions without the network.
+
+    Titles are added from search results and can be bulk-loaded from a TMDB
+    export. Queries are matched by the trigrams they share with the titles,
+    so a typo only costs a few trigrams, and results are ranked by that
+    share, a bonus for titles starting with the query and their popularity.
+
+    Attributes
+    ----------
+    path : str
+        Path of the file the index is saved to.
+
+    Methods
+    -------
+    add(title: str, popularity: float = 0.0) -> None
+        Add a title, or raise its popularity if it is already indexed.
+    search(query: str, limit: int = 10) -> list[str]
+        Get the titles best matching a query.
+    load_tmdb_export(path: str) -> int
+        Add the titles of a TMDB daily export file.
+    load() -> None
+        Load the saved index, if it isn't loaded yet.
+    save() -> None
+        Save the index if it has changed.
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        self.path = path
+        self._titles: list[str] = []
+        self._padded: list[str] = []
+        self._popularity: list[float] = []
+        self._ids: dict[str, int] = {}
+        self._postings: dict[str, array] = {}
+        self._loaded = False
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        self.load()
+        return len(self._titles)
+
+    def add(self, title: str, popularity: float = 0.0) -> None:
+        """Add a title, or raise its popularity if it is already indexed.
+
+        Parameters
+        ----------
+        title : str
+            The title.
+        popularity : float, optional
+            Popularity of the title, e.g. from TMDB, by default 0.0
+        """
+        self.load()
+        with self._lock:
+            self._add(title, popularity)
+
+    def search(self, query: str, limit: int = 10) -> list[str]:
+        """Get the titles best matching a query.
+
+        Parameters
+        ----------
+        query : str
+            The query, possibly unfinished or misspelled.
+        limit : int, optional
+            Maximum number of titles, by default 10
+
+        Returns
+        -------
+        list[str]
+            The titles, best match first.
+        """
+        self.load()
+        norm = normalize(query)
+        if not norm:
+            return []
+        # No space after the query, its last word may be unfinished.
+        grams = trigrams('  '+norm)
+        with self._lock:
+            counts = Counter()
+            budget = MAX_SCANNED_POSTINGS
+            for posting in sorted((self._postings.get(gram, ()) for gram in grams), key=len):
+                if len(posting) > budget:
+                    if counts:
+                        break
+                    posting = posting[:budget]
+                budget -= len(posting)
+                counts.update(posting)
+            scored = []
+            for id, _ in counts.most_common(MAX_CANDIDATES):
+                padded = self._padded[id]
+                # Also counts the trigrams skipped above.
+                similarity = sum(gram in padded for gram in grams)/len(grams)
+                if similarity < MIN_SIMILARITY:
+                    continue
+                score = (similarity+(PREFIX_BONUS if padded.startswith('  '+norm) else 0)
+                         + POPULARITY_WEIGHT*math.log1p(self._popularity[id]))
+                # Ties go to the title added first, the most popular of an export.
+                scored.append((score, -id))
+            return [self._titles[-negative_id] for _, negative_id in heapq.nlargest(limit, scored)]
+
+    def load_tmdb_export(self, path: str) -> int:
+        """Add the titles of a TMDB daily export file.
+
+        The files are JSON lines, optionally gzipped, with an
+        ``original_title`` (movies) or ``original_name`` (series) and a
+        ``popularity`` on every line. Adult titles are skipped. Titles are
+        added most popular first, which is the order short queries scan them.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file.
+
+        Returns
+        -------
+        int
+            Number of titles read.
+        """
+        self.load()
+        entries = []
+        with (gzip.open if path.endswith('.gz') else open)(path, 'rt', encoding='utf-8') as f_export:
+            for line in f_export:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue
+                title = item.get('original_title') or item.get('original_name')
+                if title and not item.get('adult'):
+                    entries.append((float(item.get('popularity') or 0), title))
+        entries.sort(reverse=True)
+        with self._lock:
+            for popularity, title in entries:
+                self._add(title, popularity)
+        return len(entries)
+
+    def save(self) -> None:
+        """Save the index if it has changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path+'.tmp', 'w', encoding='utf-8') as f_index:
+                json.dump([[title, popularity] for title, popularity in zip(self._titles, self._popularity)],
+                          f_index, ensure_ascii=False)
+            os.replace(self.path+'.tmp', self.path)
+            self._dirty = False
+
+    def load(self) -> None:
+        """Load the saved index, if it isn't loaded yet.
+
+        The index is loaded on first use, this allows loading it in the
+        background beforehand.
+        """
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                with open(self.path, encoding='utf-8') as f_index:
+                    entries = json.load(f_index)
+            except (OSError, ValueError):
+                entries = []
+            for title, popularity in entries:
+                self._add(title, popularity)
+            self._dirty = False
+            self._loaded = True
+
+    def _add(self, title: str, popularity: float) -> None:
+        norm = normalize(title)
+        if not norm:
+            return
+        self._dirty = True
+        id = self._ids.get(norm)
+        if id is not None:
+            self._popularity[id] = max(self._popularity[id], popularity)
+            return
+        id = len(self._titles)
+        self._ids[norm] = id
+        self._titles.append(title)
+        self._popularity.append(popularity)
+        padded = '  '+norm+' '
+        self._padded.append(padded)
+        for gram in trigrams(padded):
+            posting = self._postings.get(gram)
+            if posting is None:
+                posting = self._postings[gram] = array('i')
+            posting.append(id)
+
+
+# Index of the titles seen by this installation.
+title_index = TitleIndex()
+atexit.register(title_index.save)
+
+
+if __name__ == '__main__':
+    import sys
+    for path in sys.argv[1:]:
+        print(f'{title_index.load_tmdb_export(path)} titles read from {path}')
+    title_index.save()
+    print(f'{len(title_index)} titles indexed')